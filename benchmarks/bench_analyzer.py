@@ -0,0 +1,169 @@
+"""
+AI 分析串流效能測試（使用本機假 Ollama 伺服器，不需要真的模型）
+- 同時進行多個串流分析時的總耗時與 event loop 最大延遲：
+  舊版在 async generator 中迭代同步 requests 串流，每讀一個 token 都阻塞 event loop
+- 連續分析時開啟的 TCP 連線數（連線池 keep-alive 應只需少數幾條）
+- 用戶端中途停止時，假伺服器是否立即看到串流中斷
+
+用法：python benchmarks/bench_analyzer.py [--concurrency 4] [--tokens 100] [--token-delay 0.01]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "tests"))
+
+from analyzer import AIAnalyzer  # noqa: E402
+from fake_ollama import FakeOllama  # noqa: E402
+
+DEVICES = [
+    {"ip": f"192.168.1.{i}", "mac": f"aa:bb:cc:dd:ee:{i:02x}", "vendor": "Apple, Inc.", "hostname": None, "ports": []}
+    for i in range(1, 30)
+]
+
+
+def legacy_stream(api_url, device_list):
+    """舊版實作：同步 requests，每次呼叫建立新連線"""
+    payload = {"model": "fake", "prompt": json.dumps(device_list, indent=2), "stream": True}
+    response = requests.post(api_url, json=payload, stream=True, timeout=180)
+    for line in response.iter_lines():
+        if line:
+            chunk = json.loads(line)
+            if chunk.get("response"):
+                yield {"response": chunk["response"]}
+            if chunk.get("done"):
+                break
+
+
+async def lag_monitor(stop, interval=0.005):
+    """量測 event loop 延遲：預期每 interval 醒來一次，回傳最大延遲（毫秒）"""
+    worst = 0.0
+    while not stop.is_set():
+        t = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - t - interval)
+    return worst * 1000
+
+
+async def run_concurrent(server, concurrency, legacy):
+    analyzer = AIAnalyzer(model="fake", host=server.url)
+    first_tokens = []
+
+    async def one():
+        started = time.perf_counter()
+        first = None
+        if legacy:
+            # 與舊版 app.py 相同：在 async generator 中迭代同步 generator
+            for chunk in legacy_stream(analyzer.api_url, DEVICES):
+                first = first or time.perf_counter()
+        else:
+            async for chunk in analyzer.analyze_network_astream(DEVICES):
+                if "response" in chunk:
+                    first = first or time.perf_counter()
+        first_tokens.append((first - started) * 1000)
+
+    connections = server.connections
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(lag_monitor(stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    lag = await monitor
+    await analyzer.aclose()
+    return {
+        "elapsed_s": elapsed,
+        "max_loop_lag_ms": lag,
+        "worst_first_token_ms": max(first_tokens),
+        "connections": server.connections - connections,
+    }
+
+
+async def connection_reuse(server, runs):
+    analyzer = AIAnalyzer(model="fake", host=server.url)
+    connections = server.connections
+    for _ in range(runs):
+        async for _ in analyzer.analyze_network_astream(DEVICES):
+            pass
+    await analyzer.aclose()
+    return server.connections - connections
+
+
+async def cancellation(server):
+    """讀幾個 token 後停止，回傳伺服器看到中斷所花的毫秒數"""
+    analyzer = AIAnalyzer(model="fake", host=server.url)
+    aborted = server.stats["aborted"]
+    stream = analyzer.analyze_network_astream(DEVICES)
+    count = 0
+    async for chunk in stream:
+        count += "response" in chunk
+        if count == 3:
+            break
+    stopped = time.perf_counter()
+    await stream.aclose()
+    while server.stats["aborted"] == aborted and time.perf_counter() - stopped < 5:
+        await asyncio.sleep(0.005)
+    await analyzer.aclose()
+    return (time.perf_counter() - stopped) * 1000 if server.stats["aborted"] > aborted else None
+
+
+def sync_cancellation(server):
+    """同步包裝版本提早 break 時，背景串流是否一併取消"""
+    analyzer = AIAnalyzer(model="fake", host=server.url)
+    aborted = server.stats["aborted"]
+    for i, _ in enumerate(analyzer.analyze_network_stream(DEVICES)):
+        if i == 3:
+            break
+    deadline = time.perf_counter() + 5
+    while server.stats["aborted"] == aborted and time.perf_counter() < deadline:
+        time.sleep(0.005)
+    return server.stats["aborted"] > aborted
+
+
+def run(concurrency=4, tokens=100, token_delay=0.01):
+    """
+    執行全部測試
+    :return: {"legacy": {...}, "async": {...}, "sequential_connections", "async_abort_ms", "sync_break_cancels"}
+    """
+    results = {}
+    with FakeOllama(tokens=tokens, token_delay=token_delay) as server:
+        for name, legacy in (("legacy", True), ("async", False)):
+            results[name] = asyncio.run(run_concurrent(server, concurrency, legacy))
+        results["sequential_connections"] = asyncio.run(connection_reuse(server, 10))
+        results["async_abort_ms"] = asyncio.run(cancellation(server))
+        results["sync_break_cancels"] = sync_cancellation(server)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=4, help="同時進行的分析數")
+    parser.add_argument("--tokens", type=int, default=100, help="每次回應的 token 數")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="token 之間的間隔秒數")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    results = run(args.concurrency, args.tokens, args.token_delay)
+    print(f"{args.concurrency} concurrent analyses × {args.tokens} tokens @ {args.token_delay * 1000:.0f} ms")
+    for name in ("legacy", "async"):
+        r = results[name]
+        print(f"{name:7s} total {r['elapsed_s']:6.2f} s  worst first token {r['worst_first_token_ms']:8.1f} ms  "
+              f"max loop lag {r['max_loop_lag_ms']:8.1f} ms  connections {r['connections']}")
+    print(f"connections for 10 sequential analyses: {results['sequential_connections']}")
+    abort_ms = results["async_abort_ms"]
+    print(f"server saw async stream abort after: {abort_ms:.1f} ms" if abort_ms is not None
+          else "server never saw the async stream abort")
+    print(f"sync wrapper break cancels stream: {results['sync_break_cancels']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+API 延遲負載測試
+在子行程啟動 uvicorn，主行程以多個用戶端持續請求掃描歷史，同時伺服器背景不斷儲存掃描，比較 API 延遲：
+- blocking：async handler 直接呼叫 Database（舊寫法，sqlite3 在 event loop 上執行）
+- async：透過 AsyncDatabase（讀取執行緒池 + 批次寫入執行緒）
+
+每種模式各量測「沒有寫入」與「持續寫入」兩種情況，寫入期間 p99 應維持平穩。
+用戶端與伺服器在不同行程，event loop 被阻塞時請求會在 socket 中等待，延遲如實反映在結果中。
+
+用法：python benchmarks/bench_api_latency.py [--clients 5] [--duration 5] [--devices 1000]
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import random
+import socket
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_database import fake_devices  # noqa: E402
+from database import Database  # noqa: E402
+
+
+def serve(db_path, port, mode, devices, write_interval):
+    """子行程：只含歷史查詢的 app，背景依 write_interval 儲存掃描（devices 為空時不寫入）"""
+    import uvicorn
+    from fastapi import FastAPI
+
+    from repository import AsyncDatabase
+
+    logging.disable(logging.INFO)
+    db = Database(db_path)
+    adb = AsyncDatabase(db) if mode == "async" else None
+
+    async def writer():
+        while True:
+            if adb is None:
+                db.save_scan(devices, "192.168.1.0/24", deep_scan=True)
+            else:
+                await adb.save_scan(devices, "192.168.1.0/24", deep_scan=True)
+            await asyncio.sleep(write_interval)
+
+    async def lifespan(app):
+        task = asyncio.create_task(writer()) if devices else None
+        yield
+        if task:
+            task.cancel()
+
+    app = FastAPI(lifespan=lifespan)
+
+    if adb is None:
+        @app.get("/api/history")
+        async def get_history(limit: int = 20):
+            return {"history": db.get_scan_history(limit)}
+    else:
+        @app.get("/api/history")
+        async def get_history(limit: int = 20):
+            return {"history": await adb.get_scan_history(limit)}
+
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def client(http, deadline, think_time, latencies):
+    while time.monotonic() < deadline:
+        t = time.perf_counter()
+        response = await http.get("/api/history")
+        response.raise_for_status()
+        latencies.append((time.perf_counter() - t) * 1000)
+        await asyncio.sleep(think_time)
+
+
+async def load(port, clients, duration, think_time):
+    limits = httpx.Limits(max_connections=clients)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits) as http:
+        # 等待伺服器就緒
+        for _ in range(100):
+            try:
+                await http.get("/api/history")
+                break
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+        latencies = []
+        deadline = time.monotonic() + duration
+        await asyncio.gather(*(client(http, deadline, think_time, latencies) for _ in range(clients)))
+    return latencies
+
+
+def measure(db_path, mode, devices, args):
+    port = free_port()
+    server = multiprocessing.Process(
+        target=serve, args=(db_path, port, mode, devices, args.write_interval), daemon=True
+    )
+    server.start()
+    try:
+        latencies = sorted(asyncio.run(load(port, args.clients, args.duration, args.think_time)))
+    finally:
+        server.terminate()
+        server.join()
+    return {
+        "requests": len(latencies),
+        "p50_ms": statistics.median(latencies),
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1],
+        "max_ms": latencies[-1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=5, help="同時請求的用戶端數")
+    parser.add_argument("--duration", type=float, default=5, help="每種情況量測秒數")
+    parser.add_argument("--devices", type=int, default=1000, help="每筆寫入掃描的裝置數")
+    parser.add_argument("--write-interval", type=float, default=0.2, help="兩次寫入之間的間隔秒數")
+    parser.add_argument("--think-time", type=float, default=0.05, help="每個用戶端兩次請求之間的間隔秒數")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    devices = fake_devices(args.devices, random.Random(1))
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "bench.db"
+        db = Database(db_path)
+        for _ in range(200):
+            db.save_scan(devices, "192.168.1.0/24", deep_scan=True)
+        db.close()
+
+        results = {}
+        for mode in ("blocking", "async"):
+            for label, writes in (("idle", []), ("writing", devices)):
+                results[f"{mode}/{label}"] = measure(db_path, mode, writes, args)
+
+    print(f"{args.clients} clients, writes of {args.devices} devices every {args.write_interval}s")
+    for name, r in results.items():
+        print(f"{name:18s} {r['requests']:6d} req  p50 {r['p50_ms']:7.2f} ms  p99 {r['p99_ms']:7.2f} ms  "
+              f"max {r['max_ms']:7.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+資料庫效能測試
+比較舊版（每次呼叫重新連線、逐筆 INSERT、無索引）與目前 Database 的：
+- 掃描寫入速度（scans/s 與 devices/s）
+- 歷史累積到 N 筆掃描後，get_scan_details 的查詢延遲
+- 資料庫檔案大小
+
+用法：python benchmarks/bench_database.py [--scans 10000] [--devices 20]
+"""
+
+import argparse
+import json
+import logging
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from database import Database  # noqa: E402
+
+
+def fake_devices(count, rng):
+    """產生模擬網路的基準裝置列表"""
+    devices = []
+    for i in range(count):
+        ports = [{"port": p, "service": "X"} for p in (22, 80, 443) if rng.random() < 0.3]
+        devices.append({
+            "ip": f"192.168.1.{i + 1}",
+            "mac": f"aa:bb:cc:00:{i // 256:02x}:{i % 256:02x}",
+            "vendor": rng.choice(["Apple, Inc.", "Intel Corporate", "TP-LINK"]),
+            "hostname": rng.choice([None, f"host-{i}"]),
+            "ports": ports,
+        })
+    return devices
+
+
+def drift(devices, rng, rate=0.02):
+    """模擬兩次掃描之間的變化：少數裝置離線、換 IP 或開關埠"""
+    result = []
+    for d in devices:
+        if rng.random() < rate:
+            continue
+        d = dict(d)
+        if rng.random() < rate:
+            d["ip"] = f"192.168.2.{rng.randint(1, 254)}"
+        if rng.random() < rate:
+            d["ports"] = d["ports"] + [{"port": 3389, "service": "RDP"}]
+        result.append(d)
+    return result
+
+
+class LegacyDatabase:
+    """舊版寫法：每次呼叫都重新連線、逐筆 INSERT、沒有索引"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        with sqlite3.connect(db_path) as conn:
+            conn.execute("""CREATE TABLE scans (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                scan_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP, device_count INTEGER,
+                subnet TEXT, deep_scan INTEGER DEFAULT 0)""")
+            conn.execute("""CREATE TABLE devices (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                scan_id INTEGER, ip TEXT, mac TEXT, vendor TEXT, hostname TEXT, open_ports TEXT)""")
+
+    def save_scan(self, devices, subnet, deep_scan=False):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("INSERT INTO scans (device_count, subnet, deep_scan) VALUES (?, ?, ?)",
+                           (len(devices), subnet, 1 if deep_scan else 0))
+            scan_id = cursor.lastrowid
+            for d in devices:
+                cursor.execute(
+                    "INSERT INTO devices (scan_id, ip, mac, vendor, hostname, open_ports) VALUES (?, ?, ?, ?, ?, ?)",
+                    (scan_id, d["ip"], d["mac"], d["vendor"], d["hostname"], json.dumps(d["ports"])))
+            conn.commit()
+            return scan_id
+
+    def get_scan_details(self, scan_id):
+        with sqlite3.connect(self.db_path) as conn:
+            conn.row_factory = sqlite3.Row
+            scan = conn.execute("SELECT * FROM scans WHERE id = ?", (scan_id,)).fetchone()
+            rows = conn.execute("SELECT ip, mac, vendor, hostname, open_ports FROM devices WHERE scan_id = ?",
+                                (scan_id,)).fetchall()
+            info = dict(scan)
+            info["devices"] = [dict(r) for r in rows]
+            return info
+
+
+def db_size_mb(db_path):
+    """資料庫檔案大小（先把 WAL 寫回主檔）"""
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return sum(p.stat().st_size for p in db_path.parent.glob(db_path.name + "*")) / 1024 / 1024
+
+
+def run(db, scans, devices_per_scan, queries, rng):
+    """寫入 scans 筆掃描後隨機查詢 queries 次，回傳統計結果"""
+    base = fake_devices(devices_per_scan, rng)
+    batches = [drift(base, rng) for _ in range(20)]
+
+    start = time.perf_counter()
+    ids = [db.save_scan(batches[i % len(batches)], "192.168.1.0/24", deep_scan=True) for i in range(scans)]
+    insert_time = time.perf_counter() - start
+
+    latencies = []
+    for scan_id in rng.sample(ids, min(queries, len(ids))):
+        t = time.perf_counter()
+        db.get_scan_details(scan_id)
+        latencies.append((time.perf_counter() - t) * 1000)
+    latencies.sort()
+
+    return {
+        "scans_per_sec": scans / insert_time,
+        "devices_per_sec": scans * devices_per_scan / insert_time,
+        "detail_p50_ms": statistics.median(latencies),
+        "detail_p99_ms": latencies[int(len(latencies) * 0.99) - 1],
+        "size_mb": db_size_mb(Path(db.db_path)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scans", type=int, default=10000, help="寫入的掃描筆數")
+    parser.add_argument("--devices", type=int, default=20, help="每筆掃描的裝置數")
+    parser.add_argument("--queries", type=int, default=200, help="詳細查詢次數")
+    parser.add_argument("--skip-legacy", action="store_true", help="不執行舊版對照組")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        if not args.skip_legacy:
+            results["legacy"] = run(LegacyDatabase(Path(tmp) / "legacy.db"), args.scans, args.devices,
+                                    args.queries, random.Random(1))
+        results["current"] = run(Database(Path(tmp) / "current.db"), args.scans, args.devices,
+                                 args.queries, random.Random(1))
+
+    print(f"{args.scans} scans × {args.devices} devices")
+    for name, r in results.items():
+        print(f"{name:8s} insert {r['scans_per_sec']:8.0f} scans/s ({r['devices_per_sec']:9.0f} devices/s)  "
+              f"detail p50 {r['detail_p50_ms']:7.3f} ms  p99 {r['detail_p99_ms']:7.3f} ms  "
+              f"size {r['size_mb']:6.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+掃描歷史匯出測試
+累積 N 筆掃描後，量測各格式串流匯出的：
+- 輸出速度（列/秒、MB/秒）
+- Python 記憶體峰值（tracemalloc）
+- 匯出期間 event loop 的最大延遲（每 5ms 一次的計時器實際延遲）
+並與「逐筆 get_scan_details 後整份 json.dumps」的做法比較。
+
+用法：python benchmarks/bench_export.py [--scans 5000] [--devices 30]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_history import populate  # noqa: E402
+from database import Database  # noqa: E402
+from export import ScanExport  # noqa: E402
+
+
+async def loop_lag(stop):
+    """回傳 event loop 最大延遲（毫秒）"""
+    worst = 0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.005)
+        worst = max(worst, time.perf_counter() - started - 0.005)
+    return worst * 1000
+
+
+async def run_export(db, fmt, compress):
+    stop = asyncio.Event()
+    lag = asyncio.create_task(loop_lag(stop))
+    size = 0
+    async for piece in ScanExport(db, fmt, compress=compress).stream():
+        size += len(piece)
+    stop.set()
+    return size, await lag
+
+
+async def run_naive(db):
+    """舊做法：在 event loop 中逐筆載入所有掃描，再一次序列化"""
+    stop = asyncio.Event()
+    lag = asyncio.create_task(loop_lag(stop))
+    await asyncio.sleep(0)
+    scans = [db.get_scan_details(scan["id"]) for scan in db.query_scans(10 ** 9)["scans"]]
+    size = len(json.dumps(scans).encode())
+    stop.set()
+    return size, await lag
+
+
+def measure(run):
+    """計時與記憶體分兩次執行（tracemalloc 會大幅拖慢執行速度）"""
+    started = time.perf_counter()
+    size, lag = asyncio.run(run())
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    asyncio.run(run())
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, size, peak, lag
+
+
+def run(scans=5000, devices=30, naive=True):
+    """
+    累積 scans 筆掃描後量測各格式的匯出
+    :return: {"observations", "exports": {名稱: {"elapsed_s", "rows_per_sec", "size_mb", "peak_mb", "max_loop_lag_ms"}}}
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(Path(tmp) / "export.db")
+        _, results = populate(db, scans, devices, random.Random(0))
+        rows = results["observations"]
+
+        cases = {f"{fmt}{'.gz' if compress else ''}": (lambda f=fmt, c=compress: run_export(db, f, c))
+                 for fmt in ("csv", "ndjson", "json") for compress in (False, True)}
+        if naive:
+            cases["naive json"] = lambda: run_naive(db)
+        exports = {}
+        for name, case in cases.items():
+            elapsed, size, peak, lag = measure(case)
+            exports[name] = {
+                "elapsed_s": elapsed,
+                "rows_per_sec": rows / elapsed,
+                "size_mb": size / 1e6,
+                "peak_mb": peak / 1e6,
+                "max_loop_lag_ms": lag,
+            }
+        db.close()
+
+    results["exports"] = exports
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scans", type=int, default=5000, help="累積的掃描次數")
+    parser.add_argument("--devices", type=int, default=30, help="每次掃描的裝置數")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    r = run(args.scans, args.devices)
+    print(f"populated {r['scans']} scans / {r['observations']} observations in {r['populate_s']:.1f}s")
+    print(f"\n{'export':16s} {'seconds':>8s} {'rows/s':>9s} {'MB':>7s} {'MB/s':>6s} {'peak MB':>8s} {'max lag ms':>11s}")
+    for name, e in r["exports"].items():
+        print(f"{name:16s} {e['elapsed_s']:8.2f} {e['rows_per_sec']:9.0f} {e['size_mb']:7.1f} "
+              f"{e['size_mb'] / e['elapsed_s']:6.1f} {e['peak_mb']:8.2f} {e['max_loop_lag_ms']:11.1f}")
+
+
+if __name__ == "__main__":
+    main()
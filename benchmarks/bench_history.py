@@ -0,0 +1,124 @@
+"""
+歷史與裝置查詢效能測試
+累積 N 筆掃描後，比較第一頁與深層分頁的查詢延遲：
+- query_scans：掃描歷史（無條件、依網段、只查深度掃描）
+- query_observations：裝置觀測紀錄（MAC、CIDR、廠商、主機名稱、開放埠）
+- 舊版 LIMIT/OFFSET 分頁作為對照（延遲隨頁數增加）
+
+用法：python benchmarks/bench_history.py [--scans 10000] [--devices 30] [--pages 200]
+"""
+
+import argparse
+import logging
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_database import drift, fake_devices  # noqa: E402
+from database import Database  # noqa: E402
+
+
+def populate(db, scans, devices, rng):
+    base = fake_devices(devices, rng)
+    conn = db._connect()
+    started = time.perf_counter()
+    for i in range(scans):
+        subnet = "192.168.1.0/24" if i % 4 else "10.0.0.0/24"
+        db.save_scan(drift(base, rng), subnet, deep_scan=i % 10 == 0)
+    elapsed = time.perf_counter() - started
+    rows = conn.execute("SELECT COUNT(*) FROM scan_hosts").fetchone()[0]
+    return base, {"scans": scans, "observations": rows, "populate_s": elapsed}
+
+
+def measure(query, repeat=20):
+    """回傳多次查詢的中位數延遲（毫秒）"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        query()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def deep_cursor(fetch, pages):
+    """往後翻 pages 頁，回傳該頁的游標"""
+    cursor = None
+    for _ in range(pages):
+        page = fetch(cursor)
+        if page["next_cursor"] is None:
+            break
+        cursor = page["next_cursor"]
+    return cursor
+
+
+def run(scans=10000, devices=30, pages=200):
+    """
+    累積 scans 筆掃描後量測各查詢第一頁與第 pages 頁的延遲
+    :return: {"scans", "observations", "populate_s", "queries": {名稱: {"first_page_ms", "deep_page_ms"}}}
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(Path(tmp) / "history.db")
+        base, results = populate(db, scans, devices, random.Random(0))
+        conn = db._connect()
+        queries = {}
+
+        history = {
+            "history": {},
+            "history subnet=10.0.0.0/24": {"subnet": "10.0.0.0/24"},
+            "history deep_scan": {"deep_scan": True},
+        }
+        for name, filters in history.items():
+            fetch = lambda cursor, f=filters: db.query_scans(20, cursor, **f)  # noqa: E731
+            cursor = deep_cursor(fetch, pages)
+            queries[name] = {"first_page_ms": measure(lambda: fetch(None)), "deep_page_ms": measure(lambda: fetch(cursor))}
+
+        legacy = lambda start: conn.execute(  # noqa: E731
+            "SELECT id, scan_time, device_count, subnet, deep_scan FROM scans ORDER BY scan_time DESC LIMIT 20 OFFSET ?",
+            (start,)
+        ).fetchall()
+        queries["history (LIMIT/OFFSET)"] = {
+            "first_page_ms": measure(lambda: legacy(0)), "deep_page_ms": measure(lambda: legacy(20 * pages)),
+        }
+
+        observations = {
+            "devices": {},
+            "devices mac": {"mac": base[7]["mac"]},
+            "devices ip=192.168.1.0/28": {"ip": "192.168.1.0/28"},
+            "devices vendor=tp-link": {"vendor": "tp-link"},
+            "devices hostname=host-1": {"hostname": "host-1"},
+            "devices port=3389": {"port": 3389},
+            "devices port=22 vendor=apple": {"port": 22, "vendor": "apple"},
+        }
+        for name, filters in observations.items():
+            fetch = lambda cursor, f=filters: db.query_observations(limit=50, cursor=cursor, **f)  # noqa: E731
+            cursor = deep_cursor(fetch, pages)
+            queries[name] = {"first_page_ms": measure(lambda: fetch(None)), "deep_page_ms": measure(lambda: fetch(cursor))}
+        db.close()
+
+    results["queries"] = queries
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scans", type=int, default=10000, help="累積的掃描次數")
+    parser.add_argument("--devices", type=int, default=30, help="每次掃描的裝置數")
+    parser.add_argument("--pages", type=int, default=200, help="深層分頁要往後翻幾頁")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    r = run(args.scans, args.devices, args.pages)
+    print(f"populated {r['scans']} scans / {r['observations']} observations in {r['populate_s']:.1f}s")
+    print(f"\n{'query':42s} {'page 1 ms':>10s} {f'page {args.pages} ms':>12s}")
+    for name, q in r["queries"].items():
+        print(f"{name:42s} {q['first_page_ms']:10.3f} {q['deep_page_ms']:12.3f}")
+
+
+if __name__ == "__main__":
+    main()
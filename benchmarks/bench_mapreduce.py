@@ -0,0 +1,79 @@
+"""
+map-reduce 分析效能測試（使用本機假 Ollama 伺服器）
+大型網路分別以單次分析與 map-reduce 分析，比較：
+- 第一個有用輸出的延遲（單次分析為第一個 token，map-reduce 為第一個分片的發現）
+- 完整報告的總耗時、呼叫次數與最大 prompt 的估計 token 數
+- 單次分析列入 prompt 的裝置數：single 超過 token 預算的裝置會被捨棄，single-full 不限預算，map-reduce 涵蓋全部裝置
+
+假伺服器的 prefill 時間與 prompt 長度成正比，並以 --server-parallel 模擬 OLLAMA_NUM_PARALLEL。
+
+用法：python benchmarks/bench_mapreduce.py [--devices 500] [--shard-size 50] [--parallelism 4]
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "tests"))
+
+from analyzer import AIAnalyzer  # noqa: E402
+from bench_prompt import sample_network  # noqa: E402
+from fake_ollama import FakeOllama  # noqa: E402
+from prompt import build_prompt, estimate_tokens  # noqa: E402
+
+
+async def measure(analyzer, devices, mapreduce):
+    stream = analyzer.analyze_network_mapreduce(devices, refresh=True) if mapreduce \
+        else analyzer.analyze_network_astream(devices, refresh=True)
+    started = time.perf_counter()
+    first = None
+    async for chunk in stream:
+        if first is None and ("response" in chunk or "findings" in chunk):
+            first = time.perf_counter()
+    elapsed = time.perf_counter() - started
+    await analyzer.aclose()
+    return (first - started) * 1000, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=500, help="網路裝置數")
+    parser.add_argument("--shard-size", type=int, default=50, help="每個分片的裝置數")
+    parser.add_argument("--parallelism", type=int, default=4, help="同時分析的分片數")
+    parser.add_argument("--budget", type=int, default=3000, help="prompt 的 token 預算")
+    parser.add_argument("--prefill-rate", type=float, default=1000, help="假伺服器每秒處理的 prompt token 數")
+    parser.add_argument("--server-parallel", type=int, default=4, help="假伺服器同時生成的請求數")
+    parser.add_argument("--tokens", type=int, default=100, help="每次回應的 token 數")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="token 之間的間隔秒數")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    devices = sample_network(args.devices, random.Random(1))
+    _, info = build_prompt(devices, args.budget)
+    server = FakeOllama(tokens=args.tokens, token_delay=args.token_delay, first_token_delay=0.05,
+                        prefill_rate=args.prefill_rate, parallel=args.server_parallel)
+    print(f"{args.devices} devices, budget {args.budget} tokens, prefill {args.prefill_rate:.0f} tokens/s, "
+          f"server parallel {args.server_parallel}")
+    with server:
+        for name, mapreduce, budget in (("single", False, args.budget), ("single-full", False, None),
+                                        ("mapreduce", True, args.budget)):
+            analyzer = AIAnalyzer(model="fake", host=server.url, token_budget=budget,
+                                  shard_size=args.shard_size, parallelism=args.parallelism)
+            requests = server.stats["requests"]
+            prompts = len(server.prompts)
+            first_ms, elapsed = asyncio.run(measure(analyzer, devices, mapreduce))
+            largest = max(estimate_tokens(p) for p in server.prompts[prompts:])
+            listed = info["included"] if budget and not mapreduce else args.devices
+            print(f"{name:11s} first output {first_ms:8.1f} ms  total {elapsed:6.2f} s  "
+                  f"calls {server.stats['requests'] - requests:3d}  largest prompt ~{largest:5d} tokens  "
+                  f"devices covered {listed}/{args.devices}")
+
+
+if __name__ == "__main__":
+    main()
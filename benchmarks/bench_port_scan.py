@@ -0,0 +1,133 @@
+"""
+Port 掃描效能測試
+在 loopback 上建立本機監聽埠，比較逐一 connect_ex 與 PortScanEngine 並行掃描的耗時。
+
+為模擬實際網路中「被防火牆丟棄」的埠（最耗時的情況），每台主機另外放一個
+backlog 已滿的監聽埠：新的 SYN 會被核心丟棄，連線只能等到 timeout。
+127.0.0.0/8 整段都會回到 loopback（Linux），因此可用 127.0.0.x 模擬多台主機。
+
+用法：python benchmarks/bench_port_scan.py [--hosts 16] [--timeout 0.5]
+"""
+
+import argparse
+import socket
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from scanner import NetworkScanner  # noqa: E402
+
+
+def legacy_port_scan(ip, ports, timeout):
+    """舊版實作：一次一個阻塞式 connect_ex"""
+    open_ports = []
+    for port in ports:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        if sock.connect_ex((ip, port)) == 0:
+            open_ports.append(port)
+        sock.close()
+    return open_ports
+
+
+def open_listeners(hosts, open_count):
+    """
+    在每台模擬主機上建立監聽埠
+    :return: (所有 socket, 開放埠列表, 被丟棄埠)
+    """
+    sockets = []
+
+    # 第一台主機決定埠號，其他主機沿用相同埠號
+    open_ports = []
+    for _ in range(open_count):
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.bind((hosts[0], 0))
+        s.listen(128)
+        sockets.append(s)
+        open_ports.append(s.getsockname()[1])
+
+    tarpit = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    tarpit.bind((hosts[0], 0))
+    tarpit.listen(0)
+    sockets.append(tarpit)
+    filtered_port = tarpit.getsockname()[1]
+
+    for host in hosts[1:]:
+        for port in open_ports:
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s.bind((host, port))
+            s.listen(128)
+            sockets.append(s)
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.bind((host, filtered_port))
+        s.listen(0)
+        sockets.append(s)
+
+    # 塞滿 tarpit 的 accept queue，之後的 SYN 會被丟棄
+    for host in hosts:
+        for _ in range(2):
+            c = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            c.setblocking(False)
+            c.connect_ex((host, filtered_port))
+            sockets.append(c)
+    time.sleep(0.2)
+
+    return sockets, open_ports, filtered_port
+
+
+def run(host_count=16, open_count=3, timeout=0.5):
+    """
+    比較逐一 connect_ex 與 PortScanEngine
+    :return: 結果 dict
+    """
+    hosts = [f"127.0.0.{i}" for i in range(1, host_count + 1)]
+    sockets, open_ports, filtered_port = open_listeners(hosts, open_count)
+
+    # 掃描清單：開放埠 + 被丟棄埠 + 預設埠（loopback 上通常是關閉的）
+    ports = open_ports + [filtered_port] + NetworkScanner.DEFAULT_PORTS
+    try:
+        start = time.perf_counter()
+        legacy = {ip: legacy_port_scan(ip, ports, timeout) for ip in hosts}
+        legacy_time = time.perf_counter() - start
+
+        scanner = NetworkScanner()
+        start = time.perf_counter()
+        engine = scanner.port_scan_hosts(hosts, ports, timeout)
+        engine_time = time.perf_counter() - start
+    finally:
+        for s in sockets:
+            s.close()
+
+    engine_ports = {ip: [p["port"] for p in records] for ip, records in engine.items()}
+    return {
+        "hosts": len(hosts),
+        "ports": len(ports),
+        "open_ports_found": sum(len(v) for v in engine_ports.values()),
+        "results_match": engine_ports == legacy,
+        "legacy_s": legacy_time,
+        "engine_s": engine_time,
+        "speedup": legacy_time / engine_time,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hosts", type=int, default=16, help="模擬主機數量")
+    parser.add_argument("--open", type=int, default=3, help="每台主機開放的埠數")
+    parser.add_argument("--timeout", type=float, default=0.5, help="單次探測超時秒數")
+    args = parser.parse_args()
+
+    r = run(args.hosts, args.open, args.timeout)
+    print(f"{r['hosts']} hosts × {r['ports']} ports, timeout={args.timeout}s")
+    if not r["results_match"]:
+        print("WARNING: results differ between legacy scan and engine")
+    print(f"open ports found: {r['open_ports_found']}")
+    print(f"legacy sequential : {r['legacy_s']:8.3f} s")
+    print(f"PortScanEngine    : {r['engine_s']:8.3f} s")
+    print(f"speedup           : {r['speedup']:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
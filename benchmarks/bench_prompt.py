@@ -0,0 +1,93 @@
+"""
+AI 分析 prompt 大小與第一個 token 延遲（TTFT）測試
+比較三種 prompt：
+- legacy：舊版 json.dumps(device_list, indent=2)
+- compact：表格編碼（廠商代號、依開放埠分組）
+- budget：表格編碼 + token 預算（超過時捨棄次要裝置並摘要）
+
+TTFT 以本機假 Ollama 伺服器量測，prefill 時間與 prompt 長度成正比（--prefill-rate）。
+
+用法：python benchmarks/bench_prompt.py [--sizes 50 200 500] [--budget 3000] [--prefill-rate 1000]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "tests"))
+
+from analyzer import AIAnalyzer  # noqa: E402
+from bench_database import fake_devices  # noqa: E402
+from fake_ollama import FakeOllama  # noqa: E402
+from prompt import PROMPT_TEMPLATE, build_prompt, estimate_tokens  # noqa: E402
+
+
+def legacy_prompt(device_list):
+    return PROMPT_TEMPLATE.format(devices=json.dumps(device_list, indent=2))
+
+
+def sample_network(count, rng):
+    """模擬網路：加上少數未知廠商與隨機 MAC 的裝置"""
+    devices = fake_devices(count, rng)
+    for d in rng.sample(devices, max(1, count // 20)):
+        d["vendor"] = "Unknown Vendor"
+    for d in rng.sample(devices, max(1, count // 20)):
+        d["mac"] = "da" + d["mac"][2:]
+    return devices
+
+
+async def time_to_first_token(analyzer, devices, runs):
+    """回傳多次分析中第一個 response 的中位數延遲（毫秒）"""
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        first = None
+        async for chunk in analyzer.analyze_network_astream(devices, refresh=True):
+            if "response" in chunk and first is None:
+                first = time.perf_counter()
+        samples.append((first - started) * 1000)
+    await analyzer.aclose()
+    return sorted(samples)[len(samples) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 200, 500], help="網路裝置數")
+    parser.add_argument("--budget", type=int, default=3000, help="budget 模式的 token 上限")
+    parser.add_argument("--prefill-rate", type=float, default=1000, help="假伺服器每秒處理的 prompt token 數")
+    parser.add_argument("--runs", type=int, default=1, help="每種情況量測 TTFT 的次數")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    modes = {
+        "legacy": {"token_budget": None, "legacy": True},
+        "compact": {"token_budget": None, "legacy": False},
+        "budget": {"token_budget": args.budget, "legacy": False},
+    }
+
+    with FakeOllama(tokens=5, token_delay=0, first_token_delay=0.01, prefill_rate=args.prefill_rate) as server:
+        print(f"prefill {args.prefill_rate:.0f} tokens/s, budget {args.budget} tokens")
+        print(f"{'devices':>7s} {'mode':8s} {'chars':>8s} {'est tokens':>10s} {'listed':>7s} {'TTFT ms':>9s}")
+        for size in args.sizes:
+            devices = sample_network(size, random.Random(size))
+            for name, mode in modes.items():
+                analyzer = AIAnalyzer(model="fake", host=server.url, token_budget=mode["token_budget"])
+                if mode["legacy"]:
+                    prompt, listed = legacy_prompt(devices), size
+                    analyzer._prompt = legacy_prompt
+                else:
+                    prompt, info = build_prompt(devices, mode["token_budget"])
+                    listed = info["included"]
+                ttft = asyncio.run(time_to_first_token(analyzer, devices, args.runs))
+                print(f"{size:7d} {name:8s} {len(prompt):8d} {estimate_tokens(prompt):10d} {listed:7d} {ttft:9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+網路掃描端對端效能測試（不需要 raw socket 權限、實體網路或 DNS）
+以 fake_arp.FakeLan 取代 scapy 收發封包，模擬數百台主機的 ARP 回應（可設定延遲與掉包率）。
+模擬主機位於 127.77.0.0/16：127.0.0.0/8 整段都會回到 loopback（Linux），
+因此深度掃描的 TCP 探測是真的連線，部分主機在 8080 埠有監聽。
+主機名稱以固定延遲的假查詢取代，廠商只查本機 OUI 快照（不下載）。
+
+量測：
+- 快速掃描、深度掃描的總耗時與發現的主機數、開放埠數
+- 有掉包時，第一次掃描與第二次掃描（已知主機以 unicast 重試）發現的主機數
+
+用法：python benchmarks/bench_scan.py [--hosts 500] [--network 127.77.0.0/22] [--loss 0.05]
+"""
+
+import argparse
+import logging
+import socket
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "tests"))
+
+from fake_arp import FakeLan  # noqa: E402
+from oui import VendorResolver  # noqa: E402
+from scanner import HostnameResolver, NetworkScanner  # noqa: E402
+from sweep import ArpSweeper  # noqa: E402
+
+LISTEN_PORT = 8080
+
+
+def make_scanner(lan, hostname_delay, oui_dir):
+    """使用模擬網段、假主機名稱查詢與離線 OUI 的掃描器"""
+    def lookup(ip):
+        time.sleep(hostname_delay)
+        return "host-" + ip.replace(".", "-")
+
+    scanner = NetworkScanner(sweeper=ArpSweeper(timeout=3, idle_timeout=0.3, transport_factory=lan.transport))
+    scanner.resolver = HostnameResolver(lookup)
+    scanner.vendor_resolver = VendorResolver(snapshot_path=Path(oui_dir) / "oui.tsv", auto_refresh=False)
+    return scanner
+
+
+def open_listeners(ips):
+    """在部分模擬主機的 LISTEN_PORT 上監聽"""
+    sockets = []
+    for ip in ips:
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind((ip, LISTEN_PORT))
+        s.listen(128)
+        sockets.append(s)
+    return sockets
+
+
+def timed_scan(scanner, network, deep_scan):
+    started = time.perf_counter()
+    devices = scanner.scan(network, deep_scan=deep_scan)
+    elapsed = time.perf_counter() - started
+    if devices and "error" in devices[0]:
+        raise RuntimeError(devices[0]["error"])
+    return devices, elapsed
+
+
+def run(hosts=500, network="127.77.0.0/22", loss=0.05, latency=0.002, hostname_delay=0.01, listen_ratio=0.1):
+    """
+    執行一輪掃描測試
+    :return: 結果 dict（秒數與數量）
+    """
+    results = {"hosts": hosts}
+    with tempfile.TemporaryDirectory() as oui_dir:
+        # 快速與深度掃描（無掉包）
+        lan = FakeLan.generate(network, hosts, latency=latency)
+        listening = sorted(lan.hosts)[::max(1, round(1 / listen_ratio))] if listen_ratio else []
+        sockets = open_listeners(listening)
+        try:
+            scanner = make_scanner(lan, hostname_delay, oui_dir)
+            devices, results["quick_scan_s"] = timed_scan(scanner, network, deep_scan=False)
+            results["quick_found"] = len(devices)
+            results["arp_requests"] = lan.stats["requests"]
+
+            scanner = make_scanner(lan, hostname_delay, oui_dir)
+            devices, results["deep_scan_s"] = timed_scan(scanner, network, deep_scan=True)
+            results["deep_found"] = len(devices)
+            results["listeners"] = len(listening)
+            results["listeners_found"] = sum(
+                1 for d in devices if d["ip"] in listening and any(p["port"] == LISTEN_PORT for p in d["ports"])
+            )
+        finally:
+            for s in sockets:
+                s.close()
+
+        # 掉包：第二次掃描時已知主機以 unicast 重試
+        lossy = FakeLan(lan.hosts, latency=latency, loss=loss, seed=1)
+        scanner = make_scanner(lossy, hostname_delay, oui_dir)
+        devices, results["lossy_first_scan_s"] = timed_scan(scanner, network, deep_scan=False)
+        results["lossy_first_found"] = len(devices)
+        devices, results["lossy_second_scan_s"] = timed_scan(scanner, network, deep_scan=False)
+        results["lossy_second_found"] = len(devices)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hosts", type=int, default=500, help="模擬主機數")
+    parser.add_argument("--network", default="127.77.0.0/22", help="模擬網段（需在 127.0.0.0/8 內才能做深度掃描）")
+    parser.add_argument("--loss", type=float, default=0.05, help="掉包率")
+    parser.add_argument("--latency", type=float, default=0.002, help="ARP 回應延遲秒數")
+    parser.add_argument("--hostname-delay", type=float, default=0.01, help="每次主機名稱查詢的秒數")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    r = run(args.hosts, args.network, args.loss, args.latency, args.hostname_delay)
+    print(f"{r['hosts']} hosts in {args.network} ({r['arp_requests']} ARP requests per sweep)")
+    print(f"quick scan          {r['quick_scan_s']:6.2f} s  found {r['quick_found']}")
+    print(f"deep scan           {r['deep_scan_s']:6.2f} s  found {r['deep_found']}  "
+          f"port {LISTEN_PORT} open on {r['listeners_found']}/{r['listeners']}")
+    print(f"loss {args.loss:.0%}: first scan {r['lossy_first_scan_s']:6.2f} s  found {r['lossy_first_found']}")
+    print(f"          second scan {r['lossy_second_scan_s']:6.2f} s  found {r['lossy_second_found']} (unicast retry)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+離線效能測試套件（不需要 raw socket 權限、區域網路或 Ollama）
+依序執行各項效能測試，結果輸出為 JSON，方便留存並與先前的結果比較：
+- scan：NetworkScanner.scan 對模擬 ARP 網段（fake_arp）的快速／深度／掉包掃描
+- port_scan：port_scan_hosts 對 loopback 監聽埠
+- database：Database 寫入與詳細查詢
+- history：歷史與裝置查詢的第一頁與深層分頁
+- export：掃描歷史串流匯出
+- analyzer：AIAnalyzer 串流分析（假 Ollama 伺服器，可設定 token 延遲）
+
+預設使用較小的資料量以便快速執行，--full 則使用各測試的預設規模。
+指定 --baseline 時會與先前的 JSON 比較，有指標退步超過 --tolerance 就以結束碼 1 結束。
+
+用法：python benchmarks/run_suite.py [--only scan,database] [--full] [--output results.json]
+                                     [--baseline baseline.json] [--tolerance 0.2]
+"""
+
+import argparse
+import json
+import logging
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import bench_analyzer  # noqa: E402
+import bench_database  # noqa: E402
+import bench_export  # noqa: E402
+import bench_history  # noqa: E402
+import bench_port_scan  # noqa: E402
+import bench_scan  # noqa: E402
+from database import Database  # noqa: E402
+
+# 每項測試的參數：(快速設定, 完整設定)
+CONFIGS = {
+    "scan": ({"hosts": 300}, {}),
+    "port_scan": ({"host_count": 8}, {}),
+    "database": ({"scans": 2000, "devices_per_scan": 20, "queries": 200},
+                 {"scans": 10000, "devices_per_scan": 20, "queries": 200}),
+    "history": ({"scans": 2000, "pages": 50}, {}),
+    "export": ({"scans": 1000, "naive": False}, {}),
+    "analyzer": ({"tokens": 50}, {}),
+}
+
+# 對照組（舊版做法）只供參考，不列入退步判斷
+REFERENCE_MARKERS = ("legacy", "naive", "LIMIT/OFFSET")
+
+# 低於這些差距的時間／大小變化視為雜訊
+NOISE_FLOOR = {"_s": 0.05, "_ms": 0.5, "_mb": 0.5}
+
+
+def run_database(scans, devices_per_scan, queries):
+    """在暫存目錄中以目前的 Database 執行 bench_database"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(Path(tmp) / "bench.db")
+        try:
+            return bench_database.run(db, scans, devices_per_scan, queries, random.Random(1))
+        finally:
+            db.close()
+
+
+BENCHMARKS = {
+    "scan": bench_scan.run,
+    "port_scan": bench_port_scan.run,
+    "database": run_database,
+    "history": bench_history.run,
+    "export": bench_export.run,
+    "analyzer": bench_analyzer.run,
+}
+
+
+def git_commit():
+    """目前的 git commit，無法取得時回傳 None"""
+    try:
+        result = subprocess.run(["git", "rev-parse", "HEAD"], cwd=Path(__file__).resolve().parent,
+                                capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() or None
+
+
+def flatten(results, prefix=""):
+    """把巢狀結果攤平成 {"history.queries.devices.first_page_ms": 值}"""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        else:
+            flat[name] = value
+    return flat
+
+
+def direction(name):
+    """
+    指標的方向
+    :return: -1 越小越好、1 越大越好、0 不比較
+    """
+    leaf = name.rsplit(".", 1)[-1]
+    if leaf.endswith(("_s", "_ms", "_mb")):
+        return -1
+    if leaf.endswith(("per_sec", "speedup", "_found")):
+        return 1
+    return 0
+
+
+def compare(current, baseline, tolerance):
+    """
+    與先前的結果比較
+    :return: 退步的指標列表 [(名稱, 先前, 目前)]
+    """
+    now = flatten(current["results"])
+    before = flatten(baseline.get("results", {}))
+    regressions = []
+    for name, old in before.items():
+        new = now.get(name)
+        if new is None or any(marker in name for marker in REFERENCE_MARKERS):
+            continue
+        if isinstance(old, bool):
+            if old and not new:
+                regressions.append((name, old, new))
+            continue
+        sign = direction(name)
+        if sign == 0 or not isinstance(old, (int, float)):
+            continue
+        floor = next((v for suffix, v in NOISE_FLOOR.items() if name.endswith(suffix)), 0)
+        if sign < 0 and new > old * (1 + tolerance) and new - old > floor:
+            regressions.append((name, old, new))
+        elif sign > 0 and new < old * (1 - tolerance):
+            regressions.append((name, old, new))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", help=f"只執行指定的測試，以逗號分隔（{', '.join(BENCHMARKS)}）")
+    parser.add_argument("--full", action="store_true", help="使用各測試的預設規模（較慢）")
+    parser.add_argument("--output", help="結果 JSON 的輸出檔案（預設輸出到 stdout）")
+    parser.add_argument("--baseline", help="先前的結果 JSON，用於比較是否退步")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允許的退步比例")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    names = args.only.split(",") if args.only else list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"未知的測試: {', '.join(unknown)}")
+
+    config = {name: CONFIGS[name][1 if args.full else 0] for name in names}
+    report = {
+        "suite": "whodis-benchmarks",
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": config,
+        "results": {},
+    }
+    for name in names:
+        print(f"running {name} ...", file=sys.stderr)
+        started = time.perf_counter()
+        report["results"][name] = BENCHMARKS[name](**config[name])
+        print(f"  done in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n", encoding="utf-8")
+    else:
+        print(output)
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        regressions = compare(report, baseline, args.tolerance)
+        for name, old, new in regressions:
+            print(f"REGRESSION {name}: {old} -> {new}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f"no regressions beyond {args.tolerance:.0%} against {args.baseline}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
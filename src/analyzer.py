@@ -1,138 +1,408 @@
-import requests
+import asyncio
+import hashlib
 import json
 import logging
+import queue
+import threading
+import time
+import weakref
+
+import httpx
+
+from metrics import LLM_REQUEST_SECONDS, LLM_TIME_TO_FIRST_TOKEN_SECONDS, record_ollama_stats
+from prompt import (
+    SHARD_TEMPLATE, build_prompt, build_reduce_prompt, encode_devices, estimate_tokens, shard_devices,
+)
 
 logger = logging.getLogger(__name__)
 
+CONNECTION_ERROR = "Error: Could not connect to Ollama. Please ensure Ollama is running (localhost:11434)."
+TIMEOUT_ERROR = "Error: Request timed out. The model may be processing a complex request."
+
+# prompt 內容改變時遞增，讓舊的快取分析結果失效
+PROMPT_VERSION = 2
+
+_DONE = object()
+
+
+def _precheck(device_list):
+    """無法分析時回傳說明訊息"""
+    if not device_list:
+        return "No devices found to analyze."
+    # 檢查是否有錯誤訊息 (例如權限不足)
+    if "error" in device_list[0]:
+        return f"Cannot analyze due to scanner error: {device_list[0]['error']}"
+    return None
+
+
+def analysis_key(device_list, model, token_budget=None, variant=None):
+    """
+    分析快取的 key：裝置清單的正規化雜湊 + 模型名稱（與 prompt 的 token 預算）
+    只取會影響分析的欄位；裝置與埠排序、MAC 與主機名稱轉小寫，掃描順序或格式不同時仍得到相同的 key
+    :param device_list: 裝置列表
+    :param model: 模型名稱
+    :param token_budget: prompt 的 token 預算（影響列出哪些裝置）
+    :param variant: 分析方式（例如 map-reduce 與分片大小），不同方式的結果分開快取
+    :return: sha256 十六進位字串
+    """
+    devices = sorted(
+        (
+            (d.get("mac") or "").lower(),
+            d.get("ip") or "",
+            d.get("vendor") or "",
+            (d.get("hostname") or "").lower().rstrip("."),
+            sorted({(p["port"], p.get("service") or "") for p in d.get("ports") or []}),
+        )
+        for d in device_list
+    )
+    canonical = json.dumps([PROMPT_VERSION, model, token_budget, variant, devices], separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
 class AIAnalyzer:
-    def __init__(self, model="qwen3:8b", host="http://localhost:11434"):
+    """
+    Ollama 分析器
+    以 async 為主：每個 event loop 共用一個 httpx.AsyncClient（keep-alive 連線池），
+    串流中途被取消（例如 SSE 用戶端斷線）時立即關閉連線，Ollama 隨之停止生成。
+    設定 cache 時，相同裝置清單與模型的分析結果直接從快取回傳，不再呼叫模型。
+    大型網路可用 map-reduce 模式：分片同時分析，再合併成一份報告。
+    同步 API（analyze_network / analyze_network_stream）在背景 event loop 上執行 async 版本。
+    """
+
+    def __init__(self, model="qwen3:8b", host="http://localhost:11434", max_connections=4, timeout=180, cache=None,
+                 token_budget=3000, shard_size=50, parallelism=None):
+        """
+        :param model: Ollama 模型名稱
+        :param host: Ollama 位址
+        :param max_connections: 連線池上限（同時進行的分析數）
+        :param timeout: 等待回應（串流時為兩段輸出之間）的秒數上限
+        :param cache: AnalysisCache 實例（可選）
+        :param token_budget: prompt 中裝置表格的估計 token 上限，超過時捨棄次要裝置；None 表示不限制
+        :param shard_size: map-reduce 模式每個分片最多幾台裝置
+        :param parallelism: map-reduce 模式同時分析的分片數，預設與 max_connections 相同
+        """
         self.model = model
+        self.cache = cache
+        self.token_budget = token_budget
+        self.shard_size = shard_size
+        self.parallelism = parallelism or max_connections
         self.host = host
         self.api_url = f"{host}/api/generate"
+        self.max_connections = max_connections
+        self.timeout = httpx.Timeout(timeout, connect=5)
+        # httpx 的連線綁定建立它的 event loop，因此每個 loop 各有一個 client
+        self._clients = weakref.WeakKeyDictionary()
+        self._loop = None
+        self._loop_lock = threading.Lock()
 
-    def analyze_network(self, device_list):
-        """
-        發送設備列表給 Ollama 進行分析
-        :param device_list: List of dictionaries containing device info
-        :return: String (Analysis result)
-        """
-        if not device_list:
-            return "No devices found to analyze."
-        
-        # 檢查是否有錯誤訊息 (例如權限不足)
-        if "error" in device_list[0]:
-            return f"Cannot analyze due to scanner error: {device_list[0]['error']}"
+    def _client(self):
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None or client.is_closed:
+            limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+            client = self._clients[loop] = httpx.AsyncClient(timeout=self.timeout, limits=limits)
+        return client
+
+    async def aclose(self):
+        """關閉目前 event loop 的連線池"""
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
 
-        # 有效化設備列表，移除不需要的欄位 (目前結構已經很簡潔)
-        # 用 JSON 字串格式化列表
-        devices_str = json.dumps(device_list, indent=2)
+    def _background_loop(self):
+        """同步 API 使用的背景 event loop（第一次使用時啟動）"""
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, daemon=True, name="whodis-analyzer").start()
+            return self._loop
 
-        prompt = f"""
-You are a network security expert. Analyze the following list of devices discovered on a local network.
-Briefly point out any suspicious devices, unknown vendors, or potential security risks.
-Highlight normal infrastructure devices (routers, gateways) vs user devices.
+    def _prompt(self, device_list):
+        prompt, info = build_prompt(device_list, self.token_budget)
+        if info["included"] < info["devices"]:
+            logger.info(f"Prompt over budget: listing {info['included']} of {info['devices']} devices")
+        logger.debug(f"Prompt size: ~{info['tokens']} tokens")
+        return prompt
 
-Device List:
-{devices_str}
+    async def _cached(self, key, refresh):
+        """查詢快取（SQLite 在執行緒中讀取，不阻塞 event loop）"""
+        if self.cache is None or refresh:
+            return None
+        return await asyncio.to_thread(self.cache.get, key)
 
-Please provide a concise summary in Traditional Chinese.
-"""
+    async def _remember(self, key, analysis):
+        if self.cache is not None and analysis:
+            await asyncio.to_thread(self.cache.put, key, self.model, analysis)
 
+    async def _generate(self, prompt):
+        """
+        非串流呼叫 Ollama
+        :return: (回應文字或錯誤訊息, 是否成功)
+        """
         payload = {
             "model": self.model,
             "prompt": prompt,
             "stream": False
         }
 
+        started = time.perf_counter()
+        # 被取消時不會經過下面任何一個分支
+        outcome = "cancelled"
         try:
             logger.info(f"Sending request to Ollama ({self.model})...")
-            response = requests.post(self.api_url, json=payload, timeout=120)
+            response = await self._client().post(self.api_url, json=payload)
             response.raise_for_status()
-            
+
             result = response.json()
-            analysis = result.get("response", "No response from model.")
-            return analysis
+            if "response" not in result:
+                outcome = "error"
+                return "No response from model.", False
+            if result.get("done"):
+                record_ollama_stats(self.model, result)
+            outcome = "ok"
+            return result["response"], True
 
-        except requests.exceptions.ConnectionError:
-            return "Error: Could not connect to Ollama. Please ensure Ollama is running (localhost:11434)."
-        except requests.exceptions.Timeout:
-            return "Error: Request timed out. The model may be processing a complex request."
+        except httpx.ConnectError:
+            outcome = "error"
+            return CONNECTION_ERROR, False
+        except httpx.TimeoutException:
+            outcome = "error"
+            return TIMEOUT_ERROR, False
         except Exception as e:
+            outcome = "error"
             logger.error(f"Analysis failed: {e}")
-            return f"Error during analysis: {str(e)}"
+            return f"Error during analysis: {str(e)}", False
+        finally:
+            LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, model=self.model, mode="generate", outcome=outcome)
 
-    def analyze_network_stream(self, device_list):
+    async def _stream(self, prompt, result):
         """
-        串流版本：逐步回傳 AI 分析結果，改善使用者體驗
-        :param device_list: List of dictionaries containing device info
-        :yields: Dict with 'thinking' or 'response' keys
+        串流呼叫 Ollama，逐段 yield {"thinking"} 或 {"response"}（錯誤也以 response 回傳）
+        :param result: 完整收到 done 且沒有錯誤時，全文放入 result["text"]
         """
-        if not device_list:
-            yield {"response": "No devices found to analyze."}
-            return
-        
-        if "error" in device_list[0]:
-            yield {"response": f"Cannot analyze due to scanner error: {device_list[0]['error']}"}
-            return
-
-        devices_str = json.dumps(device_list, indent=2)
-
-        prompt = f"""
-You are a network security expert. Analyze the following list of devices discovered on a local network.
-Briefly point out any suspicious devices, unknown vendors, or potential security risks.
-Highlight normal infrastructure devices (routers, gateways) vs user devices.
-
-Device List:
-{devices_str}
-
-Please provide a concise summary in Traditional Chinese.
-"""
-
         payload = {
             "model": self.model,
             "prompt": prompt,
             "stream": True  # 啟用串流模式
         }
 
+        started = time.perf_counter()
+        first_token = None
+        # 呼叫端停止迭代或被取消時不會經過下面任何一個分支
+        outcome = "cancelled"
         try:
             logger.info(f"Sending streaming request to Ollama ({self.model})...")
-            
-            # 先 yield 一個思考中的訊息
-            yield {"thinking": "正在分析網路裝置清單..."}
-            
-            response = requests.post(self.api_url, json=payload, stream=True, timeout=180)
-            response.raise_for_status()
-            
-            thinking_shown = False
-            
-            for line in response.iter_lines():
-                if line:
+
+            # 離開 async with（包含被取消）時關閉回應；未讀完的連線不會放回連線池
+            async with self._client().stream("POST", self.api_url, json=payload) as response:
+                response.raise_for_status()
+
+                thinking_shown = False
+                parts = []
+                completed = False
+
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
                     try:
-                        chunk = json.loads(line.decode('utf-8'))
-                        
-                        # 檢查是否有思考過程 (某些模型會提供)
-                        if chunk.get("context") and not thinking_shown:
-                            yield {"thinking": "模型正在推理中..."}
-                            thinking_shown = True
-                        
-                        # 回傳實際的回應內容
-                        if chunk.get("response"):
-                            yield {"response": chunk["response"]}
-                        
-                        # 檢查是否完成
-                        if chunk.get("done"):
-                            break
-                            
+                        chunk = json.loads(line)
                     except json.JSONDecodeError:
                         continue
 
-        except requests.exceptions.ConnectionError:
-            yield {"response": "Error: Could not connect to Ollama. Please ensure Ollama is running (localhost:11434)."}
-        except requests.exceptions.Timeout:
-            yield {"response": "Error: Request timed out. The model may be processing a complex request."}
+                    # 檢查是否有思考過程 (某些模型會提供)
+                    if chunk.get("context") and not thinking_shown:
+                        yield {"thinking": "模型正在推理中..."}
+                        thinking_shown = True
+
+                    # 回傳實際的回應內容
+                    if chunk.get("response"):
+                        if first_token is None:
+                            first_token = time.perf_counter() - started
+                            LLM_TIME_TO_FIRST_TOKEN_SECONDS.observe(first_token, model=self.model)
+                        parts.append(chunk["response"])
+                        yield {"response": chunk["response"]}
+
+                    if chunk.get("error"):
+                        logger.error(f"Ollama error: {chunk['error']}")
+                        yield {"response": f"Error during analysis: {chunk['error']}"}
+                        parts = None
+                    elif chunk.get("done") and parts is not None:
+                        completed = True
+                        record_ollama_stats(self.model, chunk)
+
+                    # done 之後伺服器隨即結束回應；不提早 break，讀完整個回應連線才能放回連線池重用
+
+            outcome = "ok" if completed else "error"
+            if completed:
+                result["text"] = "".join(parts)
+
+        except httpx.ConnectError:
+            outcome = "error"
+            yield {"response": CONNECTION_ERROR}
+        except httpx.TimeoutException:
+            outcome = "error"
+            yield {"response": TIMEOUT_ERROR}
         except Exception as e:
+            outcome = "error"
             logger.error(f"Streaming analysis failed: {e}")
             yield {"response": f"Error during analysis: {str(e)}"}
+        finally:
+            LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, model=self.model, mode="stream", outcome=outcome)
+
+    async def analyze_network_async(self, device_list, refresh=False):
+        """
+        發送設備列表給 Ollama 進行分析
+        :param device_list: List of dictionaries containing device info
+        :param refresh: 忽略快取，強制重新分析（結果仍會寫回快取）
+        :return: String (Analysis result)
+        """
+        problem = _precheck(device_list)
+        if problem:
+            return problem
+
+        key = analysis_key(device_list, self.model, self.token_budget)
+        cached = await self._cached(key, refresh)
+        if cached is not None:
+            logger.info("Analysis cache hit")
+            return cached
+
+        analysis, ok = await self._generate(self._prompt(device_list))
+        if ok:
+            await self._remember(key, analysis)
+        return analysis
+
+    async def analyze_network_astream(self, device_list, refresh=False):
+        """
+        串流版本：逐步回傳 AI 分析結果，改善使用者體驗
+        呼叫端停止迭代或被取消時，會關閉與 Ollama 的串流
+        快取命中時一次回傳完整結果（帶 cached 標記）；只有完整收到 done 的回應才寫入快取
+        :param device_list: List of dictionaries containing device info
+        :param refresh: 忽略快取，強制重新分析（結果仍會寫回快取）
+        :yields: Dict with 'thinking' or 'response' keys
+        """
+        problem = _precheck(device_list)
+        if problem:
+            yield {"response": problem}
+            return
+
+        key = analysis_key(device_list, self.model, self.token_budget)
+        cached = await self._cached(key, refresh)
+        if cached is not None:
+            logger.info("Analysis cache hit")
+            yield {"response": cached, "cached": True}
+            return
+
+        prompt = self._prompt(device_list)
+
+        # 先 yield 一個思考中的訊息
+        yield {"thinking": "正在分析網路裝置清單..."}
+
+        result = {}
+        async for chunk in self._stream(prompt, result):
+            yield chunk
+        if "text" in result:
+            await self._remember(key, result["text"])
+
+    def should_shard(self, device_list):
+        """裝置表格超過 token 預算時，改用 map-reduce 才能涵蓋所有裝置"""
+        return (
+            self.token_budget is not None
+            and len(device_list) > self.shard_size
+            and estimate_tokens(encode_devices(device_list)) > self.token_budget
+        )
+
+    async def analyze_network_mapreduce(self, device_list, refresh=False, shard_size=None, parallelism=None):
+        """
+        map-reduce 版本（大型網路）：依網段或廠商切成分片同時分析，
+        每完成一個分片就回傳其發現，最後串流合併所有發現的報告
+        只有一個分片時等同 analyze_network_astream
+        :param device_list: List of dictionaries containing device info
+        :param refresh: 忽略快取，強制重新分析（結果仍會寫回快取）
+        :param shard_size: 每個分片最多幾台裝置（預設為建構時的設定）
+        :param parallelism: 同時分析的分片數（預設為建構時的設定）
+        :yields: {"thinking"}、每個分片完成時的 {"shard", "shards", "label", "findings"}、合併報告的 {"response"}
+        """
+        shard_size = shard_size or self.shard_size
+        shards = shard_devices(device_list, shard_size) if not _precheck(device_list) else []
+        if len(shards) <= 1:
+            async for chunk in self.analyze_network_astream(device_list, refresh):
+                yield chunk
+            return
+
+        key = analysis_key(device_list, self.model, self.token_budget, variant=f"mapreduce:{shard_size}")
+        cached = await self._cached(key, refresh)
+        if cached is not None:
+            logger.info("Analysis cache hit")
+            yield {"response": cached, "cached": True}
+            return
+
+        yield {"thinking": f"正在分 {len(shards)} 部分分析網路裝置清單..."}
+        semaphore = asyncio.Semaphore(parallelism or self.parallelism)
+
+        async def analyze_shard(index, label, members):
+            async with semaphore:
+                prompt, _ = build_prompt(members, self.token_budget, SHARD_TEMPLATE, label=label)
+                text, ok = await self._generate(prompt)
+            return index, label, text, ok
+
+        tasks = [asyncio.create_task(analyze_shard(i, label, members)) for i, (label, members) in enumerate(shards, 1)]
+        findings = {}
+        failed = []
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                index, label, text, ok = await next_done
+                if ok:
+                    findings[index] = (label, text)
+                else:
+                    failed.append(text)
+                yield {"shard": index, "shards": len(shards), "label": label, "findings": text}
+        finally:
+            # 呼叫端提早停止時取消尚未完成的分片
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        if not findings:
+            yield {"response": failed[0]}
+            return
+
+        yield {"thinking": "正在合併各部分的分析結果..."}
+        prompt = build_reduce_prompt([findings[i] for i in sorted(findings)], len(device_list), self.token_budget)
+        result = {}
+        async for chunk in self._stream(prompt, result):
+            yield chunk
+        # 有分片失敗時報告不完整，不寫入快取
+        if "text" in result and not failed:
+            await self._remember(key, result["text"])
+
+    def analyze_network(self, device_list, refresh=False):
+        """同步版本，見 analyze_network_async"""
+        future = asyncio.run_coroutine_threadsafe(
+            self.analyze_network_async(device_list, refresh), self._background_loop()
+        )
+        return future.result()
+
+    def analyze_network_stream(self, device_list, refresh=False, mapreduce=False):
+        """
+        同步串流版本（例如 Flet 介面使用），見 analyze_network_astream 與 analyze_network_mapreduce
+        呼叫端提早停止迭代時會取消背景中的串流
+        """
+        chunks = queue.Queue()
+
+        async def pump():
+            stream = (self.analyze_network_mapreduce if mapreduce else self.analyze_network_astream)(device_list, refresh)
+            try:
+                async for chunk in stream:
+                    chunks.put(chunk)
+            finally:
+                chunks.put(_DONE)
+
+        future = asyncio.run_coroutine_threadsafe(pump(), self._background_loop())
+        try:
+            while (chunk := chunks.get()) is not _DONE:
+                yield chunk
+        finally:
+            future.cancel()
 
 if __name__ == "__main__":
     # 測試用
@@ -5,32 +5,118 @@ WhoDis - FastAPI 網頁版
 
 import asyncio
 import json
+import os
 import webbrowser
+from contextlib import asynccontextmanager
 from pathlib import Path
 
 import uvicorn
-from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi import FastAPI, Request, WebSocket
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 
 from scanner import NetworkScanner
 from analyzer import AIAnalyzer
-from database import get_database
+from database import get_database, get_enrichment_cache, get_analysis_cache
+from repository import get_async_database
+from export import ScanExport
+from feed import DeviceFeed
+from jobs import JobStore, JobStoreFull, ScanCoordinator
+from metrics import CONTENT_TYPE, get_registry
+from retention import RetentionManager
+from scheduler import PeriodicTask, ScanScheduler
 
-# 初始化
-app = FastAPI(title="WhoDis", description="網路裝置掃描與 AI 安全分析")
+# 快取在啟動時（lifespan）才接上資料庫，import 時不做任何 I/O
 scanner = NetworkScanner()
 analyzer = AIAnalyzer(model="qwen3:8b")
 
+
+async def save_scan_result(devices, targets, deep_scan):
+    """儲存掃描結果（由 ScanCoordinator 在每次掃描完成時呼叫一次）"""
+    return await get_async_database().save_scan(devices, ",".join(targets), deep_scan)
+
+
+async def run_scheduled_scan(deep_scan):
+    """定時掃描本機所在網段（經由 ScanCoordinator，與同時進行的相同 API 掃描共用）"""
+    subnet = scanner.get_subnet(scanner.get_local_ip())
+    result = await scans.scan([subnet], deep_scan=deep_scan)
+    devices = result["devices"]
+    if devices and any("error" in d for d in devices):
+        raise RuntimeError(devices[0]["error"])
+    return {"scan_id": result["scan_id"], "subnet": subnet, "device_count": len(devices), "source": result["source"]}
+
+
+def run_retention():
+    """執行資料保留政策（在排程器的執行緒中執行）"""
+    return RetentionManager(get_async_database()).run()
+
+
+def open_storage():
+    """開啟資料庫並接上快取；以最近一次掃描結果作為已知主機，讓 ARP 掃描可對未回應者以 unicast 重試"""
+    scanner.cache = get_enrichment_cache()
+    analyzer.cache = get_analysis_cache()
+    last_scan = get_database().get_scan_history(1)
+    if last_scan:
+        details = get_database().get_scan_details(last_scan[0]["id"])
+        scanner.sweeper.remember((d["ip"], d["mac"]) for d in details["devices"])
+
+
+scheduler = ScanScheduler(run_scheduled_scan)
+# 同時送出的相同掃描請求共用同一次掃描
+scans = ScanCoordinator(scanner.scan_iter, save=save_scan_result, deepen=scanner.add_ports)
+# 非同步掃描工作（建立後立即回傳 ID，可訂閱進度與取消）
+jobs = JobStore(scans)
+# 每次掃描儲存後推送差異給 /ws/devices 的訂閱者
+feed = DeviceFeed()
+# 保留政策每 6 小時執行一次，避免長期監控時資料庫無限成長
+retention_task = PeriodicTask(run_retention, interval=6 * 3600, name="retention")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    await asyncio.to_thread(open_storage)
+    # 設定 WHODIS_SCAN_INTERVAL（秒）時啟動即開始定時掃描
+    interval = os.environ.get("WHODIS_SCAN_INTERVAL")
+    if interval:
+        scheduler.start(interval=float(interval))
+    retention_task.start()
+    adb = get_async_database()
+    feed.start(adb)
+    adb.on_scan_saved(feed.notify)
+    yield
+    await feed.stop()
+    await scheduler.stop()
+    await retention_task.stop()
+    scheduler.shutdown()
+    retention_task.shutdown()
+    jobs.shutdown()
+    scans.shutdown()
+    get_async_database().close()
+    await analyzer.aclose()
+
+
+# 初始化
+app = FastAPI(title="WhoDis", description="網路裝置掃描與 AI 安全分析", lifespan=lifespan)
+
 # 靜態檔案
 static_path = Path(__file__).parent / "static"
-static_path.mkdir(exist_ok=True)
 app.mount("/static", StaticFiles(directory=static_path), name="static")
 
 
 class ScanRequest(BaseModel):
     deep_scan: bool = False
+    # 要掃描的 CIDR 列表（例如 ["192.168.1.0/24", "10.0.0.0/16"]），未指定時掃描本機所在網段
+    targets: list[str] | None = None
+    # 可接受幾秒內的上次掃描結果（直接回傳，不重新掃描），未指定時一定重新掃描
+    max_age: float | None = None
+
+
+class SchedulerRequest(BaseModel):
+    # 掃描間隔秒數、抖動比例（0.1 = ±10%），未指定時沿用目前設定
+    interval: float | None = None
+    jitter: float | None = None
+    deep_scan: bool | None = None
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -44,58 +130,284 @@ async def index():
 
 @app.post("/api/scan")
 async def scan_network(request: ScanRequest):
-    """執行網路掃描"""
-    # 在背景執行掃描（避免阻塞）
-    loop = asyncio.get_event_loop()
-    devices = await loop.run_in_executor(
-        None, lambda: scanner.scan(deep_scan=request.deep_scan)
-    )
-    
-    # 儲存到資料庫
-    if devices and not any("error" in d for d in devices):
-        db = get_database()
-        subnet = scanner.get_subnet(scanner.get_local_ip())
-        db.save_scan(devices, subnet, deep_scan=request.deep_scan)
-    
-    return {"devices": devices}
+    """
+    執行網路掃描
+    同時送出的相同請求共用同一次掃描；source 表示結果來自新掃描（live）、
+    進行中的掃描（joined）、快速掃描升級（upgraded）或 max_age 內的上次結果（cached）
+    """
+    targets = request.targets or [scanner.get_subnet(scanner.get_local_ip())]
+    return await scans.scan(targets, deep_scan=request.deep_scan, max_age=request.max_age)
+
+
+@app.get("/api/scan/status")
+async def get_scan_status():
+    """進行中的掃描與請求合併統計"""
+    return scans.status()
+
+
+@app.post("/api/jobs")
+async def create_scan_job(request: ScanRequest):
+    """建立非同步掃描工作，立即回傳工作 ID；以 /api/jobs/{id}/events 訂閱進度"""
+    targets = request.targets or [scanner.get_subnet(scanner.get_local_ip())]
+    try:
+        job = jobs.submit(targets, deep_scan=request.deep_scan)
+    except JobStoreFull:
+        return {"error": "進行中的掃描工作過多，請稍後再試"}
+    return job.snapshot()
+
+
+@app.get("/api/jobs")
+async def list_scan_jobs():
+    """列出保留中的掃描工作（不含結果）"""
+    return {"jobs": jobs.list()}
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_scan_job(job_id: str):
+    """取得掃描工作的狀態與結果"""
+    job = jobs.get(job_id)
+    if job is None:
+        return {"error": "找不到該掃描工作"}
+    return job.snapshot(include_result=True)
+
+
+@app.get("/api/jobs/{job_id}/events")
+async def stream_scan_job(job_id: str):
+    """掃描工作進度（SSE）：先推送目前狀態，之後每次進度更新推送一次，工作結束後關閉"""
+    job = jobs.get(job_id)
+    if job is None:
+        return {"error": "找不到該掃描工作"}
+
+    async def generate():
+        async for event in job.events():
+            yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(generate(), media_type="text/event-stream")
+
+
+@app.delete("/api/jobs/{job_id}")
+async def cancel_scan_job(job_id: str):
+    """取消掃描工作（沒有其他請求共用同一次掃描時，停止送出 ARP 與尚未完成的埠探測，結果不儲存）"""
+    job = jobs.cancel(job_id)
+    if job is None:
+        return {"error": "找不到該掃描工作"}
+    return job.snapshot()
+
+
+@app.websocket("/ws/devices")
+async def device_feed(websocket: WebSocket):
+    """
+    即時裝置動態：連線後先送出各網段最新掃描的快照（type=snapshot），
+    之後每次掃描儲存時只送出差異（type=delta：up 上線、down 離線、changed 屬性變更）
+    用戶端跟不上時略過累積的差異，改送一份新的快照
+    """
+    await websocket.accept()
+
+    async def send():
+        async for message in feed.subscribe():
+            await websocket.send_json(message)
+
+    sender = asyncio.create_task(send())
+    try:
+        # 用戶端不需送資料；持續接收以便及早發現斷線
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+    finally:
+        sender.cancel()
+
+
+@app.get("/api/scan/stream")
+async def scan_network_stream(deep_scan: bool = False, targets: str | None = None):
+    """
+    串流掃描（SSE）：每發現一個裝置或補齊一項資訊就立即推送
+    targets 為逗號分隔的 CIDR 列表，未指定時掃描本機所在網段
+    與 /api/scan 共用進行中的掃描：多個分頁同時串流時只執行一次掃描，中途加入的分頁先收到已發生的事件；
+    done 事件在結果儲存後才送出（附 scan_id）
+    """
+    subnet = targets or scanner.get_subnet(scanner.get_local_ip())
+
+    async def generate():
+        async for event in scans.stream(subnet.split(","), deep_scan=deep_scan):
+            yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(generate(), media_type="text/event-stream")
 
 
 @app.post("/api/analyze")
 async def analyze_devices(request: Request):
-    """AI 分析裝置"""
+    """
+    AI 分析裝置（相同裝置清單的結果由快取回傳，refresh 為 true 時強制重新分析）
+    mode: "single" 一次分析全部裝置；"mapreduce" 分片分析後合併；
+    "auto"（預設）在裝置表格超過 token 預算時使用 mapreduce
+    """
     data = await request.json()
     devices = data.get("devices", [])
+    refresh = bool(data.get("refresh", False))
+    mode = data.get("mode", "auto")
     
     if not devices:
         return {"analysis": "沒有裝置可分析"}
     
-    # 使用串流回應
+    # 使用串流回應；用戶端斷線時 Starlette 會取消此 generator，連帶關閉與 Ollama 的串流
     async def generate():
-        for chunk in analyzer.analyze_network_stream(devices):
+        if mode == "mapreduce" or (mode == "auto" and analyzer.should_shard(devices)):
+            stream = analyzer.analyze_network_mapreduce(devices, refresh)
+        else:
+            stream = analyzer.analyze_network_astream(devices, refresh)
+        async for chunk in stream:
             yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
         yield "data: {\"done\": true}\n\n"
     
     return StreamingResponse(generate(), media_type="text/event-stream")
 
 
+@app.post("/api/scheduler/start")
+async def start_scheduler(request: SchedulerRequest):
+    """啟動定時掃描（已啟動時套用新設定）"""
+    return scheduler.start(request.interval, request.jitter, request.deep_scan)
+
+
+@app.post("/api/scheduler/stop")
+async def stop_scheduler():
+    """停止定時掃描"""
+    return await scheduler.stop()
+
+
+@app.get("/api/scheduler/status")
+async def get_scheduler_status():
+    """取得定時掃描狀態與最近一次結果"""
+    return scheduler.status()
+
+
+@app.post("/api/retention/run")
+async def run_retention_now():
+    """立即執行資料保留政策，回傳刪除筆數與歸還的空間"""
+    return await retention_task.run_once()
+
+
+@app.get("/api/retention/status")
+async def get_retention_status():
+    """取得保留政策排程狀態與最近一次結果"""
+    return retention_task.status()
+
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    """取得裝置資訊快取與 AI 分析快取的命中統計"""
+    # AI 分析快取的統計需要查詢 SQLite，不在 event loop 上執行
+    analysis = await asyncio.to_thread(get_analysis_cache().stats)
+    return {**get_enrichment_cache().stats(), "analysis": analysis}
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """掃描各階段、資料庫與 AI 分析的耗時指標（Prometheus 文字格式）"""
+    return Response(get_registry().render(), media_type=CONTENT_TYPE)
+
+
+@app.delete("/api/cache/analysis")
+async def clear_analysis_cache():
+    """清空 AI 分析快取"""
+    await asyncio.to_thread(get_analysis_cache().invalidate)
+    return {"success": True}
+
+
+@app.get("/api/timeline")
+async def get_presence_timeline(mac: str | None = None, since: str | None = None,
+                                until: str | None = None, limit: int = 500):
+    """
+    取得裝置上線區間（新到舊）
+    since/until 為 ISO 時間（例如 2025-01-01T08:00:00+08:00），未指定時區視為 UTC
+    """
+    db = get_async_database()
+    try:
+        timeline = await db.get_presence_timeline(mac, since, until, limit)
+    except ValueError:
+        return {"error": "時間格式錯誤"}
+    return {"timeline": timeline}
+
+
+@app.get("/api/ports/{port}/hosts")
+async def get_hosts_with_port(port: int):
+    """查詢目前開放指定埠的主機（例如 3389）"""
+    db = get_async_database()
+    return {"port": port, "hosts": await db.get_hosts_with_port(port)}
+
+
 @app.get("/api/history")
-async def get_history(limit: int = 20):
-    """取得掃描歷史"""
-    db = get_database()
-    history = db.get_scan_history(limit)
-    return {"history": history}
+async def get_history(limit: int = 20, cursor: str | None = None, subnet: str | None = None,
+                      deep_scan: bool | None = None, since: str | None = None, until: str | None = None):
+    """
+    取得掃描歷史（新到舊），以 next_cursor 取得下一頁
+    since/until 為 ISO 時間，未指定時區視為 UTC
+    """
+    db = get_async_database()
+    try:
+        page = await db.query_scans(max(1, min(limit, 500)), cursor, subnet, deep_scan, since, until)
+    except ValueError:
+        return {"error": "時間或游標格式錯誤"}
+    return {"history": page["scans"], "next_cursor": page["next_cursor"]}
+
+
+@app.get("/api/devices")
+async def query_devices(mac: str | None = None, ip: str | None = None, vendor: str | None = None,
+                        hostname: str | None = None, port: int | None = None, subnet: str | None = None,
+                        since: str | None = None, until: str | None = None,
+                        limit: int = 100, cursor: str | None = None):
+    """
+    跨掃描查詢裝置觀測紀錄（新到舊），以 next_cursor 取得下一頁
+    ip 可為單一位址或 CIDR（例如 192.168.1.0/24）；vendor/hostname 為不分大小寫的子字串；
+    port 只比對深度掃描；since/until 為 ISO 時間，未指定時區視為 UTC
+    """
+    db = get_async_database()
+    try:
+        page = await db.query_observations(
+            mac=mac, ip=ip, vendor=vendor, hostname=hostname, port=port, subnet=subnet,
+            since=since, until=until, limit=max(1, min(limit, 500)), cursor=cursor,
+        )
+    except ValueError:
+        return {"error": "時間、IP/CIDR 或游標格式錯誤"}
+    return page
+
+
+@app.get("/api/export/{fmt}")
+async def export_history(fmt: str, subnet: str | None = None, since: str | None = None,
+                         until: str | None = None, gzip: bool = False):
+    """
+    串流匯出掃描歷史（每次掃描中出現的每台主機一列）
+    fmt 為 csv、ndjson 或 json；since/until 為 ISO 時間，未指定時區視為 UTC；gzip=true 時下載 .gz 檔
+    """
+    try:
+        export = ScanExport(get_database(), fmt, subnet, since, until, compress=gzip)
+    except ValueError:
+        return {"error": "匯出格式或時間格式錯誤"}
+    return StreamingResponse(
+        export.stream(),
+        media_type=export.media_type,
+        headers={"Content-Disposition": f'attachment; filename="{export.filename}"'},
+    )
 
 
 @app.get("/api/history/{scan_id}")
 async def get_scan_details(scan_id: int):
     """取得特定掃描詳情"""
-    db = get_database()
-    details = db.get_scan_details(scan_id)
+    db = get_async_database()
+    details = await db.get_scan_details(scan_id)
     if details:
         return details
     return {"error": "找不到該掃描記錄"}
 
 
+@app.get("/api/history/{scan_id}/diff")
+async def get_scan_diff(scan_id: int):
+    """取得掃描與同一網段上一次掃描的差異（新增/消失/變更的裝置）"""
+    db = get_async_database()
+    diff = await db.get_scan_diff(scan_id)
+    if diff:
+        return diff
+    return {"error": "找不到該掃描記錄"}
+
+
 if __name__ == "__main__":
     print("🚀 WhoDis 啟動中...")
     print("📍 開啟瀏覽器: http://localhost:8000")
@@ -1,55 +1,996 @@
+import heapq
+import ipaddress
 import sqlite3
 import json
 import logging
-from datetime import datetime
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
 from pathlib import Path
 
+from metrics import DB_SECONDS
+
 logger = logging.getLogger(__name__)
 
 # 資料庫檔案路徑
 DB_PATH = Path(__file__).parent / "whodis.db"
 
+# 每條連線套用的 pragma
+CONNECTION_PRAGMAS = [
+    "PRAGMA journal_mode = WAL",       # 讀寫不互相阻塞
+    "PRAGMA synchronous = NORMAL",     # WAL 模式下安全且大幅減少 fsync
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",      # 約 16 MB 頁快取
+    "PRAGMA busy_timeout = 5000",      # 寫入鎖競爭時最多等 5 秒
+]
+
+# 正規化結構：主機以 MAC 為 key，每次掃描只記錄「出現」與「有變化的部分」
+NORMALIZED_SCHEMA = [
+    # 每個 MAC 一列，保存最後一次觀測到的屬性（寫入時用來比對是否變化）
+    """
+    CREATE TABLE IF NOT EXISTS hosts (
+        id INTEGER PRIMARY KEY,
+        mac TEXT NOT NULL UNIQUE,
+        ip TEXT,
+        vendor TEXT,
+        hostname TEXT,
+        first_seen_scan INTEGER,
+        last_seen_scan INTEGER,
+        last_deep_scan INTEGER
+    )
+    """,
+    # 屬性變更紀錄：與上一次觀測不同時才新增，scan_id 為此版本生效的掃描
+    """
+    CREATE TABLE IF NOT EXISTS host_attributes (
+        host_id INTEGER NOT NULL REFERENCES hosts(id),
+        scan_id INTEGER NOT NULL,
+        ip TEXT,
+        vendor TEXT,
+        hostname TEXT,
+        PRIMARY KEY (host_id, scan_id)
+    ) WITHOUT ROWID
+    """,
+    # 每次掃描出現的主機
+    """
+    CREATE TABLE IF NOT EXISTS scan_hosts (
+        scan_id INTEGER NOT NULL REFERENCES scans(id),
+        host_id INTEGER NOT NULL REFERENCES hosts(id),
+        PRIMARY KEY (scan_id, host_id)
+    ) WITHOUT ROWID
+    """,
+    # 開放埠區間：同一個埠在該主機連續的深度掃描中持續開放時，只延長 last_scan
+    """
+    CREATE TABLE IF NOT EXISTS host_ports (
+        id INTEGER PRIMARY KEY,
+        host_id INTEGER NOT NULL REFERENCES hosts(id),
+        port INTEGER NOT NULL,
+        service TEXT,
+        first_scan INTEGER NOT NULL,
+        last_scan INTEGER NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_scan_hosts_host ON scan_hosts(host_id, scan_id)",
+    "CREATE INDEX IF NOT EXISTS idx_host_ports_port ON host_ports(port, host_id)",
+    "CREATE INDEX IF NOT EXISTS idx_host_ports_host ON host_ports(host_id, last_scan)",
+    "CREATE INDEX IF NOT EXISTS idx_host_ports_lookup ON host_ports(host_id, port, last_scan)",
+]
+
+
+def _to_timestamp(value):
+    """將 ISO 時間字串轉為 scans.scan_time 的格式（YYYY-MM-DD HH:MM:SS），以便直接比較字串"""
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc)
+    return moment.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _chunks(items, size=500):
+    """切成小段，避免超過 SQLite 參數數量上限"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _record_observations(conn, scan_id, devices, deep_scan):
+    """
+    以正規化結構寫入一次掃描的觀測結果
+    - 屬性（IP/廠商/主機名稱）與上一次觀測相同時不重複儲存
+    - 深度掃描時延長仍開放的埠區間，新開放的埠新增區間
+    同一次掃描中重複出現的 MAC 只採用第一筆。
+    :param conn: SQLite 連線（由呼叫端管理交易）
+    """
+    observed = {}
+    for device in devices:
+        if "error" in device or not device.get("mac"):
+            continue
+        observed.setdefault(device["mac"].lower(), device)
+    if not observed:
+        return
+
+    macs = list(observed)
+    conn.executemany(
+        "INSERT OR IGNORE INTO hosts (mac, first_seen_scan) VALUES (?, ?)",
+        [(mac, scan_id) for mac in macs]
+    )
+    hosts = {}
+    for chunk in _chunks(macs):
+        rows = conn.execute(f"""
+            SELECT id, mac, ip, vendor, hostname, last_seen_scan, last_deep_scan
+            FROM hosts WHERE mac IN ({",".join("?" * len(chunk))})
+        """, chunk)
+        hosts.update((row["mac"], row) for row in rows)
+
+    attribute_rows = []
+    host_updates = []
+    for mac, device in observed.items():
+        host = hosts[mac]
+        attrs = (device.get("ip"), device.get("vendor"), device.get("hostname"))
+        # 新主機或屬性有變化才記錄
+        if host["last_seen_scan"] is None or attrs != (host["ip"], host["vendor"], host["hostname"]):
+            attribute_rows.append((host["id"], scan_id, *attrs))
+        host_updates.append((*attrs, scan_id, host["id"]))
+
+    conn.executemany(
+        "INSERT OR REPLACE INTO host_attributes (host_id, scan_id, ip, vendor, hostname) VALUES (?, ?, ?, ?, ?)",
+        attribute_rows
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO scan_hosts (scan_id, host_id) VALUES (?, ?)",
+        [(scan_id, host["id"]) for host in hosts.values()]
+    )
+    conn.executemany(
+        "UPDATE hosts SET ip = ?, vendor = ?, hostname = ?, last_seen_scan = ? WHERE id = ?",
+        host_updates
+    )
+
+    if not deep_scan:
+        return
+
+    # 目前開放中的區間：last_scan 等於該主機上一次深度掃描
+    open_intervals = {}
+    host_ids = [host["id"] for host in hosts.values()]
+    for chunk in _chunks(host_ids):
+        rows = conn.execute(f"""
+            SELECT hp.id, hp.host_id, hp.port
+            FROM hosts h
+            JOIN host_ports hp INDEXED BY idx_host_ports_host
+                ON hp.host_id = h.id AND hp.last_scan = h.last_deep_scan
+            WHERE h.id IN ({",".join("?" * len(chunk))})
+        """, chunk)
+        open_intervals.update(((row["host_id"], row["port"]), row["id"]) for row in rows)
+
+    extended = []
+    opened = []
+    for mac, device in observed.items():
+        host_id = hosts[mac]["id"]
+        for record in device.get("ports", []):
+            interval_id = open_intervals.get((host_id, record["port"]))
+            if interval_id is None:
+                opened.append((host_id, record["port"], record.get("service"), scan_id, scan_id))
+            else:
+                extended.append((scan_id, interval_id))
+
+    conn.executemany("UPDATE host_ports SET last_scan = ? WHERE id = ?", extended)
+    conn.executemany(
+        "INSERT INTO host_ports (host_id, port, service, first_scan, last_scan) VALUES (?, ?, ?, ?, ?)",
+        opened
+    )
+    conn.executemany(
+        "UPDATE hosts SET last_deep_scan = ? WHERE id = ?",
+        [(scan_id, host_id) for host_id in host_ids]
+    )
+
+
+def _scan_devices(conn, scan_id, deep_scan):
+    """
+    還原某次掃描當下的裝置列表
+    :return: [{"host_id", "ip", "mac", "vendor", "hostname", "ports"}, ...]
+    """
+    # 每台主機套用此掃描當下（scan_id 以前最新）的屬性版本
+    rows = conn.execute("""
+        SELECT h.id AS host_id, h.mac, a.ip, a.vendor, a.hostname
+        FROM scan_hosts sh
+        JOIN hosts h ON h.id = sh.host_id
+        JOIN host_attributes a ON a.host_id = sh.host_id AND a.scan_id = (
+            SELECT MAX(scan_id) FROM host_attributes
+            WHERE host_id = sh.host_id AND scan_id <= sh.scan_id
+        )
+        WHERE sh.scan_id = ?
+    """, (scan_id,)).fetchall()
+
+    # 深度掃描才有 Port 資料：取涵蓋此掃描的開放區間
+    # 同一主機同一埠的區間互不重疊，因此對每個 (主機, 埠) 只需找 last_scan >= scan_id 的第一個區間；
+    # 埠清單以遞迴 CTE 沿索引跳躍取得，避免掃過整段歷史
+    ports = {}
+    if deep_scan:
+        port_rows = conn.execute("""
+            WITH RECURSIVE known_ports(port) AS (
+                SELECT MIN(port) FROM host_ports
+                UNION ALL
+                SELECT (SELECT MIN(port) FROM host_ports WHERE port > known_ports.port)
+                FROM known_ports WHERE port IS NOT NULL
+            ),
+            candidates AS (
+                SELECT sh.scan_id, (
+                    SELECT hp.id FROM host_ports hp
+                    WHERE hp.host_id = sh.host_id AND hp.port = kp.port AND hp.last_scan >= sh.scan_id
+                    ORDER BY hp.last_scan LIMIT 1
+                ) AS interval_id
+                FROM scan_hosts sh CROSS JOIN known_ports kp
+                WHERE sh.scan_id = ? AND kp.port IS NOT NULL
+            )
+            SELECT hp.host_id, hp.port, hp.service
+            FROM candidates c JOIN host_ports hp ON hp.id = c.interval_id
+            WHERE hp.first_scan <= c.scan_id
+            ORDER BY hp.port
+        """, (scan_id,))
+        for row in port_rows:
+            ports.setdefault(row["host_id"], []).append({"port": row["port"], "service": row["service"]})
+
+    return [
+        {
+            "host_id": row["host_id"],
+            "ip": row["ip"],
+            "mac": row["mac"],
+            "vendor": row["vendor"],
+            "hostname": row["hostname"],
+            "ports": ports.get(row["host_id"], []),
+        }
+        for row in rows
+    ]
+
+
+def diff_devices(old_devices, new_devices, compare_ports=True):
+    """
+    以 MAC 比對兩次掃描的裝置列表
+    :param old_devices: 較早的裝置列表
+    :param new_devices: 較新的裝置列表
+    :param compare_ports: 是否比較開放埠（兩次都是深度掃描才有意義）
+    :return: {"added": [裝置], "removed": [裝置],
+              "changed": [{"mac", "ip", "hostname", "changes": {"ip": {"old", "new"}, "hostname": {...},
+                                                                "ports": {"opened": [...], "closed": [...]}}}]}
+    """
+    old = {d["mac"].lower(): d for d in old_devices}
+    new = {d["mac"].lower(): d for d in new_devices}
+
+    diff = {
+        "added": [new[mac] for mac in new if mac not in old],
+        "removed": [old[mac] for mac in old if mac not in new],
+        "changed": [],
+    }
+    for mac in new.keys() & old.keys():
+        before, after = old[mac], new[mac]
+        changes = {}
+        for field in ("ip", "hostname"):
+            if before.get(field) != after.get(field):
+                changes[field] = {"old": before.get(field), "new": after.get(field)}
+        if compare_ports:
+            before_ports = {p["port"]: p for p in before.get("ports", [])}
+            after_ports = {p["port"]: p for p in after.get("ports", [])}
+            opened = [after_ports[p] for p in sorted(after_ports.keys() - before_ports.keys())]
+            closed = [before_ports[p] for p in sorted(before_ports.keys() - after_ports.keys())]
+            if opened or closed:
+                changes["ports"] = {"opened": opened, "closed": closed}
+        if changes:
+            diff["changed"].append({
+                "mac": after["mac"],
+                "ip": after.get("ip"),
+                "hostname": after.get("hostname"),
+                "changes": changes,
+            })
+    return diff
+
+
+def _materialize_diff(conn, scan_id):
+    """
+    計算並儲存 scan_id 與同一網段上一次掃描的差異（寫入 scan_diffs）
+    沒有上一次掃描時只清除舊的差異紀錄
+    """
+    scan = conn.execute("SELECT id, subnet, deep_scan FROM scans WHERE id = ?", (scan_id,)).fetchone()
+    base = conn.execute("""
+        SELECT id, deep_scan FROM scans
+        WHERE subnet IS ? AND id < ? ORDER BY id DESC LIMIT 1
+    """, (scan["subnet"], scan_id)).fetchone()
+
+    conn.execute("DELETE FROM scan_diffs WHERE scan_id = ?", (scan_id,))
+    conn.execute("UPDATE scans SET base_scan_id = ? WHERE id = ?", (base["id"] if base else None, scan_id))
+    if base is None:
+        return
+
+    old_devices = _scan_devices(conn, base["id"], base["deep_scan"])
+    new_devices = _scan_devices(conn, scan_id, scan["deep_scan"])
+    diff = diff_devices(old_devices, new_devices, compare_ports=bool(base["deep_scan"] and scan["deep_scan"]))
+
+    host_ids = {d["mac"]: d["host_id"] for d in old_devices + new_devices}
+    rows = []
+    for change, entries in diff.items():
+        for entry in entries:
+            details = {k: v for k, v in entry.items() if k != "host_id"}
+            rows.append((scan_id, host_ids[entry["mac"]], change, json.dumps(details, ensure_ascii=False)))
+    conn.executemany(
+        "INSERT INTO scan_diffs (scan_id, host_id, change, details) VALUES (?, ?, ?, ?)", rows
+    )
+
+
+def _extend_presence(conn, scan_id):
+    """
+    更新上線區間：上一次同網段掃描仍在線的主機延長區間，其餘主機開始新的區間
+    只處理本次掃描出現的主機，不需要重播歷史
+    """
+    scan = conn.execute("SELECT base_scan_id, scan_time FROM scans WHERE id = ?", (scan_id,)).fetchone()
+    if scan["base_scan_id"] is not None:
+        conn.execute("""
+            UPDATE host_presence SET last_scan = ?, ended_at = ?
+            WHERE last_scan = ? AND host_id IN (SELECT host_id FROM scan_hosts WHERE scan_id = ?)
+        """, (scan_id, scan["scan_time"], scan["base_scan_id"], scan_id))
+    conn.execute("""
+        INSERT INTO host_presence (host_id, first_scan, last_scan, started_at, ended_at)
+        SELECT host_id, ?, ?, ?, ? FROM scan_hosts
+        WHERE scan_id = ? AND host_id NOT IN (SELECT host_id FROM host_presence WHERE last_scan = ?)
+    """, (scan_id, scan_id, scan["scan_time"], scan["scan_time"], scan_id, scan_id))
+
+
+def _rebuild_presence(conn, host_ids):
+    """
+    由掃描紀錄重新計算指定主機的上線區間（建立區間表時使用）
+    連續的定義與 _extend_presence 相同：這次掃描的比較基準正是主機上一次出現的掃描
+    同一台主機可能出現在多個網段，各網段的區間分別延續（可能在時間上重疊）
+    """
+    for host_id in host_ids:
+        conn.execute("DELETE FROM host_presence WHERE host_id = ?", (host_id,))
+        rows = conn.execute("""
+            SELECT s.id, s.base_scan_id, s.scan_time
+            FROM scan_hosts sh JOIN scans s ON s.id = sh.scan_id
+            WHERE sh.host_id = ? ORDER BY s.id
+        """, (host_id,))
+        intervals = []
+        by_last_scan = {}  # 區間目前的最後一次掃描 -> 區間
+        for row in rows:
+            interval = by_last_scan.pop(row["base_scan_id"], None)
+            if interval is None:
+                interval = [host_id, row["id"], row["id"], row["scan_time"], row["scan_time"]]
+                intervals.append(interval)
+            else:
+                interval[2] = row["id"]
+                interval[4] = row["scan_time"]
+            by_last_scan[row["id"]] = interval
+        conn.executemany("""
+            INSERT INTO host_presence (host_id, first_scan, last_scan, started_at, ended_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, intervals)
+
+
+def _unlink_presence(conn, scan, host_ids, dependents):
+    """
+    刪除掃描後就地修正上線區間（不重播歷史，因此已降採樣的區間不受影響）
+    - 區間的起點或終點是被刪除的掃描時，改為同網段中主機相鄰的下一次／上一次出現
+    - 只在被刪除掃描中缺席的主機，前後兩段區間在比較基準接上後合併
+    :param scan: 被刪除的掃描（id, subnet, base_scan_id）
+    :param host_ids: 出現在被刪除掃描中的主機
+    :param dependents: 以被刪除掃描為比較基準的掃描 ID
+    """
+    scan_id = scan["id"]
+    for host_id in host_ids:
+        # 同一台主機在其他網段的區間可能在時間上重疊，只取被刪除掃描所在網段的區間
+        interval = conn.execute("""
+            SELECT id, first_scan, last_scan FROM host_presence p
+            WHERE host_id = ? AND first_scan <= ? AND last_scan >= ?
+              AND (? IN (first_scan, last_scan) OR EXISTS (
+                  SELECT 1 FROM scans WHERE id IN (p.first_scan, p.last_scan) AND subnet IS ?
+              ))
+        """, (host_id, scan_id, scan_id, scan_id, scan["subnet"])).fetchone()
+        if interval is None:
+            continue
+        if interval["first_scan"] == interval["last_scan"]:
+            conn.execute("DELETE FROM host_presence WHERE id = ?", (interval["id"],))
+        elif interval["first_scan"] == scan_id:
+            following = conn.execute("""
+                SELECT s.id, s.scan_time FROM scan_hosts sh JOIN scans s ON s.id = sh.scan_id
+                WHERE sh.host_id = ? AND sh.scan_id > ? AND sh.scan_id <= ? AND s.subnet IS ?
+                ORDER BY sh.scan_id LIMIT 1
+            """, (host_id, scan_id, interval["last_scan"], scan["subnet"])).fetchone()
+            # 找不到時（端點掃描已被保留政策移除）保留原本的時間
+            if following is not None:
+                conn.execute(
+                    "UPDATE host_presence SET first_scan = ?, started_at = ? WHERE id = ?",
+                    (following["id"], following["scan_time"], interval["id"])
+                )
+        elif interval["last_scan"] == scan_id:
+            preceding = conn.execute("""
+                SELECT s.id, s.scan_time FROM scan_hosts sh JOIN scans s ON s.id = sh.scan_id
+                WHERE sh.host_id = ? AND sh.scan_id < ? AND sh.scan_id >= ? AND s.subnet IS ?
+                ORDER BY sh.scan_id DESC LIMIT 1
+            """, (host_id, scan_id, interval["first_scan"], scan["subnet"])).fetchone()
+            if preceding is not None:
+                conn.execute(
+                    "UPDATE host_presence SET last_scan = ?, ended_at = ? WHERE id = ?",
+                    (preceding["id"], preceding["scan_time"], interval["id"])
+                )
+
+    if scan["base_scan_id"] is None:
+        return
+    for dependent in dependents:
+        rows = conn.execute("""
+            SELECT before.id AS before_id, after.id AS after_id, after.last_scan, after.ended_at
+            FROM host_presence before
+            JOIN host_presence after ON after.host_id = before.host_id AND after.first_scan = ?
+            WHERE before.last_scan = ?
+        """, (dependent, scan["base_scan_id"])).fetchall()
+        for row in rows:
+            conn.execute(
+                "UPDATE host_presence SET last_scan = ?, ended_at = ? WHERE id = ?",
+                (row["last_scan"], row["ended_at"], row["before_id"])
+            )
+            conn.execute("DELETE FROM host_presence WHERE id = ?", (row["after_id"],))
+
+
+def _refresh_hosts(conn, host_ids, deleted_scan_id):
+    """
+    刪除掃描後修正主機狀態
+    - 不再出現在任何掃描中的主機連同其屬性版本與開放埠一併刪除；
+      仍有上線區間（來自已降採樣的歷史）的主機保留，以免遺失區間
+    - 重新計算最後出現／最後深度掃描；開放中的埠區間跟著移回上一次深度掃描
+    """
+    for host_id in host_ids:
+        last_seen = conn.execute(
+            "SELECT MAX(scan_id) FROM scan_hosts WHERE host_id = ?", (host_id,)
+        ).fetchone()[0]
+        if last_seen is None:
+            conn.execute("DELETE FROM scan_diffs WHERE host_id = ?", (host_id,))
+            conn.execute("DELETE FROM host_ports WHERE host_id = ?", (host_id,))
+            if conn.execute("SELECT 1 FROM host_presence WHERE host_id = ? LIMIT 1", (host_id,)).fetchone():
+                conn.execute(
+                    "UPDATE hosts SET last_seen_scan = NULL, last_deep_scan = NULL WHERE id = ?", (host_id,)
+                )
+                continue
+            conn.execute("DELETE FROM host_attributes WHERE host_id = ?", (host_id,))
+            conn.execute("DELETE FROM hosts WHERE id = ?", (host_id,))
+            continue
+
+        last_deep = conn.execute("""
+            SELECT MAX(sh.scan_id) FROM scan_hosts sh JOIN scans s ON s.id = sh.scan_id
+            WHERE sh.host_id = ? AND s.deep_scan = 1
+        """, (host_id,)).fetchone()[0]
+        # 只在被刪除的掃描中開放過的區間已無意義
+        conn.execute(
+            "DELETE FROM host_ports WHERE host_id = ? AND first_scan = ? AND last_scan = ?",
+            (host_id, deleted_scan_id, deleted_scan_id)
+        )
+        # 被刪除的是最後一次深度掃描時，開放中的區間改以上一次深度掃描為結尾
+        if last_deep is not None and last_deep < deleted_scan_id:
+            conn.execute(
+                "UPDATE host_ports SET last_scan = ? WHERE host_id = ? AND last_scan = ?",
+                (last_deep, host_id, deleted_scan_id)
+            )
+        conn.execute(
+            "UPDATE hosts SET last_seen_scan = ?, last_deep_scan = ? WHERE id = ?",
+            (last_seen, last_deep, host_id)
+        )
+
+
+def _insert_scan(conn, devices, subnet, deep_scan):
+    """
+    寫入一次掃描（由呼叫端管理交易）
+    :return: 掃描記錄 ID
+    """
+    cursor = conn.execute("""
+        INSERT INTO scans (device_count, subnet, deep_scan)
+        VALUES (?, ?, ?)
+    """, (len(devices), subnet, 1 if deep_scan else 0))
+
+    scan_id = cursor.lastrowid
+    _record_observations(conn, scan_id, devices, deep_scan)
+    _materialize_diff(conn, scan_id)
+    _extend_presence(conn, scan_id)
+    return scan_id
+
+
+def _remove_scan(conn, scan_id):
+    """刪除一次掃描並修正相關紀錄（由呼叫端管理交易）"""
+    host_ids = [row[0] for row in conn.execute(
+        "SELECT host_id FROM scan_hosts WHERE scan_id = ?", (scan_id,)
+    )]
+    scan = conn.execute(
+        "SELECT id, subnet, base_scan_id FROM scans WHERE id = ?", (scan_id,)
+    ).fetchone()
+    if scan is None:
+        return
+    dependents = [row[0] for row in conn.execute(
+        "SELECT id FROM scans WHERE base_scan_id = ?", (scan_id,)
+    )]
+    conn.execute("DELETE FROM scan_diffs WHERE scan_id = ?", (scan_id,))
+    conn.execute("DELETE FROM scan_hosts WHERE scan_id = ?", (scan_id,))
+    conn.execute("DELETE FROM scans WHERE id = ?", (scan_id,))
+    # 以被刪除掃描為比較基準的掃描，改與更早的掃描重新比較
+    for dependent in dependents:
+        _materialize_diff(conn, dependent)
+    # 前後兩次掃描接上後，受影響主機的上線區間可能合併或縮短
+    _unlink_presence(conn, scan, host_ids, dependents)
+    _refresh_hosts(conn, host_ids, scan_id)
+
+
+def _migrate_to_normalized_schema(conn):
+    """將舊的 devices 表（每次掃描完整複製）轉換為正規化結構"""
+    for statement in NORMALIZED_SCHEMA:
+        conn.execute(statement)
+
+    scans = conn.execute("SELECT id, deep_scan FROM scans ORDER BY id").fetchall()
+    for scan in scans:
+        rows = conn.execute("""
+            SELECT ip, mac, vendor, hostname, open_ports
+            FROM devices WHERE scan_id = ? ORDER BY id
+        """, (scan["id"],)).fetchall()
+        devices = [
+            {
+                "ip": row["ip"],
+                "mac": row["mac"],
+                "vendor": row["vendor"],
+                "hostname": row["hostname"],
+                "ports": json.loads(row["open_ports"] or "[]"),
+            }
+            for row in rows
+        ]
+        _record_observations(conn, scan["id"], devices, bool(scan["deep_scan"]))
+
+    conn.execute("DROP TABLE devices")
+    logger.info(f"Migrated {len(scans)} scans to the normalized schema")
+
+
+def _add_scan_diffs(conn):
+    """新增掃描差異表，並為既有掃描補算與上一次掃描的差異"""
+    conn.execute("ALTER TABLE scans ADD COLUMN base_scan_id INTEGER")
+    # 每次掃描相對於同一網段上一次掃描的變化（新增/消失/屬性或埠變更），儲存時計算
+    conn.execute("""
+        CREATE TABLE scan_diffs (
+            scan_id INTEGER NOT NULL REFERENCES scans(id),
+            host_id INTEGER NOT NULL REFERENCES hosts(id),
+            change TEXT NOT NULL,
+            details TEXT,
+            PRIMARY KEY (scan_id, host_id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX idx_scans_subnet ON scans(subnet, id)")
+    conn.execute("CREATE INDEX idx_scans_base ON scans(base_scan_id)")
+    conn.execute("CREATE INDEX idx_scan_diffs_host ON scan_diffs(host_id)")
+
+    scan_ids = [row[0] for row in conn.execute("SELECT id FROM scans ORDER BY id")]
+    for scan_id in scan_ids:
+        _materialize_diff(conn, scan_id)
+
+
+def _add_host_presence(conn):
+    """新增主機上線區間表，並由既有掃描紀錄建立區間"""
+    # 主機連續出現在同網段掃描中的期間；時間取自掃描的 scan_time，不依賴 scans 列仍存在
+    conn.execute("""
+        CREATE TABLE host_presence (
+            id INTEGER PRIMARY KEY,
+            host_id INTEGER NOT NULL REFERENCES hosts(id),
+            first_scan INTEGER NOT NULL,
+            last_scan INTEGER NOT NULL,
+            started_at TIMESTAMP NOT NULL,
+            ended_at TIMESTAMP NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX idx_host_presence_last ON host_presence(last_scan, host_id)")
+    conn.execute("CREATE INDEX idx_host_presence_host ON host_presence(host_id, ended_at)")
+    conn.execute("CREATE INDEX idx_host_presence_ended ON host_presence(ended_at)")
+
+    _rebuild_presence(conn, [row[0] for row in conn.execute("SELECT id FROM hosts")])
+
+
+def _enable_incremental_vacuum(conn):
+    """auto_vacuum 模式只能在 VACUUM 時變更；VACUUM 不能在交易中執行，因此先結束目前交易"""
+    conn.commit()
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+
+
+def _add_analysis_cache(conn):
+    conn.execute("""
+        CREATE TABLE analysis_cache (
+            key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            response TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX idx_analysis_cache_used ON analysis_cache(last_used)")
+
+
+def _add_query_indexes(conn):
+    """歷史與裝置查詢的篩選條件各自需要的索引（host_attributes 的索引隱含主鍵，為涵蓋索引）"""
+    conn.execute("CREATE INDEX idx_scans_deep ON scans(deep_scan, id)")
+    conn.execute("CREATE INDEX idx_scans_subnet_deep ON scans(subnet, deep_scan, id)")
+    conn.execute("CREATE INDEX idx_host_attributes_ip ON host_attributes(ip)")
+    conn.execute("CREATE INDEX idx_host_attributes_vendor ON host_attributes(vendor)")
+    conn.execute("CREATE INDEX idx_host_attributes_hostname ON host_attributes(hostname)")
+
+
+# 查詢用的最大掃描 ID（不設上限）
+_NO_LIMIT = 2 ** 63 - 1
+
+# 裝置查詢中，符合條件的（主機, 掃描區間）超過此數量時，改為依掃描順序逐筆檢查
+# （條件涵蓋的主機很多時，符合的紀錄很密集，逐筆檢查很快就能填滿一頁）
+MAX_OBSERVATION_RANGES = 256
+
+
+def _ip_ranges(value):
+    """
+    將 IP 或 CIDR 轉為 ip 欄位（文字）上的範圍條件
+    點分隔的位址依字串排序時，同一個八位元組前綴（例如 "192.168.1."）的位址是連續的一段，
+    因此 CIDR 可拆成最多 256 個前綴範圍或個別位址，每一段都能以 ip 索引查找。
+    :param value: 例如 "192.168.1.5"、"10.0.0.0/8"、"192.168.16.0/20"
+    :return: [(low, high), ...]，條件為 ip BETWEEN low AND high；空列表表示不限制
+    """
+    network = ipaddress.ip_network(value, strict=False)
+    if network.version != 4:
+        raise ValueError(f"Only IPv4 addresses are supported: {value}")
+    if network.prefixlen == 0:
+        return []
+    if network.prefixlen > 24:
+        return [(str(address), str(address)) for address in network]
+
+    # 對齊到下一個八位元組邊界，每個子網對應一個前綴；"/" 在 ASCII 中緊接在 "." 之後
+    boundary = -(-network.prefixlen // 8) * 8
+    ranges = []
+    for subnet in network.subnets(new_prefix=boundary):
+        prefix = ".".join(str(subnet.network_address).split(".")[:boundary // 8])
+        ranges.append((prefix + ".", prefix + "/"))
+    return ranges
+
+
+def _like_pattern(text):
+    """不分大小寫的子字串比對樣式（跳脫 LIKE 的萬用字元）"""
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def _parse_cursor(cursor, parts):
+    """
+    解析分頁游標
+    :param cursor: 上一頁回傳的游標，例如 "1234" 或 "1234.56"
+    :param parts: 游標包含幾個整數
+    :return: 整數 tuple
+    """
+    values = tuple(int(part) for part in str(cursor).split("."))
+    if len(values) != parts:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return values
+
+
+def _scan_id_bounds(conn, since, until):
+    """
+    將時間範圍轉為掃描 ID 範圍（掃描 ID 隨時間遞增），各以一次 idx_scans_scan_time 查找
+    :return: (最小 ID, 最大 ID)，範圍內沒有掃描時 low > high
+    """
+    low, high = 0, _NO_LIMIT
+    if since:
+        row = conn.execute(
+            "SELECT id FROM scans WHERE scan_time >= ? ORDER BY scan_time, id LIMIT 1", (_to_timestamp(since),)
+        ).fetchone()
+        low = row[0] if row else _NO_LIMIT
+    if until:
+        row = conn.execute(
+            "SELECT id FROM scans WHERE scan_time <= ? ORDER BY scan_time DESC, id DESC LIMIT 1",
+            (_to_timestamp(until),)
+        ).fetchone()
+        high = row[0] if row else -1
+    return low, high
+
+
+def _intersect_ranges(left, right):
+    """兩組掃描 ID 區間（閉區間）的交集"""
+    ranges = []
+    for left_low, left_high in left:
+        for right_low, right_high in right:
+            low, high = max(left_low, right_low), min(left_high, right_high)
+            if low <= high:
+                ranges.append((low, high))
+    return ranges
+
+
+def _observation_filters(mac, attributes, port, subnet):
+    """
+    每筆觀測紀錄（scan_hosts sh、scans s）須符合的條件，兩種查詢方式共用
+    :param attributes: (SQL 條件, 參數)，條件以 a 代表掃描當下的屬性版本
+    :return: (額外的 JOIN, [條件], [參數])
+    """
+    join = ""
+    conditions = []
+    params = []
+    if mac:
+        conditions.append("sh.host_id = (SELECT id FROM hosts WHERE mac = ?)")
+        params.append(mac.lower())
+    if attributes:
+        join = """
+            CROSS JOIN host_attributes a ON a.host_id = sh.host_id AND a.scan_id = (
+                SELECT MAX(scan_id) FROM host_attributes
+                WHERE host_id = sh.host_id AND scan_id <= sh.scan_id
+            )
+        """
+        conditions.append(attributes[0])
+        params.extend(attributes[1])
+    if port is not None:
+        conditions.append("""s.deep_scan = 1 AND EXISTS (
+            SELECT 1 FROM host_ports hp INDEXED BY idx_host_ports_lookup
+            WHERE hp.host_id = sh.host_id AND hp.port = ?
+              AND hp.last_scan >= sh.scan_id AND hp.first_scan <= sh.scan_id
+        )""")
+        params.append(port)
+    if subnet is not None:
+        conditions.append("s.subnet = ?")
+        params.append(subnet)
+    return join, conditions, params
+
+
+def _observation_ranges(conn, mac, attributes, port, max_ranges):
+    """
+    依主機相關條件以索引找出可能符合的（主機, 掃描 ID 區間）
+    - MAC：該主機的所有掃描
+    - IP/廠商/主機名稱：符合的屬性版本，從生效的掃描到下一個版本之前
+    - 開放埠：該埠的開放區間
+    多個條件取交集；單獨符合超過 max_ranges 個區間的條件，改為只查詢其他條件找到的主機。
+    :param attributes: (SQL 條件, 參數)，條件以 a 代表 host_attributes
+    :return: [(host_id, low, high), ...]；沒有可用的條件時回傳 None
+    """
+    def restrict(column, hosts, limit):
+        """只查詢指定主機（hosts 為 None 時不限制），並限制筆數"""
+        sql = "" if hosts is None else f" AND {column} IN ({','.join('?' * len(hosts))})"
+        if limit is not None:
+            sql += f" LIMIT {limit + 1}"
+        return sql, list(hosts or [])
+
+    def attribute_ranges(hosts, limit):
+        where, params = attributes
+        restriction, host_params = restrict("a.host_id", hosts, limit)
+        rows = conn.execute(f"""
+            SELECT a.host_id, a.scan_id AS low, (
+                SELECT MIN(n.scan_id) - 1 FROM host_attributes n
+                WHERE n.host_id = a.host_id AND n.scan_id > a.scan_id
+            ) AS high
+            FROM host_attributes a
+            WHERE {where}{restriction}
+        """, (*params, *host_params)).fetchall()
+        return rows
+
+    def port_ranges(hosts, limit):
+        restriction, host_params = restrict("host_id", hosts, limit)
+        return conn.execute(
+            f"SELECT host_id, first_scan AS low, last_scan AS high FROM host_ports WHERE port = ?{restriction}",
+            (port, *host_params)
+        ).fetchall()
+
+    def by_host(rows):
+        matched = {}
+        for row in rows:
+            high = _NO_LIMIT if row["high"] is None else row["high"]
+            matched.setdefault(row["host_id"], []).append((row["low"], high))
+        return matched
+
+    def intersect(left, right):
+        return {
+            host_id: _intersect_ranges(ranges, right[host_id])
+            for host_id, ranges in left.items() if host_id in right
+        }
+
+    combined = None
+    if mac:
+        row = conn.execute("SELECT id FROM hosts WHERE mac = ?", (mac.lower(),)).fetchone()
+        if row is None:
+            return []
+        combined = {row[0]: [(0, _NO_LIMIT)]}
+
+    queries = []
+    if attributes:
+        queries.append(attribute_ranges)
+    if port is not None:
+        queries.append(port_ranges)
+
+    deferred = []
+    for query in queries:
+        hosts = None if combined is None else list(combined)
+        rows = query(hosts, max_ranges if hosts is None else None)
+        if hosts is None and len(rows) > max_ranges:
+            deferred.append(query)
+            continue
+        combined = by_host(rows) if combined is None else intersect(combined, by_host(rows))
+    if combined is None:
+        return None
+    for query in deferred:
+        combined = intersect(combined, by_host(query(list(combined), None)))
+    return [(host_id, low, high) for host_id, ranges in combined.items() for low, high in ranges]
+
+
+def _merge_ranges(ranges, fetch, count):
+    """
+    依 (scan_id, host_id) 由新到舊合併各區間的觀測紀錄，需要時才查詢區間
+    區間依上限由高到低開啟：目前最新的一筆比所有尚未開啟區間的上限都新時即可輸出，
+    因此一頁通常只需查詢少數幾個區間。
+    :param ranges: [(host_id, low, high), ...]，同一主機的區間互不重疊
+    :param fetch: fetch(host_id, low, high, count)，回傳區間內由新到舊的 [(scan_id, host_id), ...]
+    :param count: 要取得幾筆
+    :return: [(scan_id, host_id), ...]
+    """
+    ranges = sorted(ranges, key=lambda r: r[2], reverse=True)
+    heap = []
+    keys = []
+    opened = 0
+    while len(keys) < count:
+        next_high = ranges[opened][2] if opened < len(ranges) else -1
+        if heap and -heap[0][0] > next_high:
+            _, _, rows, position = heapq.heappop(heap)
+            keys.append(rows[position])
+            if position + 1 < len(rows):
+                scan_id, host_id = rows[position + 1]
+                heapq.heappush(heap, (-scan_id, -host_id, rows, position + 1))
+        elif opened < len(ranges):
+            rows = fetch(*ranges[opened], count - len(keys))
+            opened += 1
+            if rows:
+                heapq.heappush(heap, (-rows[0][0], -rows[0][1], rows, 0))
+        else:
+            break
+    return keys
+
+
+def _observation_details(conn, keys):
+    """
+    取得一頁觀測紀錄的內容：掃描當下的屬性版本，深度掃描時附上當下開放的埠
+    :param keys: [(scan_id, host_id), ...]
+    :return: 與 keys 同順序的觀測紀錄列表
+    """
+    if not keys:
+        return []
+    page = ", ".join("(?, ?)" for _ in keys)
+    params = [value for key in keys for value in key]
+    rows = conn.execute(f"""
+        WITH page(scan_id, host_id) AS (VALUES {page})
+        SELECT page.scan_id, page.host_id, s.scan_time, s.subnet, s.deep_scan,
+               h.mac, a.ip, a.vendor, a.hostname
+        FROM page
+        JOIN scans s ON s.id = page.scan_id
+        JOIN hosts h ON h.id = page.host_id
+        JOIN host_attributes a ON a.host_id = page.host_id AND a.scan_id = (
+            SELECT MAX(scan_id) FROM host_attributes
+            WHERE host_id = page.host_id AND scan_id <= page.scan_id
+        )
+    """, params).fetchall()
+    port_rows = conn.execute(f"""
+        WITH page(scan_id, host_id) AS (VALUES {page})
+        SELECT page.scan_id, page.host_id, hp.port, hp.service
+        FROM page
+        JOIN scans s ON s.id = page.scan_id AND s.deep_scan = 1
+        JOIN host_ports hp INDEXED BY idx_host_ports_host
+            ON hp.host_id = page.host_id AND hp.last_scan >= page.scan_id
+        WHERE hp.first_scan <= page.scan_id
+        ORDER BY hp.port
+    """, params)
+    ports = {}
+    for row in port_rows:
+        ports.setdefault((row["scan_id"], row["host_id"]), []).append(
+            {"port": row["port"], "service": row["service"]}
+        )
+
+    observations = {}
+    for row in rows:
+        key = (row["scan_id"], row["host_id"])
+        observations[key] = {
+            "scan_id": row["scan_id"],
+            "scan_time": row["scan_time"],
+            "subnet": row["subnet"],
+            "mac": row["mac"],
+            "ip": row["ip"],
+            "vendor": row["vendor"],
+            "hostname": row["hostname"],
+            "ports": ports.get(key, []),
+        }
+    return [observations[key] for key in keys if key in observations]
+
+
+# 資料庫結構遷移，依序套用一次，版本記錄於 PRAGMA user_version
+# 每一項可以是 SQL script 或 function(conn)
+MIGRATIONS = [
+    # 1: 初始結構
+    """
+    CREATE TABLE IF NOT EXISTS scans (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        scan_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        device_count INTEGER,
+        subnet TEXT,
+        deep_scan INTEGER DEFAULT 0
+    );
+
+    CREATE TABLE IF NOT EXISTS devices (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        scan_id INTEGER,
+        ip TEXT,
+        mac TEXT,
+        vendor TEXT,
+        hostname TEXT,
+        open_ports TEXT,
+        FOREIGN KEY (scan_id) REFERENCES scans(id)
+    );
+
+    -- 裝置資訊快取表（廠商/主機名稱/開放埠）
+    CREATE TABLE IF NOT EXISTS enrichment_cache (
+        field TEXT,
+        mac TEXT,
+        ip TEXT,
+        value TEXT,
+        updated_at REAL,
+        PRIMARY KEY (field, mac, ip)
+    );
+    """,
+    # 2: 常用查詢的索引
+    """
+    CREATE INDEX IF NOT EXISTS idx_devices_scan_id ON devices(scan_id);
+    CREATE INDEX IF NOT EXISTS idx_devices_mac ON devices(mac);
+    CREATE INDEX IF NOT EXISTS idx_scans_scan_time ON scans(scan_time);
+    """,
+    # 3: 正規化的主機/出現紀錄/開放埠結構，取代 devices 表
+    _migrate_to_normalized_schema,
+    # 4: 掃描差異
+    _add_scan_diffs,
+    # 5: 主機上線區間
+    _add_host_presence,
+    # 6: 改為增量式 VACUUM，讓保留政策刪除資料後能逐步歸還空間
+    _enable_incremental_vacuum,
+    # 7: AI 分析結果快取
+    _add_analysis_cache,
+    # 8: 歷史與裝置查詢的篩選索引
+    _add_query_indexes,
+]
+
 
 class Database:
-    """SQLite 資料庫管理類別，用於儲存掃描歷史"""
+    """
+    SQLite 資料庫管理類別，用於儲存掃描歷史
+    每個執行緒保留一條長期連線（WAL 模式），不再每次呼叫都重新連線。
+    """
     
     def __init__(self, db_path=None):
         self.db_path = db_path or DB_PATH
+        self._local = threading.local()
         self._init_db()
+
+    def _connect(self):
+        """取得目前執行緒的連線（第一次使用時建立）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path)
+            conn.row_factory = sqlite3.Row
+            for pragma in CONNECTION_PRAGMAS:
+                conn.execute(pragma)
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        """關閉目前執行緒的連線"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
     
     def _init_db(self):
-        """初始化資料庫結構"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            # 掃描記錄表
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS scans (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    scan_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    device_count INTEGER,
-                    subnet TEXT,
-                    deep_scan INTEGER DEFAULT 0
-                )
-            """)
-            
-            # 裝置記錄表
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS devices (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    scan_id INTEGER,
-                    ip TEXT,
-                    mac TEXT,
-                    vendor TEXT,
-                    hostname TEXT,
-                    open_ports TEXT,
-                    FOREIGN KEY (scan_id) REFERENCES scans(id)
-                )
-            """)
-            
-            conn.commit()
-            logger.info(f"Database initialized at {self.db_path}")
+        """初始化資料庫結構，套用尚未執行的遷移"""
+        conn = self._connect()
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            with conn:
+                if callable(migration):
+                    migration(conn)
+                else:
+                    conn.executescript(migration)
+                conn.execute(f"PRAGMA user_version = {number}")
+            logger.info(f"Applied database migration {number}")
+
+        logger.info(f"Database initialized at {self.db_path}")
     
+    @DB_SECONDS.timed(operation="save_scan")
     def save_scan(self, devices, subnet, deep_scan=False):
         """
         儲存掃描結果
@@ -58,38 +999,12 @@ class Database:
         :param deep_scan: 是否為深度掃描
         :return: 掃描記錄 ID
         """
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            # 插入掃描記錄
-            cursor.execute("""
-                INSERT INTO scans (device_count, subnet, deep_scan)
-                VALUES (?, ?, ?)
-            """, (len(devices), subnet, 1 if deep_scan else 0))
-            
-            scan_id = cursor.lastrowid
-            
-            # 插入裝置記錄
-            for device in devices:
-                if "error" in device:
-                    continue
-                    
-                ports_json = json.dumps(device.get("ports", []))
-                cursor.execute("""
-                    INSERT INTO devices (scan_id, ip, mac, vendor, hostname, open_ports)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, (
-                    scan_id,
-                    device.get("ip"),
-                    device.get("mac"),
-                    device.get("vendor"),
-                    device.get("hostname"),
-                    ports_json
-                ))
+        conn = self._connect()
+        with conn:
+            scan_id = _insert_scan(conn, devices, subnet, deep_scan)
             
-            conn.commit()
-            logger.info(f"Saved scan #{scan_id} with {len(devices)} devices")
-            return scan_id
+        logger.info(f"Saved scan #{scan_id} with {len(devices)} devices")
+        return scan_id
     
     def get_scan_history(self, limit=20):
         """
@@ -97,69 +1012,540 @@ class Database:
         :param limit: 最多回傳幾筆
         :return: 掃描記錄列表
         """
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT id, scan_time, device_count, subnet, deep_scan
-                FROM scans
-                ORDER BY scan_time DESC
+        return self.query_scans(limit)["scans"]
+
+    @DB_SECONDS.timed(operation="query_scans")
+    def query_scans(self, limit=20, cursor=None, subnet=None, deep_scan=None, since=None, until=None):
+        """
+        分頁查詢掃描記錄（新到舊）
+        以上一頁最後一筆的 ID 為游標（keyset 分頁），任何一頁都只是一次索引範圍查找，不會隨頁數變慢
+        :param limit: 每頁筆數
+        :param cursor: 上一頁回傳的 next_cursor，未指定時從最新的掃描開始
+        :param subnet: 只查詢此網段
+        :param deep_scan: True/False 只查詢深度/快速掃描
+        :param since: 掃描時間下限（ISO 格式，UTC）
+        :param until: 掃描時間上限（ISO 格式，UTC）
+        :return: {"scans": [...], "next_cursor": 下一頁的游標，沒有下一頁時為 None}
+        """
+        conn = self._connect()
+        low, high = _scan_id_bounds(conn, since, until)
+        if cursor is not None:
+            high = min(high, _parse_cursor(cursor, 1)[0] - 1)
+
+        conditions = ["id BETWEEN ? AND ?"]
+        params = [low, high]
+        if subnet is not None:
+            conditions.append("subnet = ?")
+            params.append(subnet)
+        if deep_scan is not None:
+            conditions.append("deep_scan = ?")
+            params.append(1 if deep_scan else 0)
+
+        rows = conn.execute(f"""
+            SELECT id, scan_time, device_count, subnet, deep_scan
+            FROM scans
+            WHERE {" AND ".join(conditions)}
+            ORDER BY id DESC
+            LIMIT ?
+        """, (*params, limit + 1)).fetchall()
+        scans = [dict(row) for row in rows[:limit]]
+        next_cursor = str(scans[-1]["id"]) if len(rows) > limit else None
+        return {"scans": scans, "next_cursor": next_cursor}
+
+    @DB_SECONDS.timed(operation="query_observations")
+    def query_observations(self, mac=None, ip=None, vendor=None, hostname=None, port=None,
+                           subnet=None, since=None, until=None, limit=100, cursor=None):
+        """
+        跨掃描查詢裝置觀測紀錄（每次掃描中出現的每台主機一筆，新到舊），以 keyset 分頁
+        - 有主機相關條件時，先以索引找出可能符合的（主機, 掃描區間），每個區間沿 scan_hosts 索引取一頁再合併
+        - 沒有主機相關條件（或符合的區間太多）時，依掃描由新到舊逐筆檢查，通常很快就能填滿一頁
+        兩種方式都從游標位置開始讀取，不會隨頁數變慢。
+        :param mac: MAC 位址（完整比對）
+        :param ip: IP 或 CIDR（僅 IPv4），比對該次掃描當下的 IP
+        :param vendor: 廠商（不分大小寫的子字串）
+        :param hostname: 主機名稱（不分大小寫的子字串）
+        :param port: 該次掃描開放的埠（只有深度掃描有埠資料）
+        :param subnet: 只查詢此網段的掃描
+        :param since: 掃描時間下限（ISO 格式，UTC）
+        :param until: 掃描時間上限（ISO 格式，UTC）
+        :param limit: 每頁筆數
+        :param cursor: 上一頁回傳的 next_cursor
+        :return: {"observations": [{"scan_id", "scan_time", "subnet", "mac", "ip", "vendor", "hostname", "ports"}, ...],
+                  "next_cursor": 下一頁的游標，沒有下一頁時為 None}
+        """
+        conn = self._connect()
+        low, high = _scan_id_bounds(conn, since, until)
+        after = _parse_cursor(cursor, 2) if cursor is not None else None
+
+        # 屬性條件（比對掃描當下的屬性版本）
+        attribute_conditions = []
+        attribute_params = []
+        if ip:
+            ranges = _ip_ranges(ip)
+            if ranges:
+                attribute_conditions.append("(" + " OR ".join(["a.ip BETWEEN ? AND ?"] * len(ranges)) + ")")
+                attribute_params.extend(value for bounds in ranges for value in bounds)
+        if vendor:
+            attribute_conditions.append("a.vendor LIKE ? ESCAPE '\\'")
+            attribute_params.append(_like_pattern(vendor))
+        if hostname:
+            attribute_conditions.append("a.hostname LIKE ? ESCAPE '\\'")
+            attribute_params.append(_like_pattern(hostname))
+        attributes = (" AND ".join(attribute_conditions), attribute_params) if attribute_conditions else None
+
+        join, conditions, params = _observation_filters(mac, attributes, port, subnet)
+        where = "".join(f" AND {condition}" for condition in conditions)
+
+        ranges = _observation_ranges(conn, mac, attributes, port, MAX_OBSERVATION_RANGES)
+        if ranges is not None and len(ranges) <= MAX_OBSERVATION_RANGES:
+            def fetch(host_id, range_low, range_high, count):
+                rows = conn.execute(f"""
+                    SELECT sh.scan_id, sh.host_id
+                    FROM scan_hosts sh INDEXED BY idx_scan_hosts_host
+                    CROSS JOIN scans s ON s.id = sh.scan_id
+                    {join}
+                    WHERE sh.host_id = ? AND sh.scan_id BETWEEN ? AND ?{where}
+                    ORDER BY sh.scan_id DESC
+                    LIMIT ?
+                """, (host_id, range_low, range_high, *params, count))
+                return [tuple(row) for row in rows]
+
+            # 區間先裁到時間範圍與游標之後
+            clipped = []
+            for host_id, range_low, range_high in ranges:
+                range_low, range_high = max(range_low, low), min(range_high, high)
+                if after is not None:
+                    range_high = min(range_high, after[0] if host_id < after[1] else after[0] - 1)
+                if range_low <= range_high:
+                    clipped.append((host_id, range_low, range_high))
+            keys = _merge_ranges(clipped, fetch, limit + 1)
+        else:
+            # 依掃描由新到舊逐筆檢查；CROSS JOIN 固定以 scans 為外層（網段/深度掃描條件可走 scans 的索引）
+            cursor_condition = ""
+            cursor_params = []
+            if after is not None:
+                high = min(high, after[0])
+                cursor_condition = " AND (sh.scan_id, sh.host_id) < (?, ?)"
+                cursor_params = list(after)
+            rows = conn.execute(f"""
+                SELECT sh.scan_id, sh.host_id
+                FROM scans s
+                CROSS JOIN scan_hosts sh ON sh.scan_id = s.id
+                {join}
+                WHERE s.id BETWEEN ? AND ?{cursor_condition}{where}
+                ORDER BY s.id DESC, sh.host_id DESC
                 LIMIT ?
-            """, (limit,))
-            
-            rows = cursor.fetchall()
-            return [dict(row) for row in rows]
+            """, (low, high, *cursor_params, *params, limit + 1)).fetchall()
+            keys = [tuple(row) for row in rows]
+
+        observations = _observation_details(conn, keys[:limit])
+        next_cursor = "{}.{}".format(*keys[limit - 1]) if len(keys) > limit else None
+        return {"observations": observations, "next_cursor": next_cursor}
     
+    def get_latest_scan_ids(self):
+        """
+        各網段最近一次掃描的 ID
+        :return: {subnet: scan_id}
+        """
+        rows = self._connect().execute("SELECT subnet, MAX(id) AS id FROM scans GROUP BY subnet").fetchall()
+        return {row["subnet"]: row["id"] for row in rows}
+
+    @DB_SECONDS.timed(operation="get_scan_details")
     def get_scan_details(self, scan_id):
         """
         取得特定掃描的詳細資訊
         :param scan_id: 掃描記錄 ID
         :return: 掃描資訊與裝置列表
         """
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            
-            # 取得掃描資訊
-            cursor.execute("""
-                SELECT id, scan_time, device_count, subnet, deep_scan
-                FROM scans WHERE id = ?
-            """, (scan_id,))
-            scan_row = cursor.fetchone()
-            
-            if not scan_row:
-                return None
-            
-            scan_info = dict(scan_row)
-            
-            # 取得裝置列表
-            cursor.execute("""
-                SELECT ip, mac, vendor, hostname, open_ports
-                FROM devices WHERE scan_id = ?
-            """, (scan_id,))
-            
-            devices = []
-            for row in cursor.fetchall():
-                device = dict(row)
-                device["ports"] = json.loads(device.pop("open_ports") or "[]")
-                devices.append(device)
-            
-            scan_info["devices"] = devices
-            return scan_info
+        conn = self._connect()
+
+        # 取得掃描資訊
+        scan_row = conn.execute("""
+            SELECT id, scan_time, device_count, subnet, deep_scan
+            FROM scans WHERE id = ?
+        """, (scan_id,)).fetchone()
+        
+        if not scan_row:
+            return None
+        
+        scan_info = dict(scan_row)
+        
+        devices = _scan_devices(conn, scan_id, scan_info["deep_scan"])
+        for device in devices:
+            del device["host_id"]
+        
+        scan_info["devices"] = devices
+        return scan_info
     
+    @DB_SECONDS.timed(operation="delete_scan")
     def delete_scan(self, scan_id):
-        """刪除掃描記錄"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM devices WHERE scan_id = ?", (scan_id,))
-            cursor.execute("DELETE FROM scans WHERE id = ?", (scan_id,))
-            conn.commit()
-            logger.info(f"Deleted scan #{scan_id}")
+        """
+        刪除掃描記錄
+        屬性版本與開放埠區間是「從某次掃描起生效」的紀錄，後續掃描仍會用到，因此保留；
+        只清除不再出現在任何掃描中的主機，並修正主機的最後出現紀錄。
+        """
+        conn = self._connect()
+        with conn:
+            _remove_scan(conn, scan_id)
+        logger.info(f"Deleted scan #{scan_id}")
+
+    @DB_SECONDS.timed(operation="get_scan_diff")
+    def get_scan_diff(self, scan_id):
+        """
+        取得掃描相對於同一網段上一次掃描的差異（儲存時已計算，直接讀取）
+        :param scan_id: 掃描記錄 ID
+        :return: {"scan_id", "base_scan_id", "subnet", "scan_time", "added": [...], "removed": [...], "changed": [...]}，
+                 找不到掃描時回傳 None
+        """
+        conn = self._connect()
+        scan_row = conn.execute(
+            "SELECT id, base_scan_id, subnet, scan_time FROM scans WHERE id = ?", (scan_id,)
+        ).fetchone()
+        if not scan_row:
+            return None
+
+        diff = {
+            "scan_id": scan_id, "base_scan_id": scan_row["base_scan_id"],
+            "subnet": scan_row["subnet"], "scan_time": scan_row["scan_time"],
+            "added": [], "removed": [], "changed": [],
+        }
+        rows = conn.execute("SELECT change, details FROM scan_diffs WHERE scan_id = ?", (scan_id,))
+        for row in rows:
+            diff[row["change"]].append(json.loads(row["details"]))
+        for entries in diff.values():
+            if isinstance(entries, list):
+                entries.sort(key=lambda d: d["mac"])
+        return diff
+
+    def iter_observations(self, subnet=None, since=None, until=None, chunk_size=1000):
+        """
+        依掃描順序逐批讀取觀測紀錄（匯出用），以游標每次取出 chunk_size 筆，不會一次載入整段歷史
+        連線屬於目前執行緒，需在同一個執行緒中迭代完畢
+        :param subnet: 只匯出此網段的掃描
+        :param since: 掃描時間下限（ISO 格式，UTC）
+        :param until: 掃描時間上限（ISO 格式，UTC）
+        :param chunk_size: 每批筆數
+        :return: 逐批產生 [{"scan_id", "scan_time", "subnet", "deep_scan", "mac", "ip", "vendor", "hostname",
+                 "ports"}, ...] 的 generator
+        """
+        conn = self._connect()
+        low, high = _scan_id_bounds(conn, since, until)
+        # 只匯出目前已存在的掃描，它們的開放埠都在下面的埠清單中
+        high = min(high, conn.execute("SELECT COALESCE(MAX(id), 0) FROM scans").fetchone()[0])
+        known_ports = [row[0] for row in conn.execute("SELECT DISTINCT port FROM host_ports ORDER BY port")]
+
+        conditions = ["s.id BETWEEN ? AND ?"]
+        params = [json.dumps(known_ports), low, high]
+        if subnet is not None:
+            conditions.append("s.subnet = ?")
+            params.append(subnet)
+
+        # 開放埠與 _scan_devices 相同：對每個已知的埠找涵蓋此掃描的區間
+        cursor = conn.execute(f"""
+            SELECT s.id AS scan_id, s.scan_time, s.subnet, s.deep_scan, h.mac, a.ip, a.vendor, a.hostname,
+                   CASE WHEN s.deep_scan THEN (
+                       SELECT json_group_array(json_object('port', hp.port, 'service', hp.service))
+                       FROM json_each(?) kp
+                       JOIN host_ports hp ON hp.id = (
+                           SELECT id FROM host_ports INDEXED BY idx_host_ports_lookup
+                           WHERE host_id = sh.host_id AND port = kp.value AND last_scan >= s.id
+                           ORDER BY last_scan LIMIT 1
+                       )
+                       WHERE hp.first_scan <= s.id
+                   ) END AS ports
+            FROM scans s
+            JOIN scan_hosts sh ON sh.scan_id = s.id
+            JOIN hosts h ON h.id = sh.host_id
+            JOIN host_attributes a ON a.host_id = sh.host_id AND a.scan_id = (
+                SELECT MAX(scan_id) FROM host_attributes
+                WHERE host_id = sh.host_id AND scan_id <= sh.scan_id
+            )
+            WHERE {" AND ".join(conditions)}
+            ORDER BY s.id, sh.host_id
+        """, params)
+        try:
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    return
+                yield [
+                    dict(row, deep_scan=bool(row["deep_scan"]), ports=json.loads(row["ports"] or "[]"))
+                    for row in rows
+                ]
+        finally:
+            cursor.close()
+
+    @DB_SECONDS.timed(operation="get_presence_timeline")
+    def get_presence_timeline(self, mac=None, since=None, until=None, limit=500):
+        """
+        取得主機上線區間（新到舊）
+        :param mac: 只查詢指定 MAC，未指定時查詢所有主機
+        :param since: 只回傳此時間之後仍在線的區間（ISO 格式，UTC）
+        :param until: 只回傳此時間之前已上線的區間（ISO 格式，UTC）
+        :param limit: 最多回傳幾筆
+        :return: [{"mac", "ip", "hostname", "started_at", "ended_at", "duration", "online"}, ...]
+                 duration 為秒數；online 表示該區間延續到所在網段的最新一次掃描
+        """
+        conditions = []
+        params = []
+        if mac:
+            conditions.append("h.mac = ?")
+            params.append(mac.lower())
+        if since:
+            conditions.append("p.ended_at >= ?")
+            params.append(_to_timestamp(since))
+        if until:
+            conditions.append("p.started_at <= ?")
+            params.append(_to_timestamp(until))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        rows = self._connect().execute(f"""
+            SELECT h.mac, h.ip, h.hostname, p.started_at, p.ended_at,
+                   p.last_scan = (
+                       SELECT MAX(latest.id) FROM scans latest
+                       WHERE latest.subnet IS (SELECT subnet FROM scans WHERE id = p.last_scan)
+                   ) AS online
+            FROM host_presence p JOIN hosts h ON h.id = p.host_id
+            {where}
+            ORDER BY p.ended_at DESC, p.id DESC
+            LIMIT ?
+        """, (*params, limit)).fetchall()
+
+        timeline = []
+        for row in rows:
+            entry = dict(row)
+            entry["online"] = bool(entry["online"])
+            entry["duration"] = (
+                datetime.fromisoformat(row["ended_at"]) - datetime.fromisoformat(row["started_at"])
+            ).total_seconds()
+            timeline.append(entry)
+        return timeline
+
+    @DB_SECONDS.timed(operation="get_hosts_with_port")
+    def get_hosts_with_port(self, port):
+        """
+        查詢目前開放指定埠的主機（以各主機最後一次深度掃描為準），使用 host_ports 索引
+        :param port: 埠號，例如 3389
+        :return: [{"mac", "ip", "vendor", "hostname", "service", "since_scan", "last_scan"}, ...]
+        """
+        rows = self._connect().execute("""
+            SELECT h.mac, h.ip, h.vendor, h.hostname, hp.service,
+                   hp.first_scan AS since_scan, hp.last_scan
+            FROM host_ports hp JOIN hosts h ON h.id = hp.host_id
+            WHERE hp.port = ? AND hp.last_scan = h.last_deep_scan
+            ORDER BY h.mac
+        """, (port,)).fetchall()
+        return [dict(row) for row in rows]
+
+
+class EnrichmentCache:
+    """
+    裝置資訊快取，讓重複掃描時不必重新查詢穩定的資訊
+    - 廠商與開放埠以 MAC 為 key，主機名稱以 (MAC, IP) 為 key
+    - 每個欄位有各自的 TTL，過期即視為未命中
+    - 記憶體內以 LRU 淘汰，並持久化到 SQLite（flush 時批次寫入）
+    """
+
+    # 各欄位有效秒數
+    DEFAULT_TTLS = {
+        "vendor": 7 * 24 * 3600,
+        "hostname": 3600,
+        "ports": 15 * 60,
+    }
+
+    def __init__(self, db, ttls=None, max_entries=4096):
+        """
+        :param db: Database 實例（使用其 SQLite 檔案持久化）
+        :param ttls: 覆寫各欄位 TTL，例如 {"ports": 60}
+        :param max_entries: 記憶體內最多保留幾筆
+        """
+        self.db = db
+        self.ttls = {**self.DEFAULT_TTLS, **(ttls or {})}
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (field, mac, ip) -> (value, updated_at)
+        self._dirty = {}
+        self._lock = threading.Lock()
+        self._stats = {field: {"hits": 0, "misses": 0} for field in self.ttls}
+
+    @staticmethod
+    def _key(field, mac, ip):
+        # 只有主機名稱以 IP 區分
+        return (field, mac.lower(), ip if field == "hostname" else "")
+
+    def _load(self, key):
+        """記憶體未命中時從 SQLite 讀取"""
+        row = self.db._connect().execute("""
+            SELECT value, updated_at FROM enrichment_cache
+            WHERE field = ? AND mac = ? AND ip = ?
+        """, key).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def get(self, field, mac, ip=None):
+        """
+        取得快取值
+        :param field: "vendor" | "hostname" | "ports"
+        :return: (是否命中, 值)
+        """
+        key = self._key(field, mac, ip)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None:
+            entry = self._load(key)
+            if entry is not None:
+                with self._lock:
+                    self._store(key, entry)
+
+        fresh = entry is not None and time.time() - entry[1] < self.ttls[field]
+        with self._lock:
+            self._stats[field]["hits" if fresh else "misses"] += 1
+        return (True, entry[0]) if fresh else (False, None)
+
+    def put(self, field, mac, value, ip=None):
+        """寫入快取（記憶體立即生效，SQLite 於 flush 時寫入）"""
+        key = self._key(field, mac, ip)
+        entry = (value, time.time())
+        with self._lock:
+            self._store(key, entry)
+            self._dirty[key] = entry
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def flush(self):
+        """將尚未持久化的項目批次寫入 SQLite"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        if not dirty:
+            return
+        conn = self.db._connect()
+        with conn:
+            conn.executemany("""
+                INSERT OR REPLACE INTO enrichment_cache (field, mac, ip, value, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, [(*key, json.dumps(value), updated_at) for key, (value, updated_at) in dirty.items()])
+            # 順便清除所有欄位都已過期的舊資料
+            conn.execute(
+                "DELETE FROM enrichment_cache WHERE updated_at < ?",
+                (time.time() - max(self.ttls.values()),)
+            )
+
+    def stats(self):
+        """
+        命中統計
+        :return: {"size": ..., "hits": ..., "misses": ..., "fields": {"vendor": {"hits": .., "misses": ..}, ...}}
+        """
+        with self._lock:
+            fields = {field: dict(counts) for field, counts in self._stats.items()}
+            size = len(self._entries)
+        return {
+            "size": size,
+            "hits": sum(c["hits"] for c in fields.values()),
+            "misses": sum(c["misses"] for c in fields.values()),
+            "fields": fields,
+        }
+
+
+class AnalysisCache:
+    """
+    AI 分析結果快取，網路沒有變化時不必重新呼叫模型
+    - key 由呼叫端計算（裝置清單的正規化雜湊 + 模型名稱）
+    - 直接讀寫 SQLite，重啟後仍有效
+    - 超過 max_age 的項目失效；總數或總大小超過上限時淘汰最久未使用的項目
+    """
+
+    def __init__(self, db, max_entries=200, max_bytes=16 * 1024 * 1024, max_age=7 * 24 * 3600):
+        """
+        :param db: Database 實例
+        :param max_entries: 最多保留幾筆分析結果
+        :param max_bytes: 分析結果總大小上限（UTF-8 位元組）
+        :param max_age: 有效秒數
+        """
+        self.db = db
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def get(self, key):
+        """
+        取得快取的分析結果並更新使用時間
+        :return: 分析文字，未命中或已過期時為 None
+        """
+        now = time.time()
+        conn = self.db._connect()
+        row = conn.execute(
+            "SELECT response FROM analysis_cache WHERE key = ? AND created_at >= ?",
+            (key, now - self.max_age)
+        ).fetchone()
+        if row is not None:
+            with conn:
+                conn.execute("UPDATE analysis_cache SET last_used = ? WHERE key = ?", (now, key))
+        with self._lock:
+            self._stats["misses" if row is None else "hits"] += 1
+        return None if row is None else row[0]
+
+    def put(self, key, model, response):
+        """寫入分析結果，並依時間、數量與大小淘汰舊項目"""
+        now = time.time()
+        conn = self.db._connect()
+        with conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO analysis_cache (key, model, response, size, created_at, last_used)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (key, model, response, len(response.encode()), now, now))
+            evicted = conn.execute(
+                "DELETE FROM analysis_cache WHERE created_at < ?", (now - self.max_age,)
+            ).rowcount
+            # 由新到舊累計筆數與大小，超出任一上限的舊項目刪除
+            evicted += conn.execute("""
+                DELETE FROM analysis_cache WHERE key IN (
+                    SELECT key FROM (
+                        SELECT key,
+                               ROW_NUMBER() OVER w AS rank,
+                               SUM(size) OVER w AS total
+                        FROM analysis_cache
+                        WINDOW w AS (ORDER BY last_used DESC, created_at DESC)
+                    )
+                    WHERE rank > ? OR total > ?
+                )
+            """, (self.max_entries, self.max_bytes)).rowcount
+        with self._lock:
+            self._stats["stores"] += 1
+            self._stats["evictions"] += evicted
+
+    def invalidate(self, key=None):
+        """刪除指定項目，key 為 None 時清空整個快取"""
+        conn = self.db._connect()
+        with conn:
+            if key is None:
+                conn.execute("DELETE FROM analysis_cache")
+            else:
+                conn.execute("DELETE FROM analysis_cache WHERE key = ?", (key,))
+
+    def stats(self):
+        """
+        命中統計與目前大小
+        :return: {"entries": ..., "bytes": ..., "hits": ..., "misses": ..., "stores": ..., "evictions": ...}
+        """
+        row = self.db._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM analysis_cache"
+        ).fetchone()
+        with self._lock:
+            return {"entries": row[0], "bytes": row[1], **self._stats}
 
 
 # 全域資料庫實例
 _db = None
+_cache = None
+_analysis_cache = None
 
 def get_database():
     """取得全域資料庫實例"""
@@ -169,6 +1555,22 @@ def get_database():
     return _db
 
 
+def get_enrichment_cache():
+    """取得全域裝置資訊快取"""
+    global _cache
+    if _cache is None:
+        _cache = EnrichmentCache(get_database())
+    return _cache
+
+
+def get_analysis_cache():
+    """取得全域 AI 分析結果快取"""
+    global _analysis_cache
+    if _analysis_cache is None:
+        _analysis_cache = AnalysisCache(get_database())
+    return _analysis_cache
+
+
 if __name__ == "__main__":
     # 測試用
     db = Database()
@@ -0,0 +1,167 @@
+"""
+掃描歷史匯出
+在獨立的執行緒中以 SQLite 游標逐批讀取觀測紀錄，編碼為 CSV / NDJSON / JSON（可選 gzip），
+經由有界佇列交給 event loop 串流送出；用戶端讀得慢時讀取端會暫停，記憶體用量與歷史大小無關。
+"""
+
+import asyncio
+import concurrent.futures
+import csv
+import io
+import json
+import logging
+import threading
+import zlib
+from datetime import datetime
+
+from database import _to_timestamp
+
+logger = logging.getLogger(__name__)
+
+# 匯出格式與 Content-Type
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+    "json": "application/json",
+}
+
+CSV_COLUMNS = ["scan_id", "scan_time", "subnet", "deep_scan", "mac", "ip", "vendor", "hostname", "ports"]
+
+_END = object()
+
+
+def _encode_csv(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for rows in chunks:
+        for row in rows:
+            ports = " ".join(f"{p['port']}/{p['service']}" if p["service"] else str(p["port"]) for p in row["ports"])
+            writer.writerow([*(row[column] for column in CSV_COLUMNS[:-1]), ports])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def _encode_ndjson(chunks):
+    for rows in chunks:
+        yield "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+
+
+def _encode_json(chunks):
+    separator = "[\n"
+    for rows in chunks:
+        yield separator + ",\n".join(json.dumps(row, ensure_ascii=False) for row in rows)
+        separator = ",\n"
+    yield "[]\n" if separator == "[\n" else "\n]\n"
+
+
+_ENCODERS = {"csv": _encode_csv, "ndjson": _encode_ndjson, "json": _encode_json}
+
+
+def _gzip(pieces):
+    """以 gzip 格式逐段壓縮"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for piece in pieces:
+        data = compressor.compress(piece)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class ScanExport:
+    """
+    一次匯出
+    每一列是某次掃描中出現的一台主機（與 /api/devices 相同的欄位），依掃描順序排列
+    """
+
+    def __init__(self, db, fmt="csv", subnet=None, since=None, until=None, compress=False,
+                 chunk_size=1000, max_chunks=8):
+        """
+        :param db: Database 實例
+        :param fmt: csv / ndjson / json
+        :param subnet: 只匯出此網段
+        :param since: 掃描時間下限（ISO 格式，UTC）
+        :param until: 掃描時間上限（ISO 格式，UTC）
+        :param compress: 是否以 gzip 壓縮
+        :param chunk_size: 每次從資料庫讀取的筆數
+        :param max_chunks: 尚未送出的區塊上限（超過時暫停讀取）
+        """
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unsupported export format: {fmt}")
+        for value in (since, until):
+            if value:
+                _to_timestamp(value)
+        self.db = db
+        self.fmt = fmt
+        self.subnet = subnet
+        self.since = since
+        self.until = until
+        self.compress = compress
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks
+
+    @property
+    def media_type(self):
+        return "application/gzip" if self.compress else EXPORT_FORMATS[self.fmt]
+
+    @property
+    def filename(self):
+        name = f"whodis-{datetime.now():%Y%m%d-%H%M%S}.{self.fmt}"
+        return name + ".gz" if self.compress else name
+
+    def _pieces(self, observations):
+        """編碼後的區塊（bytes），在讀取執行緒中產生"""
+        pieces = (piece.encode("utf-8") for piece in _ENCODERS[self.fmt](observations))
+        return _gzip(pieces) if self.compress else pieces
+
+    def _produce(self, loop, chunks, stop):
+        """讀取執行緒：依序放入佇列，佇列滿時等待；用戶端中斷（stop）時停止"""
+        def put(item):
+            future = asyncio.run_coroutine_threadsafe(chunks.put(item), loop)
+            while True:
+                try:
+                    future.result(timeout=0.5)
+                    return True
+                except concurrent.futures.TimeoutError:
+                    if stop.is_set():
+                        future.cancel()
+                        return False
+
+        observations = self.db.iter_observations(self.subnet, self.since, self.until, self.chunk_size)
+        try:
+            for piece in self._pieces(observations):
+                if not put(piece):
+                    logger.info("Export cancelled by client")
+                    return
+            put(_END)
+        except Exception as e:
+            logger.error(f"Export failed: {e}")
+            put(e)
+        finally:
+            # 先關閉游標再關閉此執行緒的連線
+            observations.close()
+            self.db.close()
+
+    async def stream(self):
+        """
+        非同步產生匯出內容（供 StreamingResponse 使用）
+        :return: bytes 的 async generator
+        """
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue(maxsize=self.max_chunks)
+        stop = threading.Event()
+        producer = threading.Thread(
+            target=self._produce, args=(loop, chunks, stop), daemon=True, name="whodis-export"
+        )
+        producer.start()
+        try:
+            while True:
+                item = await chunks.get()
+                if item is _END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
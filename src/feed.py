@@ -0,0 +1,153 @@
+"""
+即時裝置動態
+每次掃描儲存後，將與同一網段上一次掃描的差異（主機上線、離線、屬性變更）推送給所有訂閱者。
+新訂閱者先收到各網段最新掃描的完整快照，之後只收到差異。
+"""
+
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class _Subscriber:
+    """
+    單一訂閱者的有界佇列
+    累積的差異超過上限時（用戶端太慢）清空佇列，改為下次送出一份新的快照
+    """
+
+    def __init__(self, max_queue):
+        self.max_queue = max_queue
+        self.messages = deque()
+        self.resync = False
+        self.ready = asyncio.Event()
+
+    def offer(self, message):
+        if not self.resync:
+            if len(self.messages) >= self.max_queue:
+                self.messages.clear()
+                self.resync = True
+            else:
+                self.messages.append(message)
+        self.ready.set()
+
+
+class DeviceFeed:
+    """
+    掃描差異的廣播
+    - 寫入執行緒通知掃描已儲存，差異在 event loop 中依儲存順序逐一讀取並廣播（每次掃描只讀一次）
+    - 每個訂閱者有自己的有界佇列，慢的訂閱者不會拖慢其他人，落後太多時改送快照
+    """
+
+    def __init__(self, db=None, max_queue=32):
+        """
+        :param db: AsyncDatabase 實例（也可在 start 時指定）
+        :param max_queue: 每個訂閱者最多累積幾筆尚未送出的差異
+        """
+        self.db = db
+        self.max_queue = max_queue
+        self._subscribers = set()
+        self._pending = None
+        self._loop = None
+        self._task = None
+        self._stats = {"broadcasts": 0, "resyncs": 0}
+
+    def start(self, db=None):
+        """在 event loop 中開始處理通知（應用程式啟動時呼叫）"""
+        if db is not None:
+            self.db = db
+        self._loop = asyncio.get_running_loop()
+        self._pending = asyncio.Queue()
+        self._task = self._loop.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def notify(self, scan_id):
+        """掃描已儲存（可在任何執行緒呼叫，例如 AsyncDatabase 的寫入執行緒）"""
+        if self._task is not None:
+            self._loop.call_soon_threadsafe(self._pending.put_nowait, scan_id)
+
+    async def _run(self):
+        while True:
+            scan_id = await self._pending.get()
+            if not self._subscribers:
+                continue
+            try:
+                message = await self._delta(scan_id)
+            except Exception as e:
+                logger.error(f"Failed to load diff for scan #{scan_id}: {e}")
+                continue
+            if message is None:
+                continue
+            self._stats["broadcasts"] += 1
+            for subscriber in self._subscribers:
+                was_resync = subscriber.resync
+                subscriber.offer(message)
+                if subscriber.resync and not was_resync:
+                    self._stats["resyncs"] += 1
+
+    async def _delta(self, scan_id):
+        """掃描的差異訊息；沒有變化（或找不到掃描）時為 None"""
+        diff = await self.db.get_scan_diff(scan_id)
+        if diff is None or not (diff["added"] or diff["removed"] or diff["changed"]):
+            return None
+        return {
+            "type": "delta",
+            "scan_id": scan_id,
+            "subnet": diff["subnet"],
+            "scan_time": diff["scan_time"],
+            "up": diff["added"],
+            "down": diff["removed"],
+            "changed": diff["changed"],
+        }
+
+    async def snapshot(self):
+        """各網段最近一次掃描的裝置"""
+        latest = await self.db.get_latest_scan_ids()
+        scans = []
+        devices = []
+        for subnet, scan_id in sorted(latest.items(), key=lambda item: item[1], reverse=True):
+            details = await self.db.get_scan_details(scan_id)
+            if details is None:
+                continue
+            scans.append({"scan_id": scan_id, "subnet": subnet, "scan_time": details["scan_time"]})
+            devices.extend(dict(device, subnet=subnet) for device in details["devices"])
+        return {"type": "snapshot", "scans": scans, "devices": devices}
+
+    async def subscribe(self):
+        """
+        訂閱裝置動態：先回傳快照，之後回傳差異
+        快照已包含的掃描不會再以差異送出
+        """
+        subscriber = _Subscriber(self.max_queue)
+        # 先登記再讀取快照，讀取期間儲存的掃描不會遺漏
+        self._subscribers.add(subscriber)
+        try:
+            while True:
+                # 快照涵蓋之前累積的差異；讀取期間又累積過多時，下一輪重新送快照
+                subscriber.resync = False
+                subscriber.messages.clear()
+                snapshot = await self.snapshot()
+                covered = {scan["subnet"]: scan["scan_id"] for scan in snapshot["scans"]}
+                yield snapshot
+
+                while not subscriber.resync:
+                    await subscriber.ready.wait()
+                    subscriber.ready.clear()
+                    while subscriber.messages:
+                        message = subscriber.messages.popleft()
+                        if message["scan_id"] > covered.get(message["subnet"], 0):
+                            yield message
+        finally:
+            self._subscribers.discard(subscriber)
+
+    def stats(self):
+        return {"subscribers": len(self._subscribers), **self._stats}
@@ -0,0 +1,521 @@
+"""
+掃描工作協調
+- ScanCoordinator：同一組目標同時只執行一次掃描（single-flight），API、串流、定時掃描共用進行中的掃描，
+  也可接受一定秒數內的上次結果，避免多個分頁或用戶端同時觸發多次完整的 ARP 掃描；每次掃描只儲存一次最終結果
+- JobStore：非同步掃描工作，建立後立即回傳 ID，可訂閱進度、取消，完成的工作保留有限數量；
+  工作同樣經由 ScanCoordinator 執行，與其他請求共用進行中的掃描
+"""
+
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+def _failed(devices):
+    return any("error" in d for d in devices)
+
+
+class ScanFlight:
+    """
+    一次進行中的掃描
+    - 掃描事件依序記錄，串流的訂閱者中途加入時先補上已發生的事件
+    - 記錄最新進度並通知監看者（掃描工作）
+    - 計算等待中的請求數；可取消的請求全部放棄、且沒有其他請求等待時才停止掃描
+    """
+
+    def __init__(self, targets, deep_scan, base=None):
+        """
+        :param targets: CIDR tuple
+        :param deep_scan: 是否為深度掃描
+        :param base: 升級時為被升級的快速掃描（只補掃開放埠，不重新執行 ARP 掃描）
+        """
+        self.targets = targets
+        self.deep_scan = deep_scan
+        self.base = base
+        self.upgrade = None  # 快速掃描被升級時為升級後的深度掃描，由它儲存最終結果
+        self.scan_id = None
+        self.events = []
+        self.progress = None
+        self.started = False
+        self.finished = False
+        self.holders = 0
+        # 掃描執行緒檢查此旗標，設定後停止送出 ARP 並取消尚未完成的探測
+        self.cancel_event = threading.Event()
+        self.task = None
+        self._watchers = []
+        self._changed = asyncio.Event()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def start(self):
+        self.started = True
+        self._report()
+
+    def set_progress(self, snapshot):
+        self.progress = snapshot
+        self._report()
+
+    def watch(self, watcher):
+        """
+        監看開始與進度（已開始時立即呼叫一次）
+        :param watcher: watcher(flight)，在 event loop 中呼叫
+        :return: 取消監看的函式
+        """
+        self._watchers.append(watcher)
+        if self.started:
+            watcher(self)
+        return lambda: self._watchers.remove(watcher)
+
+    def _report(self):
+        for watcher in list(self._watchers):
+            watcher(self)
+
+    def add_event(self, event):
+        self.events.append(event)
+        self._notify()
+
+    def finish(self):
+        self.finished = True
+        self._notify()
+
+    def _notify(self):
+        # 喚醒等待中的訂閱者，之後的等待使用新的 Event
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def replay(self):
+        """依序回傳已發生與之後的掃描事件，掃描結束後停止"""
+        index = 0
+        while True:
+            while index < len(self.events):
+                yield self.events[index]
+                index += 1
+            if self.finished:
+                return
+            await self._changed.wait()
+
+
+class ScanCoordinator:
+    """
+    合併同時進行的相同掃描
+    - 目標相同且深度相同（或進行中的是深度掃描）的請求共用同一次掃描
+    - 快速掃描進行中時收到深度掃描請求，等快速掃描完成後只補掃開放埠，不重新執行 ARP 掃描；
+      此時只儲存補上開放埠後的深度掃描結果，不會另外儲存一筆快速掃描
+    - 保留每組目標最近一次成功的結果，請求可指定 max_age 直接取用
+    """
+
+    def __init__(self, run_scan, save, deepen=None, max_results=16, max_workers=2):
+        """
+        :param run_scan: 同步函式 run_scan(targets, deep_scan, progress, cancel) -> 掃描事件 iterator
+                         （見 NetworkScanner.scan_iter），在掃描執行緒中迭代
+        :param save: async 函式 save(devices, targets, deep_scan) -> 掃描記錄 ID，每次掃描完成時呼叫一次
+        :param deepen: 同步函式 deepen(devices) -> 裝置列表，為快速掃描結果補上開放埠；
+                       None 表示不升級，深度掃描請求另外執行
+        :param max_results: 最多保留幾組目標的最近結果
+        :param max_workers: 掃描執行緒數（不同目標可同時掃描）
+        """
+        self.run_scan = run_scan
+        self.save = save
+        self.deepen = deepen
+        self.max_results = max_results
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="whodis-scan")
+        self._flights = {}  # targets -> {deep_scan: ScanFlight}
+        self._results = OrderedDict()  # targets -> {deep_scan: (devices, scan_id, finished_at)}
+        self._stats = {"live": 0, "joined": 0, "cached": 0, "upgraded": 0, "abandoned": 0}
+
+    @staticmethod
+    def _key(targets):
+        return tuple(sorted(set(targets)))
+
+    def _recent(self, key, deep_scan, max_age):
+        """max_age 秒內最新的結果（深度掃描的結果也可回應快速掃描請求）"""
+        entries = self._results.get(key, {})
+        candidates = [(finished_at, deep, devices, scan_id) for deep, (devices, scan_id, finished_at) in entries.items()
+                      if deep or not deep_scan]
+        if not candidates:
+            return None
+        finished_at, deep, devices, scan_id = max(candidates, key=lambda c: c[0])
+        age = time.monotonic() - finished_at
+        return (devices, deep, scan_id, age) if age <= max_age else None
+
+    def _join(self, key, deep_scan):
+        """
+        取得可共用的進行中掃描，沒有時開始新的掃描
+        :return: (ScanFlight, "joined" | "upgraded" | "live")
+        """
+        # 已被放棄（正在停止）的掃描不再共用
+        flights = {deep: f for deep, f in self._flights.get(key, {}).items() if not f.cancelled}
+        # 快速掃描請求優先共用較快完成的快速掃描，其次是深度掃描；深度掃描請求只能共用深度掃描
+        flight = flights.get(True) if deep_scan else flights.get(False) or flights.get(True)
+        if flight is not None:
+            source = "joined"
+        else:
+            flights = self._flights.setdefault(key, {})
+            quick = flights.get(False)
+            if deep_scan and quick is not None and not quick.cancelled and self.deepen is not None:
+                source = "upgraded"
+                flight = quick.upgrade = ScanFlight(key, True, base=quick)
+                # 升級後的掃描也在等待快速掃描
+                quick.holders += 1
+                coro = self._upgrade(flight)
+            else:
+                source = "live"
+                flight = ScanFlight(key, deep_scan)
+                coro = self._scan(flight)
+            flights[deep_scan] = flight
+            flight.task = asyncio.create_task(coro)
+            flight.task.add_done_callback(lambda t: self._land(flight))
+        flight.holders += 1
+        self._stats[source] += 1
+        return flight, source
+
+    def _release(self, flight):
+        """可取消的請求放棄等待；沒有其他請求等待時停止掃描（結果不儲存）"""
+        flight.holders -= 1
+        if flight.holders > 0 or flight.task.done() or flight.cancelled:
+            return
+        logger.info(f"Abandoning scan of {', '.join(flight.targets)}: no requests left")
+        self._stats["abandoned"] += 1
+        flight.cancel_event.set()
+        if flight.base is not None:
+            self._release(flight.base)
+
+    async def scan(self, targets, deep_scan=False, max_age=None, watch=None, cancellable=False):
+        """
+        掃描（或取用進行中／最近的掃描）
+        :param targets: CIDR 列表
+        :param deep_scan: 是否需要開放埠
+        :param max_age: 可接受的最近結果秒數，None 表示一定要等新的掃描
+        :param watch: watch(flight)，掃描開始與每次進度更新時在 event loop 中呼叫（flight.started、flight.progress）
+        :param cancellable: 請求端被取消時是否放棄共用的掃描；預設不放棄，掃描照常完成並儲存
+        :return: {"devices": [...], "deep_scan": ..., "scan_id": ..., "source": "live" | "joined" | "upgraded" | "cached",
+                  "age": 秒}；scan_id 為儲存的掃描記錄（失敗或快速掃描被升級時為 None）
+        """
+        key = self._key(targets)
+        if max_age is not None:
+            recent = self._recent(key, deep_scan, max_age)
+            if recent is not None:
+                self._stats["cached"] += 1
+                devices, deep, scan_id, age = recent
+                return {"devices": devices, "deep_scan": deep, "scan_id": scan_id, "source": "cached", "age": age}
+
+        flight, source = self._join(key, deep_scan)
+        # 升級時進度來自被升級的快速掃描
+        unwatch = [f.watch(watch) for f in (flight, flight.base) if f is not None] if watch else []
+        try:
+            devices = await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if cancellable:
+                self._release(flight)
+            raise
+        finally:
+            for remove in unwatch:
+                remove()
+        return {"devices": devices, "deep_scan": flight.deep_scan, "scan_id": flight.scan_id,
+                "source": source, "age": 0.0}
+
+    async def stream(self, targets, deep_scan=False):
+        """
+        串流版本：回傳掃描事件（見 NetworkScanner.scan_iter），中途加入時先補上已發生的事件
+        done 事件在結果儲存後才送出並附上 scan_id；儲存失敗時改送 error 事件
+        請求端停止迭代時不會中斷共用的掃描
+        """
+        flight, _ = self._join(self._key(targets), deep_scan)
+        async for event in (flight.base or flight).replay():
+            if event["type"] == "done":
+                break
+            yield event
+        try:
+            devices = await asyncio.shield(flight.task)
+        except Exception as e:
+            yield {"type": "error", "error": f"Scan failed: {e}"}
+            return
+        if _failed(devices):
+            # 錯誤或取消事件已在掃描事件中送出
+            return
+        if flight.base is not None:
+            for device in devices:
+                yield {"type": "update", "ip": device["ip"], "mac": device["mac"], "field": "ports",
+                       "value": device["ports"]}
+        yield {"type": "done", "devices": devices, "scan_id": flight.scan_id}
+
+    def _run(self, flight, loop):
+        """
+        在掃描執行緒中迭代掃描事件並轉交給 event loop
+        :return: 裝置列表，失敗或取消時為 [{"error": ...}]
+        """
+        def progress(snapshot):
+            loop.call_soon_threadsafe(flight.set_progress, snapshot)
+
+        loop.call_soon_threadsafe(flight.start)
+        devices = []
+        for event in self.run_scan(list(flight.targets), flight.deep_scan, progress, flight.cancel_event):
+            loop.call_soon_threadsafe(flight.add_event, event)
+            if event["type"] == "error":
+                devices = [{"error": event["error"]}]
+            elif event["type"] == "cancelled":
+                devices = [{"error": "Scan cancelled"}]
+            elif event["type"] == "done":
+                devices = event["devices"]
+        return devices
+
+    async def _scan(self, flight):
+        loop = asyncio.get_running_loop()
+        logger.info(f"Starting {'deep' if flight.deep_scan else 'quick'} scan of {', '.join(flight.targets)}")
+        devices = await loop.run_in_executor(self._executor, self._run, flight, loop)
+        # 被升級時由升級後的深度掃描儲存最終結果（升級已被放棄時仍自行儲存）
+        if flight.upgrade is None or flight.upgrade.cancelled:
+            await self._save(flight, devices)
+        self._remember(flight, devices)
+        return devices
+
+    async def _upgrade(self, flight):
+        """等進行中的快速掃描完成，再為其結果補上開放埠；只儲存補上開放埠後的結果"""
+        loop = asyncio.get_running_loop()
+        quick = flight.base
+        logger.info(f"Upgrading in-flight quick scan of {', '.join(flight.targets)} to a deep scan")
+        devices = await asyncio.shield(quick.task)
+        if _failed(devices):
+            return devices
+        if flight.cancelled:
+            # 升級在快速掃描完成後才被放棄時，快速掃描沒有儲存結果，改在這裡儲存
+            if quick.scan_id is None:
+                await self._save(quick, devices)
+            return [{"error": "Scan cancelled"}]
+        try:
+            deep = await loop.run_in_executor(self._executor, self.deepen, devices)
+        except Exception:
+            # 補掃失敗時仍保留快速掃描的結果
+            await self._save(quick, devices)
+            raise
+        await self._save(flight, deep)
+        self._remember(flight, deep)
+        return deep
+
+    async def _save(self, flight, devices):
+        if devices and not _failed(devices):
+            flight.scan_id = await self.save(devices, list(flight.targets), flight.deep_scan)
+
+    def _remember(self, flight, devices):
+        if _failed(devices):
+            return
+        key = flight.targets
+        self._results.setdefault(key, {})[flight.deep_scan] = (devices, flight.scan_id, time.monotonic())
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_results:
+            self._results.popitem(last=False)
+
+    def _land(self, flight):
+        """掃描結束時移出進行中列表"""
+        key, task = flight.targets, flight.task
+        flight.finish()
+        flights = self._flights.get(key, {})
+        if flights.get(flight.deep_scan) is flight:
+            del flights[flight.deep_scan]
+        if not flights:
+            self._flights.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Scan of {', '.join(key)} failed: {task.exception()}")
+
+    def status(self):
+        """進行中的掃描與合併統計"""
+        return {
+            "in_flight": [
+                {"targets": list(key), "deep_scan": deep}
+                for key, flights in self._flights.items() for deep in flights
+            ],
+            **self._stats,
+        }
+
+    def shutdown(self):
+        """停止進行中的掃描並關閉執行緒池（程式結束時呼叫）"""
+        for flights in self._flights.values():
+            for flight in flights.values():
+                flight.cancel_event.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# 工作狀態
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobStoreFull(Exception):
+    """進行中的工作已達上限"""
+
+
+class ScanJob:
+    """單一掃描工作的狀態、進度與訂閱者"""
+
+    def __init__(self, targets, deep_scan):
+        self.id = uuid.uuid4().hex[:12]
+        self.targets = targets
+        self.deep_scan = deep_scan
+        self.status = QUEUED
+        self.progress = None
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.task = None
+        self._subscribers = set()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED
+
+    def snapshot(self, include_result=False):
+        """
+        工作狀態
+        :param include_result: 是否附上掃描結果（裝置列表可能很大）
+        """
+        snapshot = {
+            "id": self.id,
+            "targets": self.targets,
+            "deep_scan": self.deep_scan,
+            "status": self.status,
+            "progress": self.progress,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if include_result:
+            snapshot["result"] = self.result
+        return snapshot
+
+    def publish(self):
+        """通知訂閱者；佇列已滿的訂閱者丟棄最舊的一筆（進度只需要最新狀態）"""
+        event = self.snapshot(include_result=self.finished)
+        for queue in self._subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    async def events(self, max_queue=16):
+        """
+        訂閱工作狀態：先回傳目前狀態，之後每次更新回傳一次，工作結束後停止
+        :param max_queue: 每個訂閱者最多累積幾筆尚未讀取的更新
+        """
+        queue = asyncio.Queue(max_queue)
+        self._subscribers.add(queue)
+        try:
+            event = self.snapshot(include_result=self.finished)
+            while True:
+                yield event
+                if event["status"] in FINISHED:
+                    return
+                event = await queue.get()
+        finally:
+            self._subscribers.discard(queue)
+
+
+class JobStore:
+    """
+    非同步掃描工作
+    - submit 立即回傳工作，掃描經由 ScanCoordinator 執行：與 /api/scan、串流、定時掃描共用進行中的相同掃描，
+      同時執行的掃描數由協調器的執行緒池限制（其餘排隊）
+    - 掃描回報的進度推送給訂閱者
+    - 取消時放棄等待；沒有其他請求等待同一次掃描時，掃描會停止 ARP 送出並取消尚未完成的埠探測，結果不儲存
+    - 最多保留 max_jobs 個工作，超過時淘汰最早結束的工作；結束超過 retention 秒的工作也會淘汰
+    """
+
+    def __init__(self, coordinator, max_jobs=50, retention=3600):
+        """
+        :param coordinator: ScanCoordinator
+        :param max_jobs: 最多保留幾個工作（包含進行中）
+        :param retention: 結束的工作保留秒數
+        """
+        self.coordinator = coordinator
+        self.max_jobs = max_jobs
+        self.retention = retention
+        self._jobs = OrderedDict()  # id -> ScanJob（依建立順序）
+
+    def submit(self, targets, deep_scan=False):
+        """
+        建立並開始掃描工作
+        :return: ScanJob
+        :raises JobStoreFull: 所有保留的工作都尚未結束
+        """
+        self._evict()
+        if len(self._jobs) >= self.max_jobs:
+            raise JobStoreFull(f"Too many active jobs (max {self.max_jobs})")
+        job = ScanJob(targets, deep_scan)
+        self._jobs[job.id] = job
+        job.task = asyncio.get_running_loop().create_task(self._execute(job))
+        logger.info(f"Scan job {job.id} queued: {', '.join(targets)}, deep_scan={deep_scan}")
+        return job
+
+    async def _execute(self, job):
+        def watch(flight):
+            if job.finished:
+                return
+            if job.status == QUEUED and flight.started:
+                job.status = RUNNING
+                job.started_at = time.time()
+            if flight.progress is not None:
+                job.progress = flight.progress
+            job.publish()
+
+        try:
+            result = await self.coordinator.scan(job.targets, job.deep_scan, watch=watch, cancellable=True)
+            devices = result["devices"]
+            if _failed(devices):
+                raise RuntimeError(devices[0]["error"])
+            job.result = {"scan_id": result["scan_id"], "source": result["source"], "devices": devices}
+            job.status = SUCCEEDED
+        except asyncio.CancelledError:
+            job.status = CANCELLED
+        except Exception as e:
+            job.status = FAILED
+            job.error = str(e)
+            logger.error(f"Scan job {job.id} failed: {e}")
+        job.finished_at = time.time()
+        logger.info(f"Scan job {job.id} {job.status}")
+        job.publish()
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def list(self):
+        """所有保留的工作（新到舊）"""
+        self._evict()
+        return [job.snapshot() for job in reversed(self._jobs.values())]
+
+    def cancel(self, job_id):
+        """
+        要求取消工作（沒有其他請求共用時掃描會盡快停止）
+        :return: ScanJob，不存在時為 None
+        """
+        job = self._jobs.get(job_id)
+        if job is not None and not job.finished:
+            job.task.cancel()
+            logger.info(f"Cancelling scan job {job.id}")
+        return job
+
+    def _evict(self):
+        """淘汰結束太久的工作；總數超過上限時再淘汰最早結束的工作"""
+        now = time.time()
+        finished = sorted((job for job in self._jobs.values() if job.finished), key=lambda job: job.finished_at)
+        for job in finished:
+            if now - job.finished_at > self.retention or len(self._jobs) >= self.max_jobs:
+                del self._jobs[job.id]
+
+    def shutdown(self):
+        """取消所有進行中的工作（程式結束時呼叫，在 ScanCoordinator.shutdown 之前）"""
+        for job in self._jobs.values():
+            if job.task is not None and not job.task.done():
+                job.task.cancel()
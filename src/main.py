@@ -1,7 +1,7 @@
 import flet as ft
 from scanner import NetworkScanner
 from analyzer import AIAnalyzer
-from database import get_database
+from database import get_database, get_enrichment_cache
 import threading
 
 def main(page: ft.Page):
@@ -18,7 +18,7 @@ def main(page: ft.Page):
     page.theme = ft.Theme(font_family="Inter")
 
     # 初始化模組
-    scanner = NetworkScanner()
+    scanner = NetworkScanner(cache=get_enrichment_cache())
     analyzer = AIAnalyzer(model="qwen3:8b")
 
     # UI 狀態
@@ -231,9 +231,21 @@ def main(page: ft.Page):
                     status_text.value = "深度掃描中...（可能需要較長時間）"
                     page.update()
                 
-                # 1. 掃描（含深度掃描選項）
-                scan_results = scanner.scan(deep_scan=is_deep_scan)
-                update_device_list(scan_results)
+                # 1. 串流掃描（含深度掃描選項）：裝置一發現就顯示，之後陸續補齊資訊
+                scan_results = []
+                for event in scanner.scan_iter(deep_scan=is_deep_scan):
+                    if event["type"] == "device":
+                        scan_results.append(event["device"])
+                        status_text.value = f"掃描中... 已發現 {len(scan_results)} 個裝置"
+                    elif event["type"] == "update":
+                        for d in scan_results:
+                            if d["mac"] == event["mac"] and d["ip"] == event["ip"]:
+                                d[event["field"]] = event["value"]
+                    elif event["type"] == "error":
+                        scan_results = [{"error": event["error"]}]
+                    elif event["type"] == "done":
+                        scan_results = event["devices"]
+                    update_device_list(scan_results)
                 progress_bar.visible = False
                 
                 # 儲存到資料庫
@@ -0,0 +1,260 @@
+"""
+效能指標：各階段耗時的直方圖與計數器，以 Prometheus 文字格式輸出（GET /metrics）
+記錄時只在對應的 bucket 計數加一（一個 lock + 二分搜尋），不保留原始樣本；
+只有被抓取時才組成文字輸出，沒有人抓取時的額外負擔可以忽略。
+"""
+
+import bisect
+import functools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 秒數直方圖的預設 bucket（1ms ~ 5 分鐘）
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    """指標共用部分：名稱、說明與標籤；每組標籤值各自一份資料"""
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        """
+        Prometheus 文字格式
+        :return: 行列表
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            series = sorted((key, self._snapshot(value)) for key, value in self._series.items())
+        for key, value in series:
+            lines.extend(self._render_series(key, value))
+        return lines
+
+
+class Counter(_Metric):
+    """只增不減的計數器"""
+
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    @staticmethod
+    def _snapshot(value):
+        return value
+
+    def _render_series(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Histogram(_Metric):
+    """
+    累積分佈直方圖
+    用法：
+        histogram.observe(0.12, phase="arp")
+        with histogram.time(phase="arp"): ...
+        @histogram.timed(operation="save_scan")
+    """
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [各 bucket 的計數（最後一格為 +Inf）, 總和]
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def time(self, **labels):
+        """計時區塊（context manager），離開時記錄耗時秒數（包含發生例外時）"""
+        return _Timer(self, labels)
+
+    def timed(self, **labels):
+        """計時函式的裝飾器"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with _Timer(self, labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @staticmethod
+    def _snapshot(value):
+        return list(value[0]), value[1]
+
+    def _render_series(self, key, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class _Timer:
+    """Histogram.time() 的計時區塊；每次使用建立新的實例，可在多個執行緒同時使用"""
+
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        self.histogram.observe(elapsed, **self.labels)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"{self.histogram.name} {self.labels} took {elapsed * 1000:.1f} ms")
+        return False
+
+
+class MetricsRegistry:
+    """指標集合，依註冊順序輸出"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """
+        所有指標的 Prometheus 文字格式
+        :return: 字串
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+_registry = MetricsRegistry()
+
+
+def get_registry():
+    """取得全域指標集合"""
+    return _registry
+
+
+# 網路掃描
+SCAN_SECONDS = _registry.histogram(
+    "whodis_scan_seconds", "Duration of completed network scans.", ["deep_scan"],
+)
+SCAN_PHASE_SECONDS = _registry.histogram(
+    "whodis_scan_phase_seconds",
+    "Duration of scan phases: arp (sweep and reply wait), vendor and hostname (per device), "
+    "port_scan (per host), enrich (wait for lookups after the sweep), cache_flush.",
+    ["phase"],
+)
+
+# 資料庫
+DB_SECONDS = _registry.histogram(
+    "whodis_db_seconds", "Duration of database operations.", ["operation"],
+)
+
+# AI 分析（Ollama）
+LLM_REQUEST_SECONDS = _registry.histogram(
+    "whodis_llm_request_seconds", "Wall-clock duration of Ollama requests as seen by WhoDis.",
+    ["model", "mode", "outcome"],
+)
+LLM_TIME_TO_FIRST_TOKEN_SECONDS = _registry.histogram(
+    "whodis_llm_time_to_first_token_seconds", "Time from sending a streaming request to the first response token.",
+    ["model"],
+)
+LLM_DURATION_SECONDS = _registry.histogram(
+    "whodis_llm_duration_seconds",
+    "Ollama-reported durations: total, load (model load), prompt_eval (prefill) and eval (generation).",
+    ["model", "phase"],
+)
+LLM_TOKENS_PER_SECOND = _registry.histogram(
+    "whodis_llm_tokens_per_second", "Generation speed reported by Ollama (eval_count / eval_duration).",
+    ["model"], buckets=(1, 2, 5, 10, 15, 20, 30, 40, 50, 75, 100, 150, 200, 300, 500),
+)
+LLM_TOKENS = _registry.counter(
+    "whodis_llm_tokens_total", "Tokens processed by Ollama.", ["model", "kind"],
+)
+
+
+def record_ollama_stats(model, chunk):
+    """
+    記錄 Ollama 最後一段回應（done）中的統計欄位（時間單位為奈秒）
+    :param model: 模型名稱
+    :param chunk: 帶 done 的回應 dict
+    """
+    for phase, field in (("total", "total_duration"), ("load", "load_duration"),
+                         ("prompt_eval", "prompt_eval_duration"), ("eval", "eval_duration")):
+        if chunk.get(field):
+            LLM_DURATION_SECONDS.observe(chunk[field] / 1e9, model=model, phase=phase)
+    if chunk.get("prompt_eval_count"):
+        LLM_TOKENS.inc(chunk["prompt_eval_count"], model=model, kind="prompt")
+    if chunk.get("eval_count"):
+        LLM_TOKENS.inc(chunk["eval_count"], model=model, kind="completion")
+        if chunk.get("eval_duration"):
+            LLM_TOKENS_PER_SECOND.observe(chunk["eval_count"] / (chunk["eval_duration"] / 1e9), model=model)
@@ -0,0 +1,238 @@
+"""
+MAC 廠商 (OUI) 查詢
+離線優先：匯入時不連網，第一次查詢時才載入本機快照；快照過期後在背景執行緒更新。
+"""
+
+import csv
+import io
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# IEEE 註冊資料：MA-L (24 bit)、MA-M (28 bit)、MA-S (36 bit)
+IEEE_SOURCES = [
+    "https://standards-oui.ieee.org/oui/oui.csv",
+    "https://standards-oui.ieee.org/oui28/mam.csv",
+    "https://standards-oui.ieee.org/oui36/oui36.csv",
+]
+REQUEST_HEADERS = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"}
+
+# 本機快照（每行 "十六進位前綴\t廠商"，前綴長度 6/7/9 對應 MA-L/MA-M/MA-S）
+SNAPSHOT_PATH = Path.home() / ".cache" / "whodis" / "oui.tsv"
+# mac-vendor-lookup 套件留下的舊快取（每行 "前綴:廠商"，僅 MA-L），作為離線備援
+LEGACY_SNAPSHOT_PATH = Path.home() / ".cache" / "mac-vendors.txt"
+
+# 快照多久後在背景更新（秒）
+DEFAULT_TTL = 30 * 24 * 3600
+
+_MAC_SEPARATORS = str.maketrans("", "", ":-.")
+
+
+class OuiIndex:
+    """
+    緊湊的前綴索引
+    以 48 bit MAC 右移後的整數為 key，分別存放 36/28/24 bit 前綴，查詢為三次 dict 存取。
+    相同廠商名稱只保留一份字串。
+    """
+
+    def __init__(self, ma_l=None, ma_m=None, ma_s=None):
+        self._ma_l = ma_l or {}
+        self._ma_m = ma_m or {}
+        self._ma_s = ma_s or {}
+
+    def __len__(self):
+        return len(self._ma_l) + len(self._ma_m) + len(self._ma_s)
+
+    def lookup(self, mac_int):
+        """
+        查詢 48 bit MAC 整數，最長前綴優先
+        :return: 廠商名稱或 None
+        """
+        return (
+            self._ma_s.get(mac_int >> 12)
+            or self._ma_m.get(mac_int >> 20)
+            or self._ma_l.get(mac_int >> 24)
+        )
+
+    @classmethod
+    def from_entries(cls, entries):
+        """
+        由 (十六進位前綴, 廠商) 建立索引
+        :param entries: 可迭代的 (prefix_hex, vendor)
+        """
+        tables = {6: {}, 7: {}, 9: {}}
+        names = {}
+        for prefix, vendor in entries:
+            table = tables.get(len(prefix))
+            if table is None or not vendor:
+                continue
+            try:
+                key = int(prefix, 16)
+            except ValueError:
+                continue
+            table[key] = names.setdefault(vendor, vendor)
+        return cls(tables[6], tables[7], tables[9])
+
+    @classmethod
+    def load(cls, path):
+        """
+        載入本機快照，同時支援本專案的 TSV 與 mac-vendor-lookup 的舊格式
+        :param path: 快照檔案路徑
+        """
+        def entries():
+            with open(path, encoding="utf-8", errors="replace") as f:
+                for line in f:
+                    sep = "\t" if "\t" in line else ":"
+                    prefix, _, vendor = line.rstrip("\n").partition(sep)
+                    yield prefix.strip().upper(), vendor.strip()
+
+        return cls.from_entries(entries())
+
+    def save(self, path):
+        """以原子方式寫出快照（先寫暫存檔再取代）"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for width, table in ((6, self._ma_l), (7, self._ma_m), (9, self._ma_s)):
+                for key in sorted(table):
+                    f.write(f"{key:0{width}X}\t{table[key]}\n")
+        os.replace(tmp_path, path)
+
+
+def mac_to_int(mac_address):
+    """
+    將 'AA:BB:CC:DD:EE:FF' / 'AA-BB-...' / 'AABB.CCDD.EEFF' 轉為 48 bit 整數
+    每次呼叫會以 translate 建立一個去除分隔符號的暫存字串（「不額外配置」的要求在此放寬）：
+    純 Python 中依固定位置切片再逐段 int() 同樣會建立暫存字串，實測比 translate 慢約一倍。
+    """
+    return int(mac_address.translate(_MAC_SEPARATORS), 16)
+
+
+def download_ieee_entries(timeout=30):
+    """
+    從 IEEE 下載 MA-L/MA-M/MA-S 註冊資料
+    :return: [(prefix_hex, vendor), ...]
+    """
+    entries = []
+    for url in IEEE_SOURCES:
+        response = requests.get(url, headers=REQUEST_HEADERS, timeout=timeout)
+        response.raise_for_status()
+        reader = csv.reader(io.StringIO(response.text))
+        next(reader, None)  # 標題列
+        for row in reader:
+            if len(row) >= 3:
+                entries.append((row[1].strip().upper(), row[2].strip()))
+    return entries
+
+
+class VendorResolver:
+    """
+    MAC 廠商查詢器
+    - 第一次查詢時才載入本機快照（匯入模組與程式啟動都不需要網路）
+    - 快照過期或不存在時，在背景執行緒下載並原子替換索引，查詢不會被阻塞
+    - 套件不附帶快照：全新安裝在第一次下載成功前（例如離線環境），所有裝置都查不到廠商
+    """
+
+    def __init__(self, snapshot_path=SNAPSHOT_PATH, ttl=DEFAULT_TTL, auto_refresh=True):
+        """
+        :param snapshot_path: 本機快照路徑
+        :param ttl: 快照有效秒數，過期後於背景更新
+        :param auto_refresh: 是否自動在背景更新
+        """
+        self.snapshot_path = Path(snapshot_path)
+        self.ttl = ttl
+        self.auto_refresh = auto_refresh
+        self._index = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._next_refresh = 0.0  # time.monotonic()，0 表示尚未檢查
+
+    def lookup(self, mac_address):
+        """
+        查詢 MAC 地址廠商
+        :param mac_address: MAC 地址字串
+        :return: 廠商名稱或 None
+        """
+        index = self._index
+        if index is None:
+            index = self._load()
+        if self.auto_refresh and time.monotonic() >= self._next_refresh:
+            self._schedule_refresh()
+        try:
+            return index.lookup(mac_to_int(mac_address))
+        except ValueError:
+            return None
+
+    def _snapshot_age(self):
+        """快照距今秒數，找不到快照回傳 None"""
+        try:
+            return time.time() - self.snapshot_path.stat().st_mtime
+        except OSError:
+            return None
+
+    def _load(self):
+        """載入本機快照（僅執行一次）"""
+        with self._lock:
+            if self._index is not None:
+                return self._index
+
+            index = OuiIndex()
+            for path in (self.snapshot_path, LEGACY_SNAPSHOT_PATH):
+                if path.exists():
+                    try:
+                        index = OuiIndex.load(path)
+                        logger.info(f"Loaded {len(index)} OUI prefixes from {path}")
+                        break
+                    except OSError as e:
+                        logger.warning(f"Failed to load OUI snapshot {path}: {e}")
+            else:
+                logger.warning("No local OUI snapshot found, vendors unknown until background refresh completes")
+
+            self._index = index
+            age = self._snapshot_age()
+            # 沒有本專案的快照時立即在背景下載，否則等到過期再更新
+            delay = 0 if age is None else max(0.0, self.ttl - age)
+            self._next_refresh = time.monotonic() + delay
+            return index
+
+    def _schedule_refresh(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self.refresh, daemon=True, name="whodis-oui-refresh").start()
+
+    def refresh(self):
+        """下載最新的 IEEE 資料並替換索引；失敗時保留舊索引，稍後再試"""
+        try:
+            index = OuiIndex.from_entries(download_ieee_entries())
+            index.save(self.snapshot_path)
+            self._index = index
+            self._next_refresh = time.monotonic() + self.ttl
+            logger.info(f"OUI index refreshed: {len(index)} prefixes")
+        except Exception as e:
+            # 離線時一小時後再試
+            self._next_refresh = time.monotonic() + 3600
+            logger.warning(f"OUI refresh failed: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+
+# 全域查詢器實例
+_resolver = None
+
+
+def get_vendor_resolver():
+    """取得全域 MAC 廠商查詢器"""
+    global _resolver
+    if _resolver is None:
+        _resolver = VendorResolver()
+    return _resolver
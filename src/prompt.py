@@ -0,0 +1,255 @@
+"""
+AI 分析 prompt 的精簡編碼
+以表格取代縮排 JSON：廠商以代號列出一次，開放埠相同的主機歸為同一組，
+並在超過 token 預算時捨棄價值最低的裝置，改以一行摘要帶過。
+大型網路可依網段或廠商切成多個分片分別分析（map），再合併成一份報告（reduce）。
+"""
+
+import math
+import re
+from collections import Counter
+
+PROMPT_TEMPLATE = """
+You are a network security expert. Analyze the following list of devices discovered on a local network.
+Briefly point out any suspicious devices, unknown vendors, or potential security risks.
+Highlight normal infrastructure devices (routers, gateways) vs user devices.
+
+Device List:
+{devices}
+
+Please provide a concise summary in Traditional Chinese.
+"""
+
+# map 階段：每個分片只列出值得注意的發現，讓 reduce 的輸入保持精簡
+SHARD_TEMPLATE = """
+You are a network security expert. The following devices are one part ({label}) of a larger local network.
+List only notable findings as short bullet points: suspicious devices, unknown vendors, risky open ports,
+infrastructure devices (routers, gateways). Reply "nothing notable" if there are none.
+
+Device List:
+{devices}
+"""
+
+# reduce 階段：合併各分片的發現
+REDUCE_TEMPLATE = """
+You are a network security expert. A local network with {total} devices was analyzed in {parts} parts.
+Findings per part:
+
+{findings}
+
+Merge these findings into one concise report. Point out suspicious devices, unknown vendors, or potential
+security risks, and distinguish infrastructure devices from user devices.
+Please provide the summary in Traditional Chinese.
+"""
+
+UNKNOWN_VENDORS = {"", "Unknown Vendor"}
+
+# 大致的 BPE 切分：英文單字每 4 個字元約一個 token，數字最多 3 位一個 token，其餘符號各一個
+_TOKEN_PATTERN = re.compile(r"[A-Za-z]+|\d{1,3}|[^\sA-Za-z\d]")
+
+
+def estimate_tokens(text):
+    """
+    估計文字的 token 數（不依賴模型的 tokenizer，誤差約一至二成，用於預算控制）
+    :param text: 文字
+    :return: 估計的 token 數
+    """
+    return sum(math.ceil(len(piece) / 4) for piece in _TOKEN_PATTERN.findall(text))
+
+
+def _vendor(device):
+    vendor = device.get("vendor") or ""
+    return "" if vendor in UNKNOWN_VENDORS else vendor
+
+
+def _port_profile(device):
+    return tuple(sorted({(p["port"], p.get("service") or "") for p in device.get("ports") or []}))
+
+
+def _is_random_mac(mac):
+    """本地管理位元為 1 的 MAC（手機的隨機 MAC 或虛擬介面）"""
+    try:
+        return bool(int(mac.replace("-", ":").split(":")[0], 16) & 0x02)
+    except (ValueError, IndexError):
+        return False
+
+
+def _ip_sort_key(ip):
+    try:
+        return tuple(int(part) for part in ip.split("."))
+    except ValueError:
+        return (ip,)
+
+
+def device_value(device, vendor_counts):
+    """
+    裝置對安全分析的價值，超過預算時先捨棄分數低的裝置
+    開放埠、未知或罕見的廠商、隨機 MAC 與閘道位址的分數較高
+    :param device: 裝置資訊
+    :param vendor_counts: 各廠商出現次數
+    :return: 分數（越大越重要）
+    """
+    vendor = _vendor(device)
+    score = 3 * len(_port_profile(device))
+    if not vendor:
+        score += 4
+    elif vendor_counts[vendor] <= 2:
+        score += 2
+    if _is_random_mac(device.get("mac") or ""):
+        score += 1
+    if (device.get("ip") or "").endswith(".1"):
+        score += 3
+    if device.get("hostname"):
+        score += 1
+    return score
+
+
+def encode_devices(device_list):
+    """
+    將裝置列表編碼為精簡表格
+    :param device_list: 裝置列表
+    :return: 表格文字
+    """
+    vendor_counts = Counter(_vendor(d) for d in device_list)
+    vendors = {
+        vendor: f"V{i}"
+        for i, (vendor, _) in enumerate(sorted(vendor_counts.items(), key=lambda item: (-item[1], item[0])), 1)
+        if vendor
+    }
+
+    groups = {}
+    for device in device_list:
+        groups.setdefault(_port_profile(device), []).append(device)
+
+    lines = ["Vendors: " + "; ".join(f"{code}={vendor}" for vendor, code in vendors.items())] if vendors else []
+    lines.append("Columns: ip mac vendor hostname (?=unknown)")
+    # 有開放埠的組別在前，組內依 IP 排序
+    for profile, members in sorted(groups.items(), key=lambda item: (-len(item[0]), item[0])):
+        ports = " ".join(f"{port}/{service}" if service else str(port) for port, service in profile)
+        lines.append(f"[open ports: {ports or 'none'}] {len(members)} hosts")
+        for d in sorted(members, key=lambda d: _ip_sort_key(d.get("ip") or "")):
+            lines.append(" ".join((
+                d.get("ip") or "?",
+                (d.get("mac") or "?").lower(),
+                vendors.get(_vendor(d), "?"),
+                d.get("hostname") or "-",
+            )))
+    return "\n".join(lines)
+
+
+def _summarize(dropped):
+    """被捨棄裝置的一行摘要：數量與最多的幾個廠商"""
+    counts = Counter(_vendor(d) or "unknown vendor" for d in dropped)
+    top = ", ".join(f"{n}x {vendor}" for vendor, n in counts.most_common(5))
+    more = ", ..." if len(counts) > 5 else ""
+    return f"(+{len(dropped)} lower-priority hosts omitted: {top}{more})"
+
+
+def build_prompt(device_list, token_budget=None, template=PROMPT_TEMPLATE, **fields):
+    """
+    產生分析用 prompt
+    :param device_list: 裝置列表
+    :param token_budget: 裝置表格的 token 上限，None 表示不限制
+    :param template: prompt 樣板，裝置表格填入 {devices}
+    :param fields: 樣板的其他欄位
+    :return: (prompt, {"devices": 總數, "included": 列出的裝置數, "tokens": 估計的 prompt token 數})
+    """
+    table = encode_devices(device_list)
+    included = len(device_list)
+
+    if token_budget is not None and estimate_tokens(table) > token_budget:
+        vendor_counts = Counter(_vendor(d) for d in device_list)
+        ranked = sorted(device_list, key=lambda d: device_value(d, vendor_counts), reverse=True)
+
+        def fit(count):
+            text = encode_devices(ranked[:count])
+            if count < len(ranked):
+                text += "\n" + _summarize(ranked[count:])
+            return text
+
+        # 二分搜尋在預算內最多能列出幾台（至少保留摘要）
+        low, high = 0, len(ranked) - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if estimate_tokens(fit(middle)) <= token_budget:
+                low = middle
+            else:
+                high = middle - 1
+        table, included = fit(low), low
+
+    prompt = template.format(devices=table, **fields)
+    return prompt, {"devices": len(device_list), "included": included, "tokens": estimate_tokens(prompt)}
+
+
+def _subnet(ip):
+    parts = ip.split(".")
+    return ".".join(parts[:3]) + ".0/24" if len(parts) == 4 else "other"
+
+
+def shard_devices(device_list, shard_size=50):
+    """
+    將裝置分成數個分片：有多個 /24 網段時依網段，否則依廠商
+    小的組別合併到同一分片，超過 shard_size 的組別再切開
+    :param device_list: 裝置列表
+    :param shard_size: 每個分片最多幾台裝置
+    :return: [(標籤, 裝置列表), ...]
+    """
+    by_subnet = {}
+    for device in device_list:
+        by_subnet.setdefault(_subnet(device.get("ip") or ""), []).append(device)
+    if len(by_subnet) > 1:
+        groups = by_subnet
+    else:
+        groups = {}
+        for device in device_list:
+            groups.setdefault(_vendor(device) or "unknown vendor", []).append(device)
+
+    # 由大到小放入第一個放得下的分片（first-fit decreasing）
+    shards = []
+    for label, members in sorted(groups.items(), key=lambda item: (-len(item[1]), item[0])):
+        members = sorted(members, key=lambda d: _ip_sort_key(d.get("ip") or ""))
+        parts = [members[start:start + shard_size] for start in range(0, len(members), shard_size)]
+        for number, part in enumerate(parts, 1):
+            part_label = f"{label} {number}/{len(parts)}" if len(parts) > 1 else label
+            for shard in shards:
+                if len(shard[1]) + len(part) <= shard_size:
+                    shard[0].append(part_label)
+                    shard[1].extend(part)
+                    break
+            else:
+                shards.append(([part_label], list(part)))
+    return [(", ".join(dict.fromkeys(labels)), members) for labels, members in shards]
+
+
+def build_reduce_prompt(findings, total, token_budget=None):
+    """
+    產生合併各分片發現的 prompt，超過 token 預算時平均截短每個分片的內容
+    :param findings: [(標籤, 發現文字), ...]
+    :param total: 裝置總數
+    :param token_budget: 發現內容的 token 上限，None 表示不限制
+    :return: prompt
+    """
+    def render(limit):
+        return "\n\n".join(
+            f"[{label}]\n{text.strip() if limit is None else _truncate(text.strip(), limit)}"
+            for label, text in findings
+        )
+
+    text = render(None)
+    if token_budget is not None and findings and estimate_tokens(text) > token_budget:
+        text = render(max(1, token_budget // len(findings)))
+    return REDUCE_TEMPLATE.format(total=total, parts=len(findings), findings=text)
+
+
+def _truncate(text, token_limit):
+    """依估計的 token 數截短文字"""
+    if estimate_tokens(text) <= token_limit:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) <= token_limit:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low].rstrip() + " ..."
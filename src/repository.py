@@ -0,0 +1,195 @@
+"""
+非同步資料庫存取層
+FastAPI 的 async handler 不直接呼叫 sqlite3：
+- 讀取在專用的讀取執行緒池中執行（WAL 模式下可與寫入同時進行）
+- 寫入送進佇列，由單一寫入執行緒批次執行，同一批共用一個交易，以 savepoint 隔離各自的錯誤
+"""
+
+import asyncio
+import logging
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from database import get_database, _insert_scan, _remove_scan
+from metrics import DB_SECONDS
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class AsyncDatabase:
+    """Database 的 async 介面，讀取與寫入都不會阻塞 event loop"""
+
+    def __init__(self, db, read_workers=4, max_batch=64):
+        """
+        :param db: Database 實例
+        :param read_workers: 讀取執行緒數（每個執行緒有自己的連線）
+        :param max_batch: 每個寫入交易最多合併幾筆寫入
+        """
+        self.db = db
+        self.max_batch = max_batch
+        self._readers = ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix="whodis-db-read")
+        self._writes = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, daemon=True, name="whodis-db-write")
+        self._writer.start()
+        self._stats = {"writes": 0, "batches": 0, "max_batch": 0}
+        self._scan_listeners = []
+        self.closed = False
+
+    async def _read(self, method, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, method, *args)
+
+    def submit_write(self, operation, *args):
+        """
+        將寫入送進佇列（可在任何執行緒呼叫）
+        :param operation: operation(conn, *args)，在寫入執行緒的交易中執行
+        :return: concurrent.futures.Future，結果為 operation 的回傳值
+        """
+        future = Future()
+        self._writes.put((operation, args, future))
+        return future
+
+    async def _write(self, operation, *args):
+        return await asyncio.wrap_future(self.submit_write(operation, *args))
+
+    def _write_loop(self):
+        """寫入執行緒：取出佇列中累積的寫入，合併為一個交易"""
+        conn = self.db._connect()
+        while True:
+            batch = [self._writes.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = any(item is _STOP for item in batch)
+            batch = [item for item in batch if item is not _STOP]
+            if batch:
+                self._run_batch(conn, batch)
+            if stop:
+                self.db.close()
+                return
+
+    def _run_batch(self, conn, batch):
+        results = []
+        try:
+            # 整批耗時包含提交（寫入磁碟）；各筆寫入另以函式名稱記錄
+            with DB_SECONDS.time(operation="write_batch"), conn:
+                # 明確開始交易；否則最外層的 savepoint 會在 RELEASE 時自行提交
+                conn.execute("BEGIN")
+                for operation, args, future in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    conn.execute("SAVEPOINT batch_item")
+                    try:
+                        with DB_SECONDS.time(operation=operation.__name__.lstrip("_")):
+                            result = operation(conn, *args)
+                        results.append((future, result, None))
+                        conn.execute("RELEASE batch_item")
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO batch_item")
+                        conn.execute("RELEASE batch_item")
+                        results.append((future, None, e))
+        except Exception as e:
+            # 交易失敗時整批都沒有寫入
+            logger.error(f"Database write batch failed: {e}")
+            results = [(future, None, e) for _, _, future in batch if not future.done()]
+
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+        self._stats["writes"] += len(batch)
+        self._stats["batches"] += 1
+        self._stats["max_batch"] = max(self._stats["max_batch"], len(batch))
+
+    def on_scan_saved(self, listener):
+        """
+        註冊掃描儲存完成（交易已提交）時的回呼
+        :param listener: listener(scan_id)，在寫入執行緒中呼叫，不應阻塞
+        """
+        self._scan_listeners.append(listener)
+
+    def queue_save_scan(self, devices, subnet, deep_scan=False):
+        """
+        將掃描結果送進寫入佇列（可在任何執行緒呼叫，例如串流掃描的 generator）
+        :return: concurrent.futures.Future，結果為掃描記錄 ID
+        """
+        future = self.submit_write(_insert_scan, devices, subnet, deep_scan)
+
+        def saved(f):
+            if f.exception() is not None:
+                return
+            logger.info(f"Saved scan #{f.result()} with {len(devices)} devices")
+            for listener in self._scan_listeners:
+                try:
+                    listener(f.result())
+                except Exception as e:
+                    logger.error(f"Scan listener failed: {e}")
+
+        future.add_done_callback(saved)
+        return future
+
+    async def save_scan(self, devices, subnet, deep_scan=False):
+        """儲存掃描結果，回傳掃描記錄 ID"""
+        return await asyncio.wrap_future(self.queue_save_scan(devices, subnet, deep_scan))
+
+    async def delete_scan(self, scan_id):
+        """刪除掃描記錄"""
+        await self._write(_remove_scan, scan_id)
+        logger.info(f"Deleted scan #{scan_id}")
+
+    async def get_scan_history(self, limit=20):
+        return await self._read(self.db.get_scan_history, limit)
+
+    async def query_scans(self, limit=20, cursor=None, subnet=None, deep_scan=None, since=None, until=None):
+        return await self._read(self.db.query_scans, limit, cursor, subnet, deep_scan, since, until)
+
+    async def query_observations(self, **filters):
+        return await self._read(lambda: self.db.query_observations(**filters))
+
+    async def get_scan_details(self, scan_id):
+        return await self._read(self.db.get_scan_details, scan_id)
+
+    async def get_latest_scan_ids(self):
+        return await self._read(self.db.get_latest_scan_ids)
+
+    async def get_scan_diff(self, scan_id):
+        return await self._read(self.db.get_scan_diff, scan_id)
+
+    async def get_presence_timeline(self, mac=None, since=None, until=None, limit=500):
+        return await self._read(self.db.get_presence_timeline, mac, since, until, limit)
+
+    async def get_hosts_with_port(self, port):
+        return await self._read(self.db.get_hosts_with_port, port)
+
+    def stats(self):
+        """寫入批次統計"""
+        return {**self._stats, "queued": self._writes.qsize()}
+
+    def close(self):
+        """處理完佇列中的寫入後停止寫入執行緒"""
+        if self.closed:
+            return
+        self.closed = True
+        self._writes.put(_STOP)
+        self._writer.join()
+        self._readers.shutdown(wait=True)
+
+
+# 全域實例
+_async_db = None
+
+
+def get_async_database():
+    """取得全域非同步資料庫介面"""
+    global _async_db
+    if _async_db is None or _async_db.closed:
+        _async_db = AsyncDatabase(get_database())
+    return _async_db
@@ -0,0 +1,236 @@
+"""
+資料保留政策
+- 近期掃描保留完整紀錄
+- 較舊的歷史降採樣為每小時／每天一筆（每個網段、深度與一般掃描各保留該時段最後一筆）
+- 上線區間記錄自己的起訖時間，刪除掃描時不受影響
+- 分批刪除，每批作為一筆寫入送進 AsyncDatabase 的寫入佇列，與掃描儲存輪流執行，不會長時間鎖住資料庫
+- 最後以增量式 VACUUM 歸還空間
+"""
+
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from database import _chunks, _materialize_diff, _refresh_hosts
+from metrics import DB_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionPolicy:
+    """
+    保留政策設定（天數）
+    - full_days 內：全部保留
+    - hourly_days 內：每小時一筆
+    - max_days 內：每天一筆；更舊的掃描與已結束的上線區間刪除（None 表示不刪除）
+    """
+
+    def __init__(self, full_days=7, hourly_days=30, max_days=365):
+        if not full_days <= hourly_days <= (max_days or hourly_days):
+            raise ValueError("Retention tiers must satisfy full_days <= hourly_days <= max_days")
+        self.full_days = full_days
+        self.hourly_days = hourly_days
+        self.max_days = max_days
+
+
+class RetentionManager:
+    """依保留政策清理資料庫並回報歸還的空間"""
+
+    def __init__(self, store, policy=None, batch_size=500, vacuum_pages=2000):
+        """
+        :param store: AsyncDatabase 實例；所有寫入都經由它的寫入執行緒
+        :param policy: RetentionPolicy，未指定時使用預設值
+        :param batch_size: 每筆寫入處理的掃描（或資料列）數
+        :param vacuum_pages: 每筆寫入以 incremental_vacuum 歸還的頁數
+        """
+        self.store = store
+        self.db = store.db
+        self.policy = policy or RetentionPolicy()
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+
+    def _write(self, operation, *args):
+        """送出一筆寫入並等待完成；批次之間佇列中的其他寫入可以先執行"""
+        return self.store.submit_write(operation, *args).result()
+
+    @staticmethod
+    def _cutoff(now, days):
+        return (now - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+
+    def _expired_scans(self, conn, now):
+        """
+        依保留政策找出要刪除的掃描 ID
+        每個網段最新的一筆掃描一律保留（新掃描以它為比較基準）
+        """
+        policy = self.policy
+        full_cutoff = self._cutoff(now, policy.full_days)
+        hourly_cutoff = self._cutoff(now, policy.hourly_days)
+        daily_cutoff = self._cutoff(now, policy.max_days) if policy.max_days else "0000-00-00"
+
+        # (時段下限, 時段上限, 分組格式)
+        tiers = [
+            (hourly_cutoff, full_cutoff, "%Y-%m-%d %H"),
+            (daily_cutoff, hourly_cutoff, "%Y-%m-%d"),
+        ]
+        expired = set()
+        for lower, upper, bucket in tiers:
+            rows = conn.execute("""
+                SELECT id FROM scans
+                WHERE scan_time >= ? AND scan_time < ? AND id NOT IN (
+                    SELECT MAX(id) FROM scans
+                    WHERE scan_time >= ? AND scan_time < ?
+                    GROUP BY subnet, deep_scan, strftime(?, scan_time)
+                )
+            """, (lower, upper, lower, upper, bucket))
+            expired.update(row[0] for row in rows)
+
+        if policy.max_days:
+            rows = conn.execute("SELECT id FROM scans WHERE scan_time < ?", (daily_cutoff,))
+            expired.update(row[0] for row in rows)
+
+        latest = {row[0] for row in conn.execute("SELECT MAX(id) FROM scans GROUP BY subnet")}
+        return sorted(expired - latest)
+
+    def _delete_scans(self, scan_ids):
+        """分批刪除掃描與其出現紀錄、差異，並修正主機狀態；上線區間不動"""
+        for chunk in _chunks(scan_ids, self.batch_size):
+            self._write(_delete_scan_chunk, chunk)
+
+    def _rebase_diffs(self):
+        """比較基準已被刪除的掃描，改與保留下來的上一筆掃描重新計算差異"""
+        orphaned = [row[0] for row in self.db._connect().execute("""
+            SELECT id FROM scans
+            WHERE base_scan_id IS NOT NULL AND base_scan_id NOT IN (SELECT id FROM scans)
+            ORDER BY id
+        """)]
+        for chunk in _chunks(orphaned, self.batch_size):
+            self._write(_rebase_chunk, chunk)
+        return len(orphaned)
+
+    def _delete_in_batches(self, sql, params=()):
+        """重複執行帶 LIMIT 的刪除直到沒有資料，回傳刪除筆數"""
+        total = 0
+        while True:
+            deleted = self._write(_delete_limited, sql, (*params, self.batch_size))
+            total += deleted
+            if deleted < self.batch_size:
+                return total
+
+    def _compact(self, now):
+        """清除刪除掃描後不會再被讀到的資料"""
+        removed = {}
+        # 區間內已沒有任何保留下來的深度掃描，查詢時永遠不會涵蓋到
+        removed["port_intervals"] = self._delete_in_batches("""
+            DELETE FROM host_ports WHERE id IN (
+                SELECT hp.id FROM host_ports hp
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM scans s
+                    WHERE s.id BETWEEN hp.first_scan AND hp.last_scan AND s.deep_scan = 1
+                )
+                LIMIT ?
+            )
+        """)
+        if self.policy.max_days:
+            removed["presence_intervals"] = self._delete_in_batches("""
+                DELETE FROM host_presence WHERE id IN (
+                    SELECT id FROM host_presence WHERE ended_at < ? LIMIT ?
+                )
+            """, (self._cutoff(now, self.policy.max_days),))
+
+        # 不再出現在任何掃描、也沒有上線區間的主機
+        orphaned = [row[0] for row in self.db._connect().execute("""
+            SELECT id FROM hosts h
+            WHERE NOT EXISTS (SELECT 1 FROM scan_hosts WHERE host_id = h.id)
+              AND NOT EXISTS (SELECT 1 FROM host_presence WHERE host_id = h.id)
+        """)]
+        for chunk in _chunks(orphaned, self.batch_size):
+            self._write(_delete_hosts, chunk)
+        removed["hosts"] = len(orphaned)
+        return removed
+
+    def _vacuum(self):
+        """分段執行 incremental_vacuum 並截斷 WAL，回傳歸還的位元組數"""
+        conn = self.db._connect()
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            logger.warning("Incremental vacuum is not enabled, skipping")
+            return 0
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        before = conn.execute("PRAGMA page_count").fetchone()[0]
+        while conn.execute("PRAGMA freelist_count").fetchone()[0] > 0:
+            if not self._write(_vacuum_pages, self.vacuum_pages):
+                break
+        # checkpoint 不能在交易中執行，直接以本執行緒的連線執行
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        after = conn.execute("PRAGMA page_count").fetchone()[0]
+        return (before - after) * page_size
+
+    @DB_SECONDS.timed(operation="retention")
+    def run(self, now=None):
+        """
+        執行一次保留政策
+        :param now: 目前時間（UTC，測試用）
+        :return: {"scans_deleted", "diffs_rebased", "port_intervals", "presence_intervals", "hosts",
+                  "bytes_reclaimed", "duration"}
+        """
+        started = time.perf_counter()
+        now = now or datetime.now(timezone.utc)
+
+        expired = self._expired_scans(self.db._connect(), now)
+        self._delete_scans(expired)
+        report = {
+            "scans_deleted": len(expired),
+            "diffs_rebased": self._rebase_diffs(),
+            **self._compact(now),
+        }
+        report["bytes_reclaimed"] = self._vacuum()
+        report["duration"] = time.perf_counter() - started
+
+        logger.info(
+            f"Retention removed {report['scans_deleted']} scans, "
+            f"reclaimed {report['bytes_reclaimed'] / 1024 / 1024:.1f} MB in {report['duration']:.1f}s"
+        )
+        return report
+
+
+def _delete_scan_chunk(conn, scan_ids):
+    """刪除一批掃描（在寫入執行緒的交易中執行），並以 _refresh_hosts 修正受影響主機的最後出現／深度掃描與開放埠區間"""
+    placeholders = ",".join("?" * len(scan_ids))
+    hosts_by_scan = {}
+    for scan_id, host_id in conn.execute(
+        f"SELECT scan_id, host_id FROM scan_hosts WHERE scan_id IN ({placeholders})", scan_ids
+    ):
+        hosts_by_scan.setdefault(scan_id, []).append(host_id)
+    conn.execute(f"DELETE FROM scan_diffs WHERE scan_id IN ({placeholders})", scan_ids)
+    conn.execute(f"DELETE FROM scan_hosts WHERE scan_id IN ({placeholders})", scan_ids)
+    conn.execute(f"DELETE FROM scans WHERE id IN ({placeholders})", scan_ids)
+    for scan_id in sorted(hosts_by_scan):
+        _refresh_hosts(conn, hosts_by_scan[scan_id], scan_id)
+
+
+def _rebase_chunk(conn, scan_ids):
+    for scan_id in scan_ids:
+        _materialize_diff(conn, scan_id)
+
+
+def _delete_limited(conn, sql, params):
+    return conn.execute(sql, params).rowcount
+
+
+def _delete_hosts(conn, host_ids):
+    placeholders = ",".join("?" * len(host_ids))
+    for table in ("scan_diffs", "host_ports", "host_attributes"):
+        conn.execute(f"DELETE FROM {table} WHERE host_id IN ({placeholders})", host_ids)
+    conn.execute(f"DELETE FROM hosts WHERE id IN ({placeholders})", host_ids)
+
+
+def _vacuum_pages(conn, pages):
+    """
+    歸還最多 pages 頁
+    incremental_vacuum 透過 execute 每次只執行一步（歸還一頁），executescript 會先提交交易，
+    因此在寫入執行緒的交易中逐頁執行
+    :return: 實際歸還的頁數
+    """
+    before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    for _ in range(min(pages, before)):
+        conn.execute("PRAGMA incremental_vacuum(1)")
+    return before - conn.execute("PRAGMA freelist_count").fetchone()[0]
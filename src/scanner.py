@@ -1,38 +1,268 @@
+import asyncio
 import logging
-from scapy.all import ARP, Ether, srp, conf, get_if_list, get_if_addr
-from mac_vendor_lookup import MacLookup
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 import socket
 import os
 
+from metrics import SCAN_PHASE_SECONDS, SCAN_SECONDS
+from oui import get_vendor_resolver
+from sweep import ArpSweeper, get_network_for_ip
+
 # 設定 logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# 預先初始化 MAC 查詢表（同步方式）
-_mac_lookup = MacLookup()
-try:
-    _mac_lookup.update_vendors()  # 同步更新廠商資料庫
-except Exception:
-    pass  # 離線時忽略更新錯誤
+
+class PortScanEngine:
+    """
+    非同步 TCP Connect 掃描引擎
+    一次排入所有 host×port 探測，再以全域與單一主機的併發上限控制負載。
+    Semaphore 綁定在執行中的 event loop，因此每次掃描建立一個新的引擎。
+    """
+
+    def __init__(self, timeout=0.5, max_concurrency=256, per_host_limit=16, on_probe=None):
+        """
+        :param timeout: 單次探測超時秒數
+        :param max_concurrency: 全域同時探測上限（同時也限制開啟的 socket 數）
+        :param per_host_limit: 單一主機同時探測上限，避免對單台裝置造成突發負載
+        :param on_probe: 每完成一次探測呼叫 on_probe()（進度回報用）
+        """
+        self.timeout = timeout
+        self.on_probe = on_probe
+        self.per_host_limit = per_host_limit
+        self._global_sem = asyncio.Semaphore(max_concurrency)
+        self._host_sems = {}
+
+    def _host_sem(self, ip):
+        sem = self._host_sems.get(ip)
+        if sem is None:
+            sem = self._host_sems[ip] = asyncio.Semaphore(self.per_host_limit)
+        return sem
+
+    async def probe(self, ip, port):
+        """
+        探測單一埠是否開放
+        :return: True 表示 TCP 連線成功
+        """
+        try:
+            return await self._probe(ip, port)
+        finally:
+            if self.on_probe is not None:
+                self.on_probe()
+
+    async def _probe(self, ip, port):
+        # 先取得主機配額再取得全域配額，避免排隊中的探測佔住全域名額
+        async with self._host_sem(ip):
+            async with self._global_sem:
+                try:
+                    _, writer = await asyncio.wait_for(
+                        asyncio.open_connection(ip, port), self.timeout
+                    )
+                except (OSError, asyncio.TimeoutError):
+                    return False
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except OSError:
+                    pass
+                return True
+
+    async def scan_host(self, ip, ports):
+        """
+        掃描單一主機
+        :return: 開放的埠號列表（依 ports 原始順序）
+        """
+        with SCAN_PHASE_SECONDS.time(phase="port_scan"):
+            results = await asyncio.gather(*(self.probe(ip, port) for port in ports))
+        return [port for port, is_open in zip(ports, results) if is_open]
+
+    async def scan_hosts(self, ips, ports):
+        """
+        同時掃描多台主機
+        :return: {ip: [開放的埠號, ...], ...}
+        """
+        results = await asyncio.gather(*(self.scan_host(ip, ports) for ip in ips))
+        return dict(zip(ips, results))
 
 
-def find_interface_for_network(target_subnet):
+class HostnameResolver:
     """
-    找到對應目標子網的網路介面
-    例如：如果目標是 192.168.0.0/24，會找到 IP 為 192.168.0.x 的介面
+    並行主機名稱解析
+    - 每次查詢有硬性期限，超時即放棄（背景執行緒會自行結束）
+    - 同時進行中的查詢數量受執行緒池大小限制
+    - 查詢失敗或超時的 IP 會記入負向快取，在 negative_ttl 內不再重試
     """
-    target_prefix = ".".join(target_subnet.split("/")[0].split(".")[:3])  # e.g., "192.168.0"
-    
-    for iface in get_if_list():
+
+    def __init__(self, lookup, timeout=1.5, max_in_flight=32, negative_ttl=600):
+        """
+        :param lookup: 實際的阻塞式查詢函式 lookup(ip) -> hostname 或 None
+        :param timeout: 單次查詢期限（秒）
+        :param max_in_flight: 同時進行中的查詢上限
+        :param negative_ttl: 查詢失敗後多久內不再重試（秒）
+        """
+        self._lookup = lookup
+        self.timeout = timeout
+        self.max_in_flight = max_in_flight
+        self.negative_ttl = negative_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="whodis-dns")
+        self._negative = {}  # ip -> 過期時間 (monotonic)
+        self._lock = threading.Lock()
+        # asyncio.Semaphore 綁定 event loop，每個 loop 各自一個
+        self._sems = weakref.WeakKeyDictionary()
+
+    def is_negative(self, ip):
+        """IP 是否在負向快取中（近期查詢失敗）"""
+        with self._lock:
+            expires = self._negative.get(ip)
+            if expires is None:
+                return False
+            if expires <= time.monotonic():
+                del self._negative[ip]
+                return False
+            return True
+
+    def _remember(self, ip, hostname):
+        with self._lock:
+            if hostname:
+                self._negative.pop(ip, None)
+            else:
+                self._negative[ip] = time.monotonic() + self.negative_ttl
+
+    def _semaphore(self):
+        loop = asyncio.get_running_loop()
+        sem = self._sems.get(loop)
+        if sem is None:
+            sem = self._sems[loop] = asyncio.Semaphore(self.max_in_flight)
+        return sem
+
+    async def resolve(self, ip):
+        """
+        解析單一 IP，超過期限回傳 None
+        :param ip: 目標 IP
+        :return: 主機名稱或 None
+        """
+        if self.is_negative(ip):
+            return None
+
+        # 名額在背景查詢真正結束後才釋放，超時的查詢仍計入進行中數量
+        sem = self._semaphore()
+        await sem.acquire()
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, self._lookup, ip)
+        future.add_done_callback(lambda _: sem.release())
+
         try:
-            ip = get_if_addr(iface)
-            if ip and ip.startswith(target_prefix):
-                logger.info(f"Found matching interface: {iface} with IP {ip}")
-                return iface
+            hostname = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            logger.debug(f"Hostname lookup for {ip} timed out")
+            hostname = None
         except Exception:
-            continue
-    
-    return None
+            hostname = None
+
+        self._remember(ip, hostname)
+        return hostname
+
+    async def resolve_many(self, ips):
+        """
+        並行解析多個 IP
+        :return: {ip: hostname 或 None, ...}
+        """
+        results = await asyncio.gather(*(self.resolve(ip) for ip in ips))
+        return dict(zip(ips, results))
+
+
+class ScanProgress:
+    """
+    掃描進度：ARP 已探測位址、發現的主機、已完成的埠探測與主機名稱查詢，並依目前速率估計剩餘時間
+    只在掃描的 event loop 執行緒中更新；回呼最多每 interval 秒呼叫一次（階段改變時立即呼叫）
+    """
+
+    def __init__(self, callback, interval=0.2):
+        """
+        :param callback: callback(進度 dict)
+        :param interval: 兩次回呼之間的最短秒數
+        """
+        self.callback = callback
+        self.interval = interval
+        self.started = time.monotonic()
+        self.phase = "sweep"
+        self.hosts_probed = 0
+        self.hosts_total = 0
+        self.hosts_found = 0
+        self.ports_done = 0
+        self.ports_total = 0
+        self.lookups_done = 0
+        self.lookups_total = 0
+        self._first_probe = None
+        self._last_emit = 0.0
+
+    def swept(self, done, total):
+        self.hosts_probed, self.hosts_total = done, total
+        self.emit()
+
+    def found(self, ports):
+        """發現一台主機，ports 為將要探測的埠數"""
+        self.hosts_found += 1
+        self.ports_total += ports
+        self.emit()
+
+    def probed(self):
+        if self._first_probe is None:
+            self._first_probe = time.monotonic()
+        self.ports_done += 1
+        self.emit()
+
+    def lookup(self, done=False):
+        if done:
+            self.lookups_done += 1
+        else:
+            self.lookups_total += 1
+        self.emit()
+
+    def set_phase(self, phase):
+        self.phase = phase
+        self.emit(force=True)
+
+    def eta(self):
+        """剩餘秒數估計（ARP 與埠探測各以目前速率推算），尚無法估計時為 None"""
+        now = time.monotonic()
+        remaining = 0.0
+        if self.phase == "sweep":
+            if not self.hosts_probed:
+                return None
+            rate = self.hosts_probed / max(now - self.started, 1e-3)
+            remaining += (self.hosts_total - self.hosts_probed) / rate
+        if self.ports_total > self.ports_done:
+            if not self.ports_done:
+                return None
+            rate = self.ports_done / max(now - self._first_probe, 1e-3)
+            remaining += (self.ports_total - self.ports_done) / rate
+        return round(remaining, 1)
+
+    def snapshot(self):
+        return {
+            "phase": self.phase,
+            "hosts_probed": self.hosts_probed,
+            "hosts_total": self.hosts_total,
+            "hosts_found": self.hosts_found,
+            "ports_done": self.ports_done,
+            "ports_total": self.ports_total,
+            "lookups_done": self.lookups_done,
+            "lookups_total": self.lookups_total,
+            "elapsed": round(time.monotonic() - self.started, 2),
+            "eta": 0.0 if self.phase == "done" else self.eta(),
+        }
+
+    def emit(self, force=False):
+        now = time.monotonic()
+        if force or now - self._last_emit >= self.interval:
+            self._last_emit = now
+            self.callback(self.snapshot())
+
 
 class NetworkScanner:
     # 常見 Port 對應服務名稱
@@ -60,9 +290,34 @@ class NetworkScanner:
     
     # 預設掃描的 Port 列表
     DEFAULT_PORTS = [22, 80, 443, 445, 3389, 8080]
+
+    # ARP 回應等待上限秒數（回應停止後會提早結束）
+    ARP_TIMEOUT = 3
     
-    def __init__(self):
-        pass  # 使用全域的 _mac_lookup
+    def __init__(self, max_port_concurrency=256, per_host_port_limit=16,
+                 hostname_timeout=1.5, max_hostname_lookups=32, hostname_negative_ttl=600,
+                 cache=None, sweeper=None):
+        """
+        :param max_port_concurrency: 深度掃描時全域同時進行的 TCP 探測上限
+        :param per_host_port_limit: 單一主機同時進行的 TCP 探測上限
+        :param hostname_timeout: 單次主機名稱查詢期限（秒）
+        :param max_hostname_lookups: 同時進行中的主機名稱查詢上限
+        :param hostname_negative_ttl: 查不到主機名稱的 IP 多久內不再重試（秒）
+        :param cache: 裝置資訊快取（database.EnrichmentCache），None 表示每次都重新查詢
+        :param sweeper: ARP 掃描引擎，預設為 ArpSweeper(timeout=ARP_TIMEOUT)
+        """
+        # MAC 廠商查詢使用全域的 OUI 索引（首次查詢時才載入）
+        self.vendor_resolver = get_vendor_resolver()
+        self.max_port_concurrency = max_port_concurrency
+        self.per_host_port_limit = per_host_port_limit
+        self.resolver = HostnameResolver(
+            self.get_hostname,
+            timeout=hostname_timeout,
+            max_in_flight=max_hostname_lookups,
+            negative_ttl=hostname_negative_ttl,
+        )
+        self.cache = cache
+        self.sweeper = sweeper or ArpSweeper(timeout=self.ARP_TIMEOUT)
 
     def get_service_name(self, port):
         """取得 Port 對應的服務名稱"""
@@ -76,24 +331,55 @@ class NetworkScanner:
         :param timeout: 連線超時秒數
         :return: 開放的埠列表 [{"port": 80, "service": "HTTP"}, ...]
         """
+        return self.port_scan_hosts([ip], ports, timeout)[ip]
+
+    async def port_scan_hosts_async(self, ips, ports=None, timeout=0.5):
+        """
+        同時掃描多台主機的埠（所有 host×port 組合並行探測），在目前的 event loop 上執行
+        :param ips: 目標 IP 列表
+        :param ports: 要掃描的埠列表，預設為 DEFAULT_PORTS
+        :param timeout: 單次探測超時秒數
+        :return: {ip: [{"port": 80, "service": "HTTP"}, ...], ...}
+        """
         if ports is None:
             ports = self.DEFAULT_PORTS
-        
-        open_ports = []
-        for port in ports:
-            try:
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.settimeout(timeout)
-                result = sock.connect_ex((ip, port))
-                if result == 0:
-                    open_ports.append({
-                        "port": port,
-                        "service": self.get_service_name(port)
-                    })
-                sock.close()
-            except Exception:
-                pass
-        return open_ports
+        engine = PortScanEngine(
+            timeout=timeout,
+            max_concurrency=self.max_port_concurrency,
+            per_host_limit=self.per_host_port_limit,
+        )
+        results = await engine.scan_hosts(ips, ports)
+        return {ip: self._port_records(open_ports) for ip, open_ports in results.items()}
+
+    def port_scan_hosts(self, ips, ports=None, timeout=0.5):
+        """
+        同步版本，見 port_scan_hosts_async
+        在執行中的 event loop 內呼叫時（asyncio.run 不能巢狀），改在另一個執行緒的新 loop 上執行；
+        async 呼叫端應直接 await port_scan_hosts_async，才不會阻塞自己的 loop
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.port_scan_hosts_async(ips, ports, timeout))
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="whodis-port-scan") as pool:
+            return pool.submit(asyncio.run, self.port_scan_hosts_async(ips, ports, timeout)).result()
+
+    def add_ports(self, devices, ports=None, timeout=0.5):
+        """
+        為快速掃描的結果補上開放埠，不必重新執行 ARP 掃描（例如將進行中的快速掃描升級為深度掃描）
+        :param devices: 裝置列表
+        :return: 新的裝置列表，每台裝置附上 ports
+        """
+        open_ports = self.port_scan_hosts([d["ip"] for d in devices], ports, timeout) if devices else {}
+        if self.cache is not None:
+            for device in devices:
+                self.cache.put("ports", device["mac"], open_ports[device["ip"]], device["ip"])
+            self.cache.flush()
+        return [dict(device, ports=open_ports[device["ip"]]) for device in devices]
+
+    def _port_records(self, open_ports):
+        """將埠號列表轉為 [{"port": 80, "service": "HTTP"}, ...]"""
+        return [{"port": port, "service": self.get_service_name(port)} for port in open_ports]
 
     def get_hostname(self, ip):
         """
@@ -144,22 +430,183 @@ class NetworkScanner:
             return "127.0.0.1"
 
     def get_subnet(self, ip):
-        """簡單的子網掩碼計算，假設是 /24"""
+        """取得 IP 所在介面的實際網段，找不到介面時假設是 /24"""
+        network = get_network_for_ip(ip)
+        if network is not None:
+            return str(network)
         return ".".join(ip.split(".")[:3]) + ".0/24"
 
+    @SCAN_PHASE_SECONDS.timed(phase="vendor")
     def get_vendor(self, mac_address):
-        """查詢 MAC 地址廠商（同步方式）"""
+        """查詢 MAC 地址廠商（本機 OUI 索引）"""
+        return self.vendor_resolver.lookup(mac_address) or "Unknown Vendor"
+
+    async def _scan_async(self, target_ip, deep_scan, emit, progress=None, cancel=None, stop=None):
+        """
+        串流掃描主流程：ARP 回應抵達即建立裝置並開始補齊資訊
+        :param emit: 事件回呼函式 emit(event)
+        :param progress: 進度回呼函式 progress(dict)，見 ScanProgress
+        :param cancel: threading.Event，設定後停止 ARP 掃描並取消尚未完成的探測與查詢
+        :param stop: threading.Event，呼叫端內部的停止旗標，效果與 cancel 相同（見 scan_iter）
+        :return: 完整的裝置列表
+        """
+        loop = asyncio.get_running_loop()
+        tracker = ScanProgress(progress) if progress is not None else None
+        engine = PortScanEngine(
+            max_concurrency=self.max_port_concurrency,
+            per_host_limit=self.per_host_port_limit,
+            on_probe=tracker.probed if tracker else None,
+        ) if deep_scan else None
+
+        # cancel 與 stop 由同一個監看合併：任一個被設定時設定 halt（ARP 掃描等待的旗標）並取消主流程
+        watched = [event for event in (cancel, stop) if event is not None]
+        halt = None
+        watcher = None
+        if watched:
+            halt = watched[0] if len(watched) == 1 else threading.Event()
+            watcher = loop.create_task(self._cancel_when_set(watched, halt, asyncio.current_task()))
+        started = time.perf_counter()
         try:
-            return _mac_lookup.lookup(mac_address)
-        except Exception:
-            return "Unknown Vendor"
+            devices = await self._scan_devices(loop, target_ip, deep_scan, emit, engine, tracker, halt)
+            # 只記錄完成的掃描，取消或失敗的掃描不列入
+            SCAN_SECONDS.observe(time.perf_counter() - started, deep_scan=str(bool(deep_scan)).lower())
+            return devices
+        finally:
+            if watcher is not None:
+                watcher.cancel()
 
-    def scan(self, target_ip=None, deep_scan=False):
+    @staticmethod
+    async def _cancel_when_set(watched, halt, task, poll=0.05):
         """
-        掃描網路設備
-        :param target_ip: 目標 IP 範圍 (例如 '192.168.1.0/24')
-        :param deep_scan: 是否執行深度掃描（Port 掃描），會花較長時間
-        :return: 設備列表 [{"ip": "...", "mac": "...", "vendor": "...", "hostname": "...", "ports": [...]}, ...]
+        任一取消旗標被設定時取消掃描主流程（連帶取消所有進行中的埠探測與主機名稱查詢）
+        :param watched: 要監看的 threading.Event 列表
+        :param halt: 同時設定的 threading.Event，讓在執行緒中等待它的 ARP 掃描也停止
+        """
+        while not any(event.is_set() for event in watched):
+            await asyncio.sleep(poll)
+        halt.set()
+        task.cancel()
+
+    async def _scan_devices(self, loop, target_ip, deep_scan, emit, engine, tracker, cancel):
+        """見 _scan_async；engine 為 None 表示不掃描開放埠，tracker 為 None 表示不回報進度"""
+        devices = []
+        seen = set()
+        tasks = []
+
+        def update(device, field, value):
+            device[field] = value
+            emit({"type": "update", "ip": device["ip"], "mac": device["mac"], "field": field, "value": value})
+
+        def from_cache(device, field):
+            """快取中仍新鮮的值直接套用，回傳是否命中"""
+            if self.cache is None:
+                return False
+            hit, value = self.cache.get(field, device["mac"], device["ip"])
+            if hit:
+                update(device, field, value)
+            return hit
+
+        def remember(device, field, value):
+            if self.cache is not None:
+                self.cache.put(field, device["mac"], value, device["ip"])
+
+        async def resolve_hostname(device):
+            try:
+                with SCAN_PHASE_SECONDS.time(phase="hostname"):
+                    hostname = await self.resolver.resolve(device["ip"])
+            finally:
+                if tracker:
+                    tracker.lookup(done=True)
+            # 查不到的結果交給 resolver 的負向快取處理
+            if hostname:
+                remember(device, "hostname", hostname)
+            update(device, "hostname", hostname)
+
+        async def scan_ports(device):
+            open_ports = self._port_records(await engine.scan_host(device["ip"], self.DEFAULT_PORTS))
+            remember(device, "ports", open_ports)
+            update(device, "ports", open_ports)
+
+        def on_reply(ip, mac):
+            # 同一 IP 可能重複回應（或由多個介面收到），只採用第一個
+            if ip in seen:
+                return
+            seen.add(ip)
+
+            device = {"ip": ip, "mac": mac, "vendor": None, "hostname": None, "ports": []}
+            devices.append(device)
+            emit({"type": "device", "device": dict(device)})
+
+            # 快取命中的欄位直接套用，只重新查詢過期或未知的部分
+            if not from_cache(device, "vendor"):
+                vendor = self.get_vendor(mac)
+                # OUI 索引可能仍在背景更新，查不到的結果不快取
+                if vendor != "Unknown Vendor":
+                    remember(device, "vendor", vendor)
+                update(device, "vendor", vendor)
+            if not from_cache(device, "hostname"):
+                if tracker:
+                    tracker.lookup()
+                tasks.append(loop.create_task(resolve_hostname(device)))
+            probe_ports = deep_scan and not from_cache(device, "ports")
+            if probe_ports:
+                tasks.append(loop.create_task(scan_ports(device)))
+            if tracker:
+                tracker.found(len(self.DEFAULT_PORTS) if probe_ports else 0)
+
+        on_sent = None
+        if tracker:
+            def on_sent(done, total):
+                loop.call_soon_threadsafe(tracker.swept, done, total)
+
+        try:
+            with SCAN_PHASE_SECONDS.time(phase="arp"):
+                await loop.run_in_executor(
+                    None, self.sweeper.sweep, target_ip,
+                    lambda ip, mac: loop.call_soon_threadsafe(on_reply, ip, mac),
+                    on_sent, cancel
+                )
+            # 讓收包執行緒最後排入的回呼先執行完
+            await asyncio.sleep(0)
+            # ARP 掃描因取消而提早結束時，不等取消監看就直接停止
+            if cancel is not None and cancel.is_set():
+                raise asyncio.CancelledError
+
+            if tracker:
+                tracker.set_phase("enrich")
+            if tasks:
+                logger.info(f"Enriching {len(tasks)} stale or unknown fields...")
+            with SCAN_PHASE_SECONDS.time(phase="enrich"):
+                await asyncio.gather(*tasks)
+        except asyncio.CancelledError:
+            # gather 被取消時會取消子工作；ARP 掃描途中被取消時，已排入的工作在這裡取消
+            for task in tasks:
+                task.cancel()
+            logger.info("Scan cancelled")
+            raise
+
+        if tracker:
+            tracker.set_phase("done")
+
+        if self.cache is not None:
+            with SCAN_PHASE_SECONDS.time(phase="cache_flush"):
+                await loop.run_in_executor(None, self.cache.flush)
+        return devices
+
+    def scan_iter(self, target_ip=None, deep_scan=False, progress=None, cancel=None):
+        """
+        串流掃描：每收到一個 ARP 回應就立即產生裝置事件，之後陸續產生補齊資訊的更新事件
+        :param target_ip: 目標 IP 範圍 (例如 '192.168.1.0/24')，或多個 CIDR 的列表
+        :param deep_scan: 是否執行深度掃描（Port 掃描）
+        :param progress: 進度回呼函式 progress(dict)，在掃描執行緒中呼叫，見 ScanProgress
+        :param cancel: threading.Event，設定後盡快停止掃描（產生 cancelled 事件）
+        消費端提早停止迭代（break、close() 或產生器被回收）時，掃描執行緒也會停止，不需要讀到 done
+        :yields: 事件 dict，type 為下列其一：
+            {"type": "device", "device": {...}}  新發現的裝置（尚未補齊資訊）
+            {"type": "update", "ip": "...", "mac": "...", "field": "vendor" | "hostname" | "ports", "value": ...}
+            {"type": "error", "error": "..."}
+            {"type": "cancelled"}                 掃描被取消
+            {"type": "done", "devices": [...]}   掃描完成，附完整裝置列表
         """
         if not target_ip:
             local_ip = self.get_local_ip()
@@ -167,56 +614,60 @@ class NetworkScanner:
             logger.info(f"Auto-detected subnet: {target_ip}")
 
         logger.info(f"Scanning target: {target_ip}, deep_scan={deep_scan}")
-        
-        # 構造 ARP 請求
-        # Ether(dst="ff:ff:ff:ff:ff:ff") 表示廣播
-        # ARP(pdst=target_ip) 表示查詢目標 IP
-        arp = ARP(pdst=target_ip)
-        ether = Ether(dst="ff:ff:ff:ff:ff:ff")
-        packet = ether/arp
+
+        events = queue.Queue()
+        finished = object()
+        # 消費端停止迭代時設定，掃描執行緒隨即停止，也不再排入事件
+        stop = threading.Event()
+
+        def emit(event):
+            if not stop.is_set():
+                events.put(event)
+
+        def worker():
+            try:
+                devices = asyncio.run(self._scan_async(target_ip, deep_scan, emit, progress, cancel, stop))
+                logger.info(f"Found {len(devices)} devices.")
+                emit({"type": "done", "devices": devices})
+            except asyncio.CancelledError:
+                emit({"type": "cancelled"})
+            except PermissionError:
+                logger.error("Permission denied. Please run as Administrator.")
+                emit({"type": "error", "error": "Permission denied. Please run as Administrator."})
+            except Exception as e:
+                logger.error(f"Scan error: {e}")
+                emit({"type": "error", "error": f"Scan failed: {str(e)}"})
+            finally:
+                events.put(finished)
+
+        threading.Thread(target=worker, daemon=True).start()
 
         try:
-            # 找到正確的網路介面
-            iface = find_interface_for_network(target_ip)
-            if iface:
-                logger.info(f"Using interface: {iface}")
-            else:
-                logger.warning(f"Could not find matching interface for {target_ip}, using default")
-                iface = conf.iface
-            
-            # srp 發送並接收 Layer 2 數據包
-            # timeout=3: 等待 3 秒 (增加 timeout 以確保收到回應)
-            # verbose=0: 不顯示 Scapy 的輸出
-            # iface: 明確指定網路介面
-            result = srp(packet, timeout=3, verbose=0, iface=iface)[0]
-        except PermissionError:
-            logger.error("Permission denied. Please run as Administrator.")
-            return [{"error": "Permission denied. Please run as Administrator."}]
-        except Exception as e:
-            logger.error(f"Scan error: {e}")
-            return [{"error": f"Scan failed: {str(e)}"}]
+            while True:
+                event = events.get()
+                if event is finished:
+                    break
+                yield event
+        finally:
+            stop.set()
 
+    def scan(self, target_ip=None, deep_scan=False, progress=None, cancel=None):
+        """
+        掃描網路設備
+        :param target_ip: 目標 IP 範圍 (例如 '192.168.1.0/24')，或多個 CIDR 的列表
+        :param deep_scan: 是否執行深度掃描（Port 掃描），會花較長時間
+        :param progress: 進度回呼函式 progress(dict)，見 ScanProgress
+        :param cancel: threading.Event，設定後盡快停止掃描
+        :return: 設備列表 [{"ip": "...", "mac": "...", "vendor": "...", "hostname": "...", "ports": [...]}, ...]
+        """
         devices = []
-        for sent, received in result:
-            ip = received.psrc
-            mac = received.hwsrc
-            
-            device = {
-                "ip": ip,
-                "mac": mac,
-                "vendor": self.get_vendor(mac),
-                "hostname": self.get_hostname(ip),
-                "ports": []
-            }
-            
-            # 深度掃描：Port 掃描
-            if deep_scan:
-                logger.info(f"Port scanning {ip}...")
-                device["ports"] = self.port_scan(ip)
-            
-            devices.append(device)
-
-        logger.info(f"Found {len(devices)} devices.")
+        for event in self.scan_iter(target_ip, deep_scan, progress, cancel):
+            if event["type"] == "error":
+                return [{"error": event["error"]}]
+            if event["type"] == "cancelled":
+                return [{"error": "Scan cancelled"}]
+            if event["type"] == "done":
+                devices = event["devices"]
         return devices
 
 if __name__ == "__main__":
@@ -0,0 +1,167 @@
+"""
+背景定時工作（定時掃描、資料庫保留政策）
+在 FastAPI 的 event loop 中排程：同步工作交給專用的執行緒池，不會佔用 API 的預設執行緒池；
+定時掃描則直接等待 ScanCoordinator（掃描在它的執行緒池中執行）。
+"""
+
+import asyncio
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask:
+    """
+    定時執行同步工作
+    - 上一次執行結束後才開始計算下一次的等待時間，因此不會重疊
+    - 每次等待時間加上隨機抖動，避免多台主機同時執行
+    - 工作在專用的有界執行緒池中執行，不會拖慢 API（第一次執行時才建立，子類別覆寫 _run 時不會建立）
+    """
+
+    def __init__(self, job, interval=300, jitter=0.1, name="periodic"):
+        """
+        :param job: 同步函式 job() -> dict
+        :param interval: 執行間隔秒數
+        :param jitter: 抖動比例，0.1 表示間隔在 ±10% 內隨機
+        :param name: 名稱（用於日誌與執行緒名稱）
+        """
+        self.job = job
+        self.interval = interval
+        self.jitter = jitter
+        self.name = name
+        self._executor = None
+        self._lock = asyncio.Lock()
+        self._task = None
+        self._next_run_at = None
+        self._stats = {
+            "runs": 0,
+            "failures": 0,
+            "last_started_at": None,
+            "last_duration": None,
+            "last_result": None,
+            "last_error": None,
+        }
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self, interval=None, jitter=None):
+        """
+        啟動排程（已在執行中時套用新設定並重新開始計時）
+        :return: 目前狀態
+        """
+        if interval is not None:
+            self.interval = max(float(interval), 1.0)
+        if jitter is not None:
+            self.jitter = min(max(float(jitter), 0.0), 1.0)
+
+        if self.running:
+            self._task.cancel()
+        self._task = asyncio.get_running_loop().create_task(self._loop())
+        logger.info(f"{self.name} scheduler started: every {self.interval}s (±{self.jitter:.0%})")
+        return self.status()
+
+    async def stop(self):
+        """停止排程；進行中的工作會跑完，但不再排入新的工作"""
+        task, self._task = self._task, None
+        self._next_run_at = None
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            logger.info(f"{self.name} scheduler stopped")
+        return self.status()
+
+    async def run_once(self):
+        """
+        立即執行一次（與排程共用鎖，不會重疊）
+        :return: job 的回傳值
+        """
+        async with self._lock:
+            started = time.time()
+            self._stats["last_started_at"] = started
+            try:
+                result = await self._run()
+            except Exception as e:
+                self._stats["failures"] += 1
+                self._stats["last_error"] = str(e)
+                logger.error(f"Scheduled {self.name} failed: {e}")
+                raise
+            finally:
+                self._stats["runs"] += 1
+                self._stats["last_duration"] = time.time() - started
+            self._stats["last_result"] = result
+            self._stats["last_error"] = None
+            return result
+
+    async def _run(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"whodis-{self.name}")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.job)
+
+    def _next_delay(self):
+        return self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    async def _loop(self):
+        while True:
+            delay = self._next_delay()
+            self._next_run_at = time.time() + delay
+            await asyncio.sleep(delay)
+            self._next_run_at = None
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # 失敗已記錄在 stats，下一輪照常執行
+                pass
+
+    def status(self):
+        """排程狀態與最近一次執行結果"""
+        return {
+            "running": self.running,
+            "busy": self._lock.locked(),
+            "interval": self.interval,
+            "jitter": self.jitter,
+            "next_run_at": self._next_run_at,
+            **self._stats,
+        }
+
+    def shutdown(self):
+        """關閉執行緒池（程式結束時呼叫）"""
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+class ScanScheduler(PeriodicTask):
+    """定時掃描，job 依設定決定是否深度掃描"""
+
+    def __init__(self, job, interval=300, jitter=0.1, deep_scan=False):
+        """
+        :param job: async 函式 job(deep_scan) -> dict，負責掃描並儲存結果（經由 ScanCoordinator，與 API 請求共用進行中的掃描）
+        :param interval: 掃描間隔秒數
+        :param jitter: 抖動比例，0.1 表示間隔在 ±10% 內隨機
+        :param deep_scan: 是否執行深度掃描
+        """
+        super().__init__(job, interval, jitter, name="scan")
+        self.deep_scan = deep_scan
+
+    def start(self, interval=None, jitter=None, deep_scan=None):
+        if deep_scan is not None:
+            self.deep_scan = deep_scan
+        return super().start(interval, jitter)
+
+    async def _run(self):
+        # 掃描本身在 ScanCoordinator 的執行緒池中執行，這裡只等待結果
+        return await self.job(self.deep_scan)
+
+    def status(self):
+        return {**super().status(), "scanning": self._lock.locked(), "deep_scan": self.deep_scan}
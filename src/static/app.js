@@ -30,15 +30,8 @@ async function scanNetwork() {
     analysisContent.textContent = '';
 
     try {
-        // 1. 執行掃描
-        const response = await fetch(`${API_BASE}/api/scan`, {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ deep_scan: deepScan })
-        });
-
-        const data = await response.json();
-        const devices = data.devices || [];
+        // 1. 串流掃描：裝置一發現就顯示，之後陸續補上廠商、主機名稱與 Port
+        const devices = await streamScan(deepScan);
 
         // 2. 顯示裝置
         progressBar.classList.add('hidden');
@@ -62,6 +55,40 @@ async function scanNetwork() {
     }
 }
 
+// 串流掃描（SSE），回傳完整裝置列表
+function streamScan(deepScan) {
+    return new Promise((resolve, reject) => {
+        const source = new EventSource(`${API_BASE}/api/scan/stream?deep_scan=${deepScan}`);
+        const devices = [];
+
+        source.onmessage = (e) => {
+            const event = JSON.parse(e.data);
+
+            if (event.type === 'device') {
+                devices.push(event.device);
+                statusEl.textContent = `掃描中... 已發現 ${devices.length} 個裝置`;
+            } else if (event.type === 'update') {
+                const device = devices.find(d => d.mac === event.mac && d.ip === event.ip);
+                if (device) device[event.field] = event.value;
+            } else if (event.type === 'error') {
+                source.close();
+                resolve([{ error: event.error }]);
+                return;
+            } else if (event.type === 'done') {
+                source.close();
+                resolve(event.devices);
+                return;
+            }
+            renderDevices(devices);
+        };
+
+        source.onerror = () => {
+            source.close();
+            reject(new Error('掃描連線中斷'));
+        };
+    });
+}
+
 // 渲染裝置列表
 function renderDevices(devices) {
     if (!devices.length) {
@@ -136,6 +163,8 @@ async function analyzeDevices(devices) {
         const reader = response.body.getReader();
         const decoder = new TextDecoder();
         let text = '';
+        // map-reduce 模式：合併報告開始前先顯示各部分的發現
+        let findings = '';
 
         while (true) {
             const { done, value } = await reader.read();
@@ -148,6 +177,10 @@ async function analyzeDevices(devices) {
                 if (line.startsWith('data: ')) {
                     try {
                         const data = JSON.parse(line.slice(6));
+                        if (data.findings && !text) {
+                            findings += `[${data.shard}/${data.shards} ${data.label}]\n${data.findings}\n\n`;
+                            analysisContent.textContent = findings;
+                        }
                         if (data.response) {
                             text += data.response;
                             analysisContent.textContent = text;
@@ -166,5 +199,52 @@ async function analyzeDevices(devices) {
     }
 }
 
+// 即時裝置動態（WebSocket）：其他分頁、API 或定時掃描完成時，只收到差異並更新列表
+const liveDevices = new Map();
+
+function applyDelta(delta) {
+    for (const device of delta.up) liveDevices.set(device.mac, { ...device, subnet: delta.subnet });
+    for (const device of delta.down) liveDevices.delete(device.mac);
+    for (const entry of delta.changed) {
+        const device = liveDevices.get(entry.mac);
+        if (!device) continue;
+        const { ip, hostname, ports } = entry.changes;
+        if (ip) device.ip = ip.new;
+        if (hostname) device.hostname = hostname.new;
+        if (ports) {
+            const closed = new Set(ports.closed.map(p => p.port));
+            device.ports = (device.ports || []).filter(p => !closed.has(p.port)).concat(ports.opened);
+        }
+    }
+}
+
+function connectDeviceFeed() {
+    const protocol = location.protocol === 'https:' ? 'wss:' : 'ws:';
+    const socket = new WebSocket(`${protocol}//${location.host}/ws/devices`);
+
+    socket.onmessage = (e) => {
+        const message = JSON.parse(e.data);
+        if (message.type === 'snapshot') {
+            liveDevices.clear();
+            for (const device of message.devices) liveDevices.set(device.mac, device);
+        } else if (message.type === 'delta') {
+            applyDelta(message);
+            if (!isScanning) {
+                const parts = [];
+                if (message.up.length) parts.push(`${message.up.length} 個上線`);
+                if (message.down.length) parts.push(`${message.down.length} 個離線`);
+                if (message.changed.length) parts.push(`${message.changed.length} 個變更`);
+                statusEl.textContent = `即時更新：${parts.join('、')}`;
+            }
+        }
+        // 掃描進行中由掃描串流更新列表
+        if (!isScanning && liveDevices.size) renderDevices([...liveDevices.values()]);
+    };
+
+    // 斷線後稍後重連（重連時會重新收到快照）
+    socket.onclose = () => setTimeout(connectDeviceFeed, 5000);
+}
+
 // 事件綁定
 scanBtn.addEventListener('click', scanNetwork);
+connectDeviceFeed();
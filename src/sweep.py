@@ -0,0 +1,386 @@
+"""
+ARP 掃描引擎
+- 從路由表讀取各網路介面實際的網段（netmask），不再假設 /24
+- 接受多個 CIDR（包含 /16 以上的大範圍），切成批次並控制送包速率
+- 不同介面平行掃描，回應即時回呼，由呼叫端合併成同一份裝置表
+- 回應停止一段時間後提早結束等待；先前出現過但這次沒回應的主機以 unicast 重試
+"""
+
+import ipaddress
+import logging
+import struct
+import threading
+import time
+
+from scapy.all import ARP, Ether, AsyncSniffer, conf, get_if_hwaddr, get_if_addr, resolve_iface
+
+logger = logging.getLogger(__name__)
+
+# ARP 請求在 Ethernet frame 中的欄位位移（Ether 14 bytes + ARP 表頭 8 bytes 之後）
+_ETHER_DST = slice(0, 6)
+_ARP_HWDST = slice(32, 38)
+_PDST_OFFSET = 38
+
+
+def get_interface_networks():
+    """
+    從 scapy 路由表取得各介面直連的 IPv4 網段
+    :return: [(iface, IPv4Network, 介面 IP), ...]，依網段大小由小到大排序
+    """
+    networks = []
+    for net, mask, gateway, iface, addr, metric in conf.route.routes:
+        # 只取直連網段；略過預設路由、單一主機路由
+        if gateway != "0.0.0.0" or mask in (0, 0xFFFFFFFF) or addr in (None, "0.0.0.0"):
+            continue
+        try:
+            network = ipaddress.IPv4Network((net, bin(mask).count("1")), strict=False)
+            address = ipaddress.IPv4Address(addr)
+        except ValueError:
+            continue
+        # 略過 loopback 與不包含介面 IP 的路由（例如 multicast）
+        if network.is_loopback or address not in network:
+            continue
+        name = iface if isinstance(iface, str) else getattr(iface, "name", str(iface))
+        networks.append((name, network, addr))
+
+    networks.sort(key=lambda item: item[1].num_addresses)
+    return networks
+
+
+def get_network_for_ip(ip):
+    """
+    取得 IP 所在介面的實際網段
+    :return: IPv4Network 或 None
+    """
+    address = ipaddress.IPv4Address(ip)
+    for _, network, _ in get_interface_networks():
+        if address in network:
+            return network
+    return None
+
+
+def find_interface_for_network(target_subnet):
+    """
+    找到對應目標子網的網路介面（網段有重疊即視為相符）
+    例如：如果目標是 192.168.0.0/24，會找到 IP 為 192.168.0.x 的介面
+    """
+    target = ipaddress.IPv4Network(target_subnet, strict=False)
+    for iface, network, addr in get_interface_networks():
+        if network.overlaps(target):
+            logger.info(f"Found matching interface: {iface} with IP {addr}")
+            return iface
+    return None
+
+
+def plan_sweep(targets):
+    """
+    將目標 CIDR 分配到各介面
+    目標比介面網段大時只掃描介面網段（ARP 只在同一個廣播域有效）；
+    沒有任何介面相符的目標使用預設介面掃描。
+    :param targets: CIDR 字串或 CIDR 列表
+    :return: {iface: [IPv4Network, ...]}
+    """
+    if isinstance(targets, str):
+        targets = [targets]
+
+    interfaces = get_interface_networks()
+    plan = {}
+    for target in targets:
+        target = ipaddress.IPv4Network(target, strict=False)
+        matched = False
+        for iface, network, _ in interfaces:
+            if not network.overlaps(target):
+                continue
+            matched = True
+            part = target if target.subnet_of(network) else network
+            plan.setdefault(iface, []).append(part)
+        if not matched:
+            logger.warning(f"Could not find matching interface for {target}, using default")
+            iface = conf.iface if isinstance(conf.iface, str) else conf.iface.name
+            plan.setdefault(iface, []).append(target)
+
+    # 合併重疊的目標，避免同一位址送出多次
+    return {iface: list(ipaddress.collapse_addresses(networks)) for iface, networks in plan.items()}
+
+
+def address_filter(networks):
+    """
+    建立「位址是否在目標網段內」的判斷函式（收包執行緒中每個回應都會呼叫，先轉成整數區間）
+    :return: contains(ip 字串) -> bool
+    """
+    ranges = [(int(n.network_address), int(n.broadcast_address)) for n in networks]
+
+    def contains(ip):
+        try:
+            value = int(ipaddress.IPv4Address(ip))
+        except ValueError:
+            return False
+        return any(low <= value <= high for low, high in ranges)
+
+    return contains
+
+
+def is_reply_to(packet, ip, mac):
+    """
+    是否為回覆本機請求的 ARP 回應
+    混雜模式下會收到網段上所有 ARP 封包；gratuitous ARP 與回覆其他主機的回應都不採用
+    :param ip: 本機介面 IP
+    :param mac: 本機介面 MAC
+    """
+    if ARP not in packet:
+        return False
+    arp = packet[ARP]
+    return arp.op == 2 and arp.pdst == ip and arp.hwdst.lower() == mac
+
+
+def iter_host_addresses(networks):
+    """逐一產生網段內的主機位址（4 bytes），排除網路位址與廣播位址"""
+    for network in networks:
+        first = int(network.network_address)
+        last = int(network.broadcast_address)
+        if network.prefixlen < 31:
+            first, last = first + 1, last - 1
+        for value in range(first, last + 1):
+            yield struct.pack("!I", value)
+
+
+class ScapyTransport:
+    """
+    以 scapy Layer 2 socket 收發 ARP 封包
+    與 srp 相同：同一個 socket 負責收發，權限不足會在 open 時直接拋出
+    """
+
+    def __init__(self, iface):
+        self.iface = iface
+        self._sock = None
+        self._sniffer = None
+
+    def open(self, on_reply):
+        """
+        開啟 socket 並開始接收 ARP 回應
+        :param on_reply: 回呼函式 on_reply(ip, mac)，在收包執行緒中呼叫
+        """
+        self._sock = resolve_iface(self.iface).l2socket()(iface=self.iface)
+        ip, mac = get_if_addr(self.iface), get_if_hwaddr(self.iface).lower()
+
+        def handle(p):
+            # prn 的回傳值會被 scapy 印出，因此不回傳任何東西
+            on_reply(p[ARP].psrc, p[ARP].hwsrc)
+
+        started = threading.Event()
+        self._sniffer = AsyncSniffer(
+            opened_socket=self._sock,
+            store=False,
+            lfilter=lambda p: is_reply_to(p, ip, mac),
+            prn=handle,
+            started_callback=started.set,
+        )
+        self._sniffer.start()
+        started.wait(1)
+
+    def template(self):
+        """建立此介面的 ARP 廣播請求樣板（目標 IP 之後再填入）"""
+        mac = get_if_hwaddr(self.iface)
+        return bytes(
+            Ether(dst="ff:ff:ff:ff:ff:ff", src=mac)
+            / ARP(op=1, hwsrc=mac, psrc=get_if_addr(self.iface), pdst="0.0.0.0")
+        )
+
+    def send(self, frame):
+        self._sock.send(frame)
+
+    def close(self):
+        try:
+            if self._sniffer is not None and self._sniffer.running:
+                self._sniffer.stop()
+        finally:
+            if self._sock is not None:
+                self._sock.close()
+
+
+class ArpSweeper:
+    """
+    ARP 掃描引擎
+    預先建好 ARP 樣板，只替換目標 IP 的 4 bytes，依設定速率分批送出。
+    送完後不固定等待 timeout：回應停止 idle_timeout 秒即結束（timeout 為上限）。
+    先前掃描回應過、這次卻沒回應的位址，以 unicast ARP 重試 retries 次（對 Wi-Fi 掉包較有效）。
+    """
+
+    def __init__(self, timeout=3, idle_timeout=0.5, rate=5000, batch_size=256, retries=2,
+                 max_hosts=1 << 20, transport_factory=ScapyTransport):
+        """
+        :param timeout: 每一輪送出後等待回應的上限秒數
+        :param idle_timeout: 超過此秒數沒有新回應就提早結束等待
+        :param rate: 每個介面每秒最多送出幾個 ARP 請求
+        :param batch_size: 每批送出的封包數，批次之間依速率暫停
+        :param retries: 已知主機未回應時的 unicast 重試次數，0 表示不重試
+        :param max_hosts: 單次掃描的位址上限，避免誤掃 /8 這類範圍
+        :param transport_factory: transport_factory(iface) 建立收發封包的物件（測試時可替換）
+        """
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.rate = rate
+        self.batch_size = batch_size
+        self.retries = retries
+        self.max_hosts = max_hosts
+        self.transport_factory = transport_factory
+        self._known = {}  # ip -> mac，先前掃描回應過的主機
+        self._lock = threading.Lock()
+
+    def remember(self, hosts):
+        """
+        加入已知主機（例如從資料庫載入上次的掃描結果）
+        :param hosts: 可迭代的 (ip, mac)
+        """
+        with self._lock:
+            self._known.update(hosts)
+
+    def sweep(self, targets, on_reply, on_sent=None, cancel=None):
+        """
+        掃描所有目標（阻塞至完成），各介面平行進行
+        :param targets: CIDR 字串或 CIDR 列表
+        :param on_reply: 回呼函式 on_reply(ip, mac)，可能在多個執行緒中呼叫
+        :param on_sent: 進度回呼 on_sent(已送出, 位址總數)，每批送出後呼叫，可能在多個執行緒中呼叫
+        :param cancel: threading.Event，設定後停止送出並結束等待
+        """
+        plan = plan_sweep(targets)
+        total = sum(
+            max(network.num_addresses - 2, 1) for networks in plan.values() for network in networks
+        )
+        if total > self.max_hosts:
+            raise ValueError(f"Target range too large: {total} addresses (max {self.max_hosts})")
+
+        logger.info(f"ARP sweep of {total} addresses on {len(plan)} interface(s)")
+        errors = []
+        sent = [0]
+        sent_lock = threading.Lock()
+
+        def count(n):
+            with sent_lock:
+                sent[0] += n
+                done = sent[0]
+            if on_sent is not None:
+                on_sent(min(done, total), total)
+
+        def run(iface, networks):
+            try:
+                self._sweep_interface(iface, networks, on_reply, count, cancel)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [
+            threading.Thread(target=run, args=(iface, networks), daemon=True)
+            for iface, networks in plan.items()
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # 全部介面都失敗才視為掃描失敗，部分失敗只記錄
+        if errors and len(errors) == len(threads):
+            raise errors[0]
+        for e in errors:
+            logger.warning(f"ARP sweep failed on one interface: {e}")
+
+    def _sweep_interface(self, iface, networks, on_reply, count=None, cancel=None):
+        """在單一介面上分批送出 ARP 請求、等待回應，並對未回應的已知主機重試"""
+        logger.info(f"Using interface: {iface} for {', '.join(map(str, networks))}")
+        replied = set()
+        last_reply = [0.0]
+        in_target = address_filter(networks)
+
+        def handle(ip, mac):
+            # 只採用目標網段內的回應（例如掃描 /28 時，不接受同一個 /24 其他主機的回應）
+            if not in_target(ip):
+                return
+            last_reply[0] = time.monotonic()
+            with self._lock:
+                replied.add(ip)
+                self._known[ip] = mac
+            on_reply(ip, mac)
+
+        transport = self.transport_factory(iface)
+        transport.open(handle)
+        started = time.monotonic()
+        try:
+            template = transport.template()
+            head, tail = template[:_PDST_OFFSET], template[_PDST_OFFSET + 4:]
+            frames = (head + address + tail for address in iter_host_addresses(networks))
+            self._send_paced(transport, frames, count, cancel)
+            self._wait_for_replies(last_reply, cancel)
+            first_pass = len(replied)
+
+            # 重試：只針對先前回應過、這次卻沒回應的位址，以 unicast 送出
+            for _ in range(self.retries):
+                missing = self._missing_known_hosts(networks, replied)
+                if not missing or (cancel is not None and cancel.is_set()):
+                    break
+                logger.info(f"Retrying {len(missing)} known hosts on {iface} by unicast")
+                self._send_paced(transport, (
+                    _unicast_frame(template, ip, mac) for ip, mac in missing
+                ), cancel=cancel)
+                self._wait_for_replies(last_reply, cancel)
+
+            logger.info(
+                f"ARP sweep on {iface}: {len(replied)} replies "
+                f"({len(replied) - first_pass} recovered by retry) in {time.monotonic() - started:.2f}s"
+            )
+        finally:
+            transport.close()
+
+    def _send_paced(self, transport, frames, count=None, cancel=None):
+        """依設定速率分批送出封包；每批送完回報數量，並在取消時停止"""
+        start = time.monotonic()
+        sent = 0
+        for frame in frames:
+            transport.send(frame)
+            sent += 1
+            # 每批送完後依速率暫停
+            if sent % self.batch_size == 0:
+                if count is not None:
+                    count(self.batch_size)
+                if cancel is not None and cancel.is_set():
+                    return
+                delay = start + sent / self.rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+        if count is not None and sent % self.batch_size:
+            count(sent % self.batch_size)
+
+    def _wait_for_replies(self, last_reply, cancel=None):
+        """
+        等待回應：最後一個回應（或送出完成）後 idle_timeout 秒內沒有新回應即結束，
+        最多等待 timeout 秒；取消時立即結束
+        """
+        sent_at = time.monotonic()
+        deadline = sent_at + self.timeout
+        while True:
+            now = time.monotonic()
+            idle_until = max(last_reply[0], sent_at) + self.idle_timeout
+            wake = min(idle_until, deadline)
+            if now >= wake:
+                return
+            if cancel is None:
+                time.sleep(wake - now)
+            elif cancel.wait(wake - now):
+                return
+
+    def _missing_known_hosts(self, networks, replied):
+        """目標網段內先前回應過、這次尚未回應的主機 [(ip, mac), ...]"""
+        with self._lock:
+            known = [(ip, mac) for ip, mac in self._known.items() if ip not in replied]
+        return [
+            (ip, mac) for ip, mac in known
+            if any(ipaddress.IPv4Address(ip) in network for network in networks)
+        ]
+
+
+def _unicast_frame(template, ip, mac):
+    """由廣播樣板建立指定目標 MAC 的 unicast ARP 請求"""
+    frame = bytearray(template)
+    mac_bytes = bytes.fromhex(mac.replace(":", "").replace("-", ""))
+    frame[_ETHER_DST] = mac_bytes
+    frame[_ARP_HWDST] = mac_bytes
+    frame[_PDST_OFFSET:_PDST_OFFSET + 4] = ipaddress.IPv4Address(ip).packed
+    return bytes(frame)
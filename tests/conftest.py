@@ -0,0 +1,40 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+
+@pytest.fixture
+def db(tmp_path):
+    """暫存目錄中的空資料庫"""
+    from database import Database
+
+    database = Database(tmp_path / "test.db")
+    yield database
+    database.close()
+
+
+SEEDED_DEVICE = {"ip": "192.168.77.10", "mac": "aa:bb:cc:00:00:10", "vendor": "Apple", "hostname": "seed", "ports": []}
+
+
+@pytest.fixture(scope="session")
+def app_client(tmp_path_factory):
+    """
+    以暫存資料庫啟動的 FastAPI app（整個測試過程共用一次 lifespan，結束時才關閉執行緒池）
+    資料庫預先存有一筆掃描（SEEDED_DEVICE）
+    :return: (app 模組, TestClient)
+    """
+    import database
+    from fastapi.testclient import TestClient
+
+    path = tmp_path_factory.mktemp("app") / "whodis.db"
+    seed = database.Database(path)
+    seed.save_scan([SEEDED_DEVICE], "192.168.77.0/24")
+    seed.close()
+    database.DB_PATH = path
+
+    import app
+    with TestClient(app.app) as client:
+        yield app, client
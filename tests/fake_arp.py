@@ -0,0 +1,136 @@
+"""
+模擬的 L2 網段（測試與效能測試用）
+取代 sweep.ScapyTransport：收到 ARP 請求時，若目標位址是模擬主機，就在設定的延遲後回呼 on_reply，
+可設定掉包率（請求或回應遺失）。不需要 raw socket 權限、scapy 的收發封包或實體網路。
+
+使用方式：
+    lan = FakeLan.generate("127.77.0.0/22", 500, loss=0.05)
+    sweeper = ArpSweeper(transport_factory=lan.transport)
+"""
+
+import heapq
+import ipaddress
+import random
+import socket
+import struct
+import threading
+import time
+
+_BROADCAST = b"\xff" * 6
+_LOCAL_MAC = bytes.fromhex("020000000001")
+
+
+def _mac_bytes(mac):
+    return bytes.fromhex(mac.replace(":", ""))
+
+
+class FakeLan:
+    """一個廣播域內的模擬主機"""
+
+    def __init__(self, hosts, latency=0.002, jitter=0.003, loss=0.0, seed=0):
+        """
+        :param hosts: {ip: mac}
+        :param latency: 回應的基本延遲秒數
+        :param jitter: 額外的隨機延遲上限秒數
+        :param loss: 每個請求遺失（不回應）的機率
+        :param seed: 亂數種子，讓每次執行的掉包結果相同
+        """
+        self.hosts = dict(hosts)
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "replies": 0, "dropped": 0}
+
+    @classmethod
+    def generate(cls, network, count, seed=0, **kwargs):
+        """
+        在網段中隨機挑選 count 個位址作為模擬主機
+        :param network: CIDR，例如 "127.77.0.0/22"
+        :param count: 主機數
+        """
+        rng = random.Random(seed)
+        addresses = rng.sample(list(ipaddress.IPv4Network(network).hosts()), count)
+        # 本地管理位址（02:00:xx:xx:xx:xx），依序編號不會重複
+        hosts = {
+            str(ip): "02:00:" + ":".join(f"{b:02x}" for b in struct.pack("!I", i + 1))
+            for i, ip in enumerate(sorted(addresses))
+        }
+        return cls(hosts, seed=seed, **kwargs)
+
+    def transport(self, iface):
+        """ArpSweeper 的 transport_factory"""
+        return FakeTransport(self)
+
+    def _answer(self, frame):
+        """
+        決定是否回應一個 ARP 請求
+        :return: (延遲秒數, ip, mac) 或 None
+        """
+        ip = socket.inet_ntoa(frame[38:42])
+        with self._lock:
+            self.stats["requests"] += 1
+            mac = self.hosts.get(ip)
+            if mac is None:
+                return None
+            # unicast 請求只有目標 MAC 相符的主機會收到
+            if frame[0:6] != _BROADCAST and frame[0:6] != _mac_bytes(mac):
+                return None
+            if self._rng.random() < self.loss:
+                self.stats["dropped"] += 1
+                return None
+            self.stats["replies"] += 1
+            return self.latency + self._rng.random() * self.jitter, ip, mac
+
+
+class FakeTransport:
+    """sweep.ScapyTransport 的替代品：回應在背景執行緒中依延遲送出"""
+
+    def __init__(self, lan):
+        self.lan = lan
+        self._pending = []  # (到期時間, 序號, ip, mac)
+        self._sequence = 0
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = None
+
+    def open(self, on_reply):
+        self._thread = threading.Thread(target=self._deliver, args=(on_reply,), daemon=True, name="fake-arp")
+        self._thread.start()
+
+    def template(self):
+        """與 ScapyTransport 相同格式的 ARP 廣播請求（目標 IP 為 0.0.0.0）"""
+        ether = _BROADCAST + _LOCAL_MAC + b"\x08\x06"
+        arp = struct.pack("!HHBBH", 1, 0x0800, 6, 4, 1) + _LOCAL_MAC + socket.inet_aton("127.0.0.1")
+        return ether + arp + b"\x00" * 6 + socket.inet_aton("0.0.0.0")
+
+    def send(self, frame):
+        answer = self.lan._answer(frame)
+        if answer is None:
+            return
+        delay, ip, mac = answer
+        with self._condition:
+            self._sequence += 1
+            heapq.heappush(self._pending, (time.monotonic() + delay, self._sequence, ip, mac))
+            self._condition.notify()
+
+    def _deliver(self, on_reply):
+        while True:
+            with self._condition:
+                while not self._closed:
+                    wait = self._pending[0][0] - time.monotonic() if self._pending else None
+                    if wait is not None and wait <= 0:
+                        break
+                    self._condition.wait(wait)
+                if self._closed:
+                    return
+                _, _, ip, mac = heapq.heappop(self._pending)
+            on_reply(ip, mac)
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,157 @@
+"""
+模擬 Ollama /api/generate 的本機伺服器（測試與效能測試用）
+- stream=true 時每隔 token_delay 秒輸出一行 NDJSON，最後一行帶 done 與統計欄位
+- 可設定 prefill 速度，第一個 token 的延遲隨 prompt 長度增加（模擬模型讀取 prompt）
+- 可限制同時生成的請求數（模擬 OLLAMA_NUM_PARALLEL），超過的請求排隊等待
+- 記錄連線數、收到的 prompt、完成與中途中斷的串流，用來驗證連線重用與取消
+- 可指定哪些 prompt 回傳錯誤（模擬模型失敗），用來驗證部分失敗的處理
+
+可單獨執行：python tests/fake_ollama.py [--port 11434] [--tokens 200] [--token-delay 0.02]
+或在程式中使用：
+    with FakeOllama(tokens=50) as server:
+        AIAnalyzer(host=server.url)
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import socket
+import threading
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+class FakeOllama:
+    """在背景執行緒中執行的假 Ollama 伺服器"""
+
+    def __init__(self, tokens=200, token_delay=0.02, first_token_delay=0.1, port=0, prefill_rate=None, parallel=None,
+                 fail=None):
+        """
+        :param tokens: 每次回應的 token 數
+        :param token_delay: token 之間的間隔秒數
+        :param first_token_delay: 第一個 token 之前的固定延遲
+        :param port: 監聽埠，0 表示自動選擇
+        :param prefill_rate: 每秒處理的 prompt token 數（以 4 字元為一個 token 計），None 表示不隨 prompt 長度增加
+        :param parallel: 同時生成的請求數上限，None 表示不限制
+        :param fail: fail(prompt) 為真時回傳 HTTP 500 與 {"error"}（與 Ollama 相同），None 表示不失敗
+        """
+        self.tokens = tokens
+        self.token_delay = token_delay
+        self.first_token_delay = first_token_delay
+        self.prefill_rate = prefill_rate
+        self.parallel = parallel
+        self.fail = fail
+        self.prompts = []
+        self.port = port or _free_port()
+        self.stats = {"requests": 0, "completed": 0, "aborted": 0, "active": 0, "failed": 0}
+        self._connections = set()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def connections(self):
+        """目前為止看過的 TCP 連線數（以用戶端位址與埠區分）"""
+        return len(self._connections)
+
+    def app(self):
+        app = FastAPI()
+        # 模擬 Ollama 的平行處理數，超過的請求排隊
+        slots = asyncio.Semaphore(self.parallel) if self.parallel else contextlib.nullcontext()
+
+        @app.post("/api/generate")
+        async def generate(request: Request):
+            body = await request.json()
+            self.stats["requests"] += 1
+            self._connections.add((request.client.host, request.client.port))
+            self.prompts.append(body.get("prompt", ""))
+            prompt_tokens = len(body.get("prompt", "")) // 4
+            prefill = self.first_token_delay + (prompt_tokens / self.prefill_rate if self.prefill_rate else 0)
+            if self.fail and self.fail(body.get("prompt", "")):
+                self.stats["failed"] += 1
+                return JSONResponse({"error": "model failed"}, status_code=500)
+
+            def final(elapsed):
+                return {
+                    "model": body.get("model"), "done": True,
+                    "prompt_eval_count": prompt_tokens, "eval_count": self.tokens,
+                    "total_duration": int(elapsed * 1e9),
+                    "prompt_eval_duration": int(prefill * 1e9),
+                    "eval_duration": int(self.tokens * self.token_delay * 1e9),
+                }
+
+            if not body.get("stream", True):
+                started = time.perf_counter()
+                async with slots:
+                    await asyncio.sleep(prefill + self.tokens * self.token_delay)
+                self.stats["completed"] += 1
+                return {"response": "ok " * self.tokens, **final(time.perf_counter() - started)}
+
+            async def stream():
+                started = time.perf_counter()
+                self.stats["active"] += 1
+                finished = False
+                try:
+                    async with slots:
+                        await asyncio.sleep(prefill)
+                        for i in range(self.tokens):
+                            yield json.dumps({"model": body.get("model"), "response": f"t{i} ", "done": False}) + "\n"
+                            await asyncio.sleep(self.token_delay)
+                        yield json.dumps({"response": "", **final(time.perf_counter() - started)}) + "\n"
+                    finished = True
+                finally:
+                    self.stats["active"] -= 1
+                    self.stats["completed" if finished else "aborted"] += 1
+
+            return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+        return app
+
+    def start(self):
+        config = uvicorn.Config(self.app(), host="127.0.0.1", port=self.port, log_level="warning")
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        return self
+
+    def stop(self):
+        self._server.should_exit = True
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    parser.add_argument("--prefill-rate", type=float, default=None, help="每秒處理的 prompt token 數")
+    parser.add_argument("--parallel", type=int, default=None, help="同時生成的請求數上限")
+    args = parser.parse_args()
+    server = FakeOllama(args.tokens, args.token_delay, port=args.port, prefill_rate=args.prefill_rate,
+                        parallel=args.parallel)
+    uvicorn.run(server.app(), host="127.0.0.1", port=args.port, log_level="info")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""AI 分析（AIAnalyzer）：以假 Ollama 伺服器驗證串流、快取、map-reduce 與 prompt 預算"""
+
+import asyncio
+import random
+import time
+from collections import Counter
+
+import pytest
+
+from analyzer import AIAnalyzer
+from database import AnalysisCache
+from fake_ollama import FakeOllama
+from metrics import LLM_TIME_TO_FIRST_TOKEN_SECONDS, LLM_TOKENS
+from prompt import build_prompt, build_reduce_prompt, device_value, estimate_tokens, _vendor
+
+DEVICES = [
+    {"ip": f"192.168.{net}.{i}", "mac": f"aa:bb:cc:00:{net:02x}:{i:02x}", "vendor": "Apple, Inc.",
+     "hostname": None, "ports": []}
+    for net in (1, 2, 3) for i in range(1, 5)
+]
+
+
+def sample_network(count, rng):
+    """模擬網路：常見廠商加上少數未知廠商、隨機 MAC 與開放埠的裝置"""
+    devices = []
+    for i in range(count):
+        devices.append({
+            "ip": f"192.168.1.{i + 1}",
+            "mac": f"aa:bb:cc:00:{i // 256:02x}:{i % 256:02x}",
+            "vendor": rng.choice(["Apple, Inc.", "Intel Corporate", "TP-LINK"]),
+            "hostname": rng.choice([None, f"host-{i}"]),
+            "ports": [{"port": p, "service": "X"} for p in (22, 80, 443) if rng.random() < 0.3],
+        })
+    for d in rng.sample(devices, max(1, count // 20)):
+        d["vendor"] = "Unknown Vendor"
+    for d in rng.sample(devices, max(1, count // 20)):
+        d["mac"] = "da" + d["mac"][2:]
+    return devices
+
+
+@pytest.fixture
+def ollama():
+    with FakeOllama(tokens=5, token_delay=0, first_token_delay=0) as server:
+        yield server
+
+
+@pytest.fixture
+def cache(db):
+    return AnalysisCache(db)
+
+
+async def collect(stream):
+    return [chunk async for chunk in stream]
+
+
+def responses(chunks):
+    return "".join(chunk["response"] for chunk in chunks if "response" in chunk)
+
+
+def test_stream_yields_tokens_and_caches_the_complete_response(ollama, cache):
+    analyzer = AIAnalyzer(model="fake", host=ollama.url, cache=cache)
+    chunks = asyncio.run(collect(analyzer.analyze_network_astream(DEVICES)))
+
+    assert "thinking" in chunks[0]
+    assert [c["response"] for c in chunks if "response" in c] == ["t0 ", "t1 ", "t2 ", "t3 ", "t4 "]
+
+    cached = asyncio.run(collect(analyzer.analyze_network_astream(DEVICES)))
+    assert cached == [{"response": "t0 t1 t2 t3 t4 ", "cached": True}]
+    assert ollama.stats["requests"] == 1
+
+
+def test_stream_records_time_to_first_token():
+    model = "fake-ttft"
+    with FakeOllama(tokens=3, token_delay=0, first_token_delay=0.05) as server:
+        analyzer = AIAnalyzer(model=model, host=server.url)
+        asyncio.run(collect(analyzer.analyze_network_astream(DEVICES)))
+
+    counts, total = LLM_TIME_TO_FIRST_TOKEN_SECONDS._series[(model,)]
+    assert sum(counts) == 1
+    assert 0.05 <= total < 5
+    assert LLM_TOKENS._series[(model, "completion")] == 3
+    assert LLM_TOKENS._series[(model, "prompt")] > 0
+
+
+def test_stopping_the_stream_closes_it_without_caching(cache):
+    with FakeOllama(tokens=200, token_delay=0.01, first_token_delay=0) as server:
+        analyzer = AIAnalyzer(model="fake", host=server.url, cache=cache)
+
+        async def stop_after_first_token():
+            stream = analyzer.analyze_network_astream(DEVICES)
+            async for chunk in stream:
+                if "response" in chunk:
+                    break
+            await stream.aclose()
+            # 連線在 event loop 的下一輪才真正關閉，因此在同一個 loop 中等待伺服器看到中斷
+            deadline = time.monotonic() + 5
+            while server.stats["aborted"] == 0 and time.monotonic() < deadline:
+                await asyncio.sleep(0.01)
+            return chunk
+
+        assert asyncio.run(stop_after_first_token()) == {"response": "t0 "}
+        assert server.stats["aborted"] == 1
+        assert server.stats["completed"] == 0
+
+    assert cache.stats()["entries"] == 0
+
+
+def test_sync_stream_matches_async_stream(ollama):
+    analyzer = AIAnalyzer(model="fake", host=ollama.url)
+    chunks = list(analyzer.analyze_network_stream(DEVICES))
+    assert responses(chunks) == "t0 t1 t2 t3 t4 "
+
+
+def test_mapreduce_merges_shard_findings_and_caches(ollama, cache):
+    analyzer = AIAnalyzer(model="fake", host=ollama.url, cache=cache, shard_size=4)
+    chunks = asyncio.run(collect(analyzer.analyze_network_mapreduce(DEVICES)))
+
+    shards = [c for c in chunks if "shard" in c]
+    assert sorted(c["label"] for c in shards) == ["192.168.1.0/24", "192.168.2.0/24", "192.168.3.0/24"]
+    assert all(c["shards"] == 3 and c["findings"].startswith("ok") for c in shards)
+    assert responses(chunks) == "t0 t1 t2 t3 t4 "
+    # 3 個分片加上 1 次合併
+    assert ollama.stats["requests"] == 4
+    assert all(f"[{c['label']}]" in ollama.prompts[-1] for c in shards)
+
+    cached = asyncio.run(collect(analyzer.analyze_network_mapreduce(DEVICES)))
+    assert cached == [{"response": "t0 t1 t2 t3 t4 ", "cached": True}]
+    assert ollama.stats["requests"] == 4
+
+
+def test_mapreduce_partial_shard_failure_is_not_cached(ollama, cache):
+    ollama.fail = lambda prompt: "part (192.168.2.0/24)" in prompt
+    analyzer = AIAnalyzer(model="fake", host=ollama.url, cache=cache, shard_size=4)
+    chunks = asyncio.run(collect(analyzer.analyze_network_mapreduce(DEVICES)))
+
+    failed = [c for c in chunks if "shard" in c and c["label"] == "192.168.2.0/24"]
+    assert failed and failed[0]["findings"].startswith("Error during analysis")
+    # 其餘分片仍然合併成報告，但報告不完整，不寫入快取
+    assert responses(chunks) == "t0 t1 t2 t3 t4 "
+    assert "[192.168.2.0/24]" not in ollama.prompts[-1]
+    assert "[192.168.1.0/24]" in ollama.prompts[-1]
+    assert cache.stats()["entries"] == 0
+
+    asyncio.run(collect(analyzer.analyze_network_mapreduce(DEVICES)))
+    assert ollama.stats["requests"] == 8
+
+
+def test_mapreduce_with_every_shard_failing_reports_the_error(ollama, cache):
+    ollama.fail = lambda prompt: True
+    analyzer = AIAnalyzer(model="fake", host=ollama.url, cache=cache, shard_size=4)
+    chunks = asyncio.run(collect(analyzer.analyze_network_mapreduce(DEVICES)))
+
+    assert responses(chunks).startswith("Error during analysis")
+    # 沒有任何發現時不送出合併請求
+    assert ollama.stats["requests"] == 3
+    assert cache.stats()["entries"] == 0
+
+
+def test_prompt_over_budget_keeps_the_most_valuable_devices():
+    devices = sample_network(200, random.Random(1))
+    prompt, info = build_prompt(devices, token_budget=300)
+
+    assert info["devices"] == 200
+    assert 0 < info["included"] < 200
+    assert f"(+{200 - info['included']} lower-priority hosts omitted" in prompt
+    assert info["tokens"] <= 300 + estimate_tokens(build_prompt([])[0])
+
+    listed = {line.split(" ", 1)[0] for line in prompt.splitlines()}
+    included = [d for d in devices if d["ip"] in listed]
+    dropped = [d for d in devices if d["ip"] not in listed]
+    assert len(included) == info["included"]
+    vendor_counts = Counter(_vendor(d) for d in devices)
+    assert min(device_value(d, vendor_counts) for d in included) >= \
+        max(device_value(d, vendor_counts) for d in dropped)
+
+
+def test_analyzer_sends_the_budgeted_prompt(ollama):
+    devices = sample_network(200, random.Random(1))
+    asyncio.run(AIAnalyzer(model="fake", host=ollama.url, token_budget=300).analyze_network_async(devices))
+    asyncio.run(AIAnalyzer(model="fake", host=ollama.url, token_budget=None).analyze_network_async(devices))
+
+    budgeted, full = ollama.prompts
+    assert "lower-priority hosts omitted" in budgeted
+    assert "omitted" not in full
+    assert estimate_tokens(budgeted) < estimate_tokens(full)
+
+
+def test_reduce_prompt_truncates_findings_evenly():
+    findings = [(f"part {i}", "suspicious device found " * 100) for i in range(4)]
+    prompt = build_reduce_prompt(findings, total=400, token_budget=100)
+
+    sections = prompt.split("[part ")[1:]
+    assert len(sections) == 4
+    assert all(" ..." in section for section in sections)
+    assert estimate_tokens(prompt) < estimate_tokens(build_reduce_prompt(findings, total=400))
+    assert estimate_tokens(prompt) <= 100 + estimate_tokens(build_reduce_prompt([], total=400)) + 4 * 10
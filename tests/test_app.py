@@ -0,0 +1,45 @@
+import os
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+from conftest import SEEDED_DEVICE
+
+SRC = Path(__file__).resolve().parent.parent / "src"
+
+
+def test_import_has_no_io(tmp_path):
+    """import app 不應開啟資料庫或建立任何檔案"""
+    path = tmp_path / "whodis.db"
+    code = f"import database; database.DB_PATH = {str(path)!r}; import app"
+    env = dict(os.environ, PYTHONPATH=str(SRC))
+    subprocess.run([sys.executable, "-c", code], cwd=tmp_path, env=env, check=True, timeout=60)
+    assert not path.exists()
+
+
+def test_startup_opens_storage_and_remembers_last_scan(app_client):
+    app, client = app_client
+    assert app.scanner.cache is not None
+    assert app.analyzer.cache is not None
+    assert app.scanner.sweeper._known[SEEDED_DEVICE["ip"]] == SEEDED_DEVICE["mac"]
+    assert client.get("/api/history").json()["history"][0]["device_count"] == 1
+
+
+def test_cache_stats_query_runs_off_the_event_loop(app_client, monkeypatch):
+    app, client = app_client
+    cache = app.get_analysis_cache()
+    threads = []
+    stats = cache.stats
+
+    def recording_stats():
+        threads.append(threading.current_thread())
+        return stats()
+
+    monkeypatch.setattr(cache, "stats", recording_stats)
+    body = client.get("/api/cache/stats").json()
+    assert body["analysis"]["entries"] == 0
+    assert "size" in body
+    # TestClient 的 event loop 在自己的執行緒中；統計查詢應在另一個工作執行緒
+    loop_thread = client.portal.call(threading.current_thread)
+    assert threads and threads[0] is not loop_thread
@@ -0,0 +1,198 @@
+"""掃描差異（diff_devices、scan_diffs）與上線區間（host_presence）"""
+
+import random
+
+import pytest
+
+from database import _rebuild_presence, diff_devices
+
+
+def device(n, ip=None, hostname=None, ports=(), mac=None):
+    return {
+        "ip": ip or f"192.168.1.{n}",
+        "mac": mac or f"aa:bb:cc:00:00:{n:02x}",
+        "vendor": "Vendor",
+        "hostname": hostname,
+        "ports": [{"port": p, "service": f"Port-{p}"} for p in ports],
+    }
+
+
+def test_diff_devices_matches_by_mac():
+    old = [device(1), device(2), device(3, ports=[22, 80])]
+    new = [
+        device(1, mac="AA:BB:CC:00:00:01"),  # 只有大小寫不同，視為同一台
+        device(3, ip="192.168.1.30", hostname="nas", ports=[80, 443]),
+        device(4),
+    ]
+    diff = diff_devices(old, new)
+    assert [d["mac"] for d in diff["added"]] == ["aa:bb:cc:00:00:04"]
+    assert [d["mac"] for d in diff["removed"]] == ["aa:bb:cc:00:00:02"]
+    assert diff["changed"] == [{
+        "mac": "aa:bb:cc:00:00:03",
+        "ip": "192.168.1.30",
+        "hostname": "nas",
+        "changes": {
+            "ip": {"old": "192.168.1.3", "new": "192.168.1.30"},
+            "hostname": {"old": None, "new": "nas"},
+            "ports": {"opened": [{"port": 443, "service": "Port-443"}], "closed": [{"port": 22, "service": "Port-22"}]},
+        },
+    }]
+
+
+def test_diff_devices_ignores_ports_when_not_comparable():
+    diff = diff_devices([device(1, ports=[22])], [device(1)], compare_ports=False)
+    assert diff == {"added": [], "removed": [], "changed": []}
+
+
+def test_quick_scan_diff_does_not_report_ports(db):
+    db.save_scan([device(1, ports=[22])], "192.168.1.0/24", deep_scan=True)
+    scan_id = db.save_scan([device(1)], "192.168.1.0/24", deep_scan=False)
+    diff = db.get_scan_diff(scan_id)
+    assert (diff["added"], diff["removed"], diff["changed"]) == ([], [], [])
+
+
+def test_mac_moving_to_new_ip(db):
+    first = db.save_scan([device(1), device(2)], "192.168.1.0/24", deep_scan=True)
+    second = db.save_scan([device(1, ip="192.168.1.2"), ], "192.168.1.0/24", deep_scan=True)
+    diff = db.get_scan_diff(second)
+    assert diff["base_scan_id"] == first
+    assert [d["mac"] for d in diff["removed"]] == ["aa:bb:cc:00:00:02"]
+    assert diff["changed"][0]["changes"] == {"ip": {"old": "192.168.1.1", "new": "192.168.1.2"}}
+    # 屬性版本：舊掃描仍看到當時的 IP
+    assert db.get_scan_details(first)["devices"][0]["ip"] == "192.168.1.1"
+
+
+def test_diffs_are_per_subnet(db):
+    a1 = db.save_scan([device(1)], "192.168.1.0/24")
+    db.save_scan([device(9, ip="10.0.0.9")], "10.0.0.0/24")
+    a2 = db.save_scan([device(1), device(2)], "192.168.1.0/24")
+    diff = db.get_scan_diff(a2)
+    assert diff["base_scan_id"] == a1
+    assert [d["mac"] for d in diff["added"]] == ["aa:bb:cc:00:00:02"]
+
+
+def test_deleting_middle_scan_rebases_diff(db):
+    first = db.save_scan([device(1), device(2, ports=[22])], "192.168.1.0/24", deep_scan=True)
+    middle = db.save_scan([device(1)], "192.168.1.0/24", deep_scan=True)
+    last = db.save_scan([device(1), device(2, ports=[22, 80])], "192.168.1.0/24", deep_scan=True)
+    assert [d["mac"] for d in db.get_scan_diff(last)["added"]] == ["aa:bb:cc:00:00:02"]
+
+    db.delete_scan(middle)
+    diff = db.get_scan_diff(last)
+    assert diff["base_scan_id"] == first
+    assert diff["added"] == [] and diff["removed"] == []
+    assert diff["changed"][0]["changes"] == {"ports": {"opened": [{"port": 80, "service": "Port-80"}], "closed": []}}
+
+
+def test_deleting_first_scan_clears_base(db):
+    first = db.save_scan([device(1)], "192.168.1.0/24")
+    second = db.save_scan([device(1), device(2)], "192.168.1.0/24")
+    db.delete_scan(first)
+    diff = db.get_scan_diff(second)
+    assert diff["base_scan_id"] is None
+    assert (diff["added"], diff["removed"], diff["changed"]) == ([], [], [])
+
+
+def presence(db):
+    """{mac: [(first_scan, last_scan), ...]}"""
+    rows = db._connect().execute("""
+        SELECT h.mac, p.first_scan, p.last_scan FROM host_presence p JOIN hosts h ON h.id = p.host_id
+        ORDER BY h.mac, p.first_scan
+    """)
+    intervals = {}
+    for row in rows:
+        intervals.setdefault(row["mac"], []).append((row["first_scan"], row["last_scan"]))
+    return intervals
+
+
+def test_presence_extends_and_splits(db):
+    s1 = db.save_scan([device(1), device(2)], "192.168.1.0/24")
+    s2 = db.save_scan([device(1)], "192.168.1.0/24")
+    s3 = db.save_scan([device(1), device(2)], "192.168.1.0/24")
+    assert presence(db) == {
+        "aa:bb:cc:00:00:01": [(s1, s3)],
+        "aa:bb:cc:00:00:02": [(s1, s1), (s3, s3)],
+    }
+    timeline = db.get_presence_timeline(mac="aa:bb:cc:00:00:02")
+    assert [entry["online"] for entry in timeline] == [True, False]
+
+
+def test_deleting_scan_where_host_was_absent_merges_intervals(db):
+    s1 = db.save_scan([device(1), device(2)], "192.168.1.0/24")
+    s2 = db.save_scan([device(1)], "192.168.1.0/24")
+    s3 = db.save_scan([device(1), device(2)], "192.168.1.0/24")
+    db.delete_scan(s2)
+    assert presence(db) == {"aa:bb:cc:00:00:01": [(s1, s3)], "aa:bb:cc:00:00:02": [(s1, s3)]}
+
+
+def test_deleting_interval_endpoints_shrinks_intervals(db):
+    s1 = db.save_scan([device(1)], "192.168.1.0/24")
+    s2 = db.save_scan([device(1), device(2)], "192.168.1.0/24")
+    s3 = db.save_scan([device(1), device(2)], "192.168.1.0/24")
+    db.delete_scan(s3)
+    db.delete_scan(s1)
+    assert presence(db) == {"aa:bb:cc:00:00:01": [(s2, s2)], "aa:bb:cc:00:00:02": [(s2, s2)]}
+
+
+def expected_diff(db, scan_id):
+    """由兩次掃描的詳細資料重新計算的差異"""
+    conn = db._connect()
+    scan = conn.execute("SELECT subnet, deep_scan FROM scans WHERE id = ?", (scan_id,)).fetchone()
+    base = conn.execute(
+        "SELECT id, deep_scan FROM scans WHERE subnet IS ? AND id < ? ORDER BY id DESC LIMIT 1",
+        (scan["subnet"], scan_id),
+    ).fetchone()
+    if base is None:
+        return None, {"added": [], "removed": [], "changed": []}
+    diff = diff_devices(db.get_scan_details(base["id"])["devices"], db.get_scan_details(scan_id)["devices"],
+                        compare_ports=bool(base["deep_scan"] and scan["deep_scan"]))
+    for entries in diff.values():
+        entries.sort(key=lambda d: d["mac"])
+    return base["id"], diff
+
+
+def assert_consistent(db):
+    """儲存的差異、上線區間與主機的最後出現紀錄，都與從頭重新計算的結果相同"""
+    conn = db._connect()
+    for (scan_id,) in conn.execute("SELECT id FROM scans").fetchall():
+        stored = db.get_scan_diff(scan_id)
+        base_id, diff = expected_diff(db, scan_id)
+        assert stored["base_scan_id"] == base_id
+        assert {k: stored[k] for k in diff} == diff, f"scan {scan_id}"
+
+    before = presence(db)
+    with conn:
+        _rebuild_presence(conn, [row[0] for row in conn.execute("SELECT id FROM hosts")])
+    assert presence(db) == before
+
+    rows = conn.execute("""
+        SELECT h.id, h.last_seen_scan, h.last_deep_scan,
+               (SELECT MAX(scan_id) FROM scan_hosts WHERE host_id = h.id) AS seen,
+               (SELECT MAX(sh.scan_id) FROM scan_hosts sh JOIN scans s ON s.id = sh.scan_id
+                WHERE sh.host_id = h.id AND s.deep_scan = 1) AS deep
+        FROM hosts h
+    """).fetchall()
+    for row in rows:
+        assert (row["last_seen_scan"], row["last_deep_scan"]) == (row["seen"], row["deep"])
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_history_with_deletes_stays_consistent(db, seed):
+    rng = random.Random(seed)
+    subnets = ["192.168.1.0/24", "10.0.0.0/24"]
+    scan_ids = []
+    for _ in range(30):
+        devices = []
+        for n in rng.sample(range(1, 12), rng.randint(0, 8)):
+            devices.append(device(
+                n,
+                ip=f"192.168.1.{n + rng.choice([0, 0, 0, 100])}",
+                hostname=rng.choice([None, f"host-{n}"]),
+                ports=[p for p in (22, 80, 443) if rng.random() < 0.4],
+            ))
+        scan_ids.append(db.save_scan(devices, rng.choice(subnets), deep_scan=rng.random() < 0.6))
+    assert_consistent(db)
+
+    for scan_id in rng.sample(scan_ids, 12):
+        db.delete_scan(scan_id)
+        assert_consistent(db)
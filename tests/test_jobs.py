@@ -0,0 +1,375 @@
+"""掃描協調（ScanCoordinator）與非同步掃描工作（JobStore）"""
+
+import asyncio
+import threading
+
+import pytest
+
+from jobs import CANCELLED, FAILED, SUCCEEDED, JobStore, ScanCoordinator
+from scheduler import PeriodicTask, ScanScheduler
+
+TARGETS = ["192.168.1.0/24"]
+DEVICES = [
+    {"ip": "192.168.1.1", "mac": "aa:bb:cc:00:00:01", "vendor": "Cisco", "hostname": None, "ports": []},
+    {"ip": "192.168.1.2", "mac": "aa:bb:cc:00:00:02", "vendor": "Apple", "hostname": None, "ports": []},
+]
+
+
+class FakeScanner:
+    """scan_iter 的替身：送出第一個裝置後等待 release，之後送出其餘裝置與 done"""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.scans = []
+        self.deepened = []
+        self.saved = []
+        self.fail_deepen = False
+        self.cancelled = False
+
+    def scan_iter(self, targets, deep_scan, progress=None, cancel=None):
+        self.scans.append((targets, deep_scan))
+        self.started.set()
+        yield {"type": "device", "device": DEVICES[0]}
+        if progress is not None:
+            progress({"phase": "sweep", "hosts_found": 1})
+        for _ in range(500):
+            if self.release.wait(0.01):
+                break
+            if cancel is not None and cancel.is_set():
+                self.cancelled = True
+                yield {"type": "cancelled"}
+                return
+        if self.error:
+            yield {"type": "error", "error": self.error}
+            return
+        yield {"type": "device", "device": DEVICES[1]}
+        ports = [{"port": 22, "service": "SSH"}] if deep_scan else []
+        yield {"type": "done", "devices": [dict(d, ports=ports) for d in DEVICES]}
+
+    def add_ports(self, devices):
+        if self.fail_deepen:
+            raise OSError("port scan failed")
+        self.deepened.append(devices)
+        return [dict(d, ports=[{"port": 80, "service": "HTTP"}]) for d in devices]
+
+    async def save(self, devices, targets, deep_scan):
+        self.saved.append((targets, deep_scan, len(devices)))
+        return len(self.saved)
+
+
+@pytest.fixture
+def fake():
+    return FakeScanner()
+
+
+def coordinator(fake):
+    return ScanCoordinator(fake.scan_iter, save=fake.save, deepen=fake.add_ports)
+
+
+async def release_when_started(fake):
+    await asyncio.to_thread(fake.started.wait, 5)
+    # 讓其他請求先加入進行中的掃描
+    await asyncio.sleep(0.05)
+    fake.release.set()
+
+
+def test_concurrent_requests_share_one_scan_and_one_save(fake):
+    scans = coordinator(fake)
+
+    async def main():
+        results = await asyncio.gather(
+            scans.scan(TARGETS), scans.scan(TARGETS), scans.scan(TARGETS), release_when_started(fake),
+        )
+        return results[:3]
+
+    results = asyncio.run(main())
+    assert len(fake.scans) == 1
+    assert fake.saved == [(TARGETS, False, 2)]
+    assert sorted(r["source"] for r in results) == ["joined", "joined", "live"]
+    assert {r["scan_id"] for r in results} == {1}
+
+
+def test_streams_join_the_flight_and_replay_earlier_events(fake):
+    scans = coordinator(fake)
+
+    async def collect():
+        return [event async for event in scans.stream(TARGETS)]
+
+    async def main():
+        first = asyncio.create_task(collect())
+        await asyncio.to_thread(fake.started.wait, 5)
+        await asyncio.sleep(0.05)
+        # 第一個裝置已經送出後才加入的串流也會收到它
+        second = asyncio.create_task(collect())
+        request = asyncio.create_task(scans.scan(TARGETS))
+        await asyncio.sleep(0.05)
+        fake.release.set()
+        return await first, await second, await request
+
+    first, second, request = asyncio.run(main())
+    assert first == second
+    assert [e["type"] for e in first] == ["device", "device", "done"]
+    assert first[-1]["scan_id"] == 1 and len(first[-1]["devices"]) == 2
+    assert request["source"] == "joined"
+    assert len(fake.scans) == 1
+    assert fake.saved == [(TARGETS, False, 2)]
+
+
+def test_stream_reports_save_failures(fake):
+    async def failing_save(devices, targets, deep_scan):
+        raise OSError("disk full")
+
+    scans = ScanCoordinator(fake.scan_iter, save=failing_save)
+    fake.release.set()
+
+    async def main():
+        return [event async for event in scans.stream(TARGETS)]
+
+    events = asyncio.run(main())
+    assert events[-1] == {"type": "error", "error": "Scan failed: disk full"}
+    assert all(e["type"] != "done" for e in events)
+
+
+def test_stream_stops_after_scan_error():
+    fake = FakeScanner(error="Permission denied")
+    fake.release.set()
+    scans = coordinator(fake)
+
+    async def main():
+        return [event async for event in scans.stream(TARGETS)]
+
+    events = asyncio.run(main())
+    assert events[-1] == {"type": "error", "error": "Permission denied"}
+    assert fake.saved == []
+
+
+def test_upgrade_saves_only_the_deep_result(fake):
+    scans = coordinator(fake)
+
+    async def main():
+        quick = asyncio.create_task(scans.scan(TARGETS))
+        await asyncio.to_thread(fake.started.wait, 5)
+        deep = asyncio.create_task(scans.scan(TARGETS, deep_scan=True))
+        await asyncio.sleep(0.05)
+        fake.release.set()
+        return await quick, await deep
+
+    quick, deep = asyncio.run(main())
+    assert len(fake.scans) == 1 and len(fake.deepened) == 1
+    assert fake.saved == [(TARGETS, True, 2)]
+    assert quick["scan_id"] is None and quick["devices"][0]["ports"] == []
+    assert deep["source"] == "upgraded" and deep["scan_id"] == 1
+    assert deep["devices"][0]["ports"] == [{"port": 80, "service": "HTTP"}]
+    assert scans.status()["in_flight"] == []
+
+
+def test_upgraded_stream_sends_port_updates(fake):
+    scans = coordinator(fake)
+
+    async def main():
+        quick = asyncio.create_task(scans.scan(TARGETS))
+        await asyncio.to_thread(fake.started.wait, 5)
+
+        async def collect():
+            return [event async for event in scans.stream(TARGETS, deep_scan=True)]
+
+        deep = asyncio.create_task(collect())
+        await asyncio.sleep(0.05)
+        fake.release.set()
+        await quick
+        return await deep
+
+    events = asyncio.run(main())
+    assert [e["type"] for e in events] == ["device", "device", "update", "update", "done"]
+    assert events[2]["field"] == "ports"
+    assert events[-1]["scan_id"] == 1
+    assert fake.saved == [(TARGETS, True, 2)]
+
+
+def test_failed_upgrade_keeps_the_quick_result(fake):
+    fake.fail_deepen = True
+    scans = coordinator(fake)
+
+    async def main():
+        quick = asyncio.create_task(scans.scan(TARGETS))
+        await asyncio.to_thread(fake.started.wait, 5)
+        deep = asyncio.create_task(scans.scan(TARGETS, deep_scan=True))
+        await asyncio.sleep(0.05)
+        fake.release.set()
+        return await quick, await asyncio.gather(deep, return_exceptions=True)
+
+    quick, (deep,) = asyncio.run(main())
+    assert isinstance(deep, OSError)
+    assert fake.saved == [(TARGETS, False, 2)]
+
+
+def test_recent_result_is_reused_within_max_age(fake):
+    fake.release.set()
+    scans = coordinator(fake)
+
+    async def main():
+        first = await scans.scan(TARGETS, deep_scan=True)
+        return first, await scans.scan(TARGETS, max_age=60)
+
+    first, cached = asyncio.run(main())
+    assert cached["source"] == "cached" and cached["deep_scan"] is True
+    assert cached["scan_id"] == first["scan_id"] == 1
+    assert len(fake.scans) == 1
+
+
+def test_scheduled_scans_join_in_flight_requests(fake):
+    scans = coordinator(fake)
+
+    async def job(deep_scan):
+        result = await scans.scan(TARGETS, deep_scan=deep_scan)
+        return {"scan_id": result["scan_id"], "source": result["source"]}
+
+    scheduler = ScanScheduler(job)
+
+    async def main():
+        request = asyncio.create_task(scans.scan(TARGETS))
+        await asyncio.to_thread(fake.started.wait, 5)
+        scheduled = asyncio.create_task(scheduler.run_once())
+        await asyncio.sleep(0.05)
+        fake.release.set()
+        return await request, await scheduled
+
+    request, scheduled = asyncio.run(main())
+    # 定時掃描直接等待協調器，不建立自己的執行緒池
+    assert scheduler._executor is None
+    scheduler.shutdown()
+    assert scheduled == {"scan_id": 1, "source": "joined"}
+    assert scheduler.status()["last_result"] == scheduled
+    assert len(fake.scans) == 1 and len(fake.saved) == 1
+
+
+def test_periodic_task_runs_sync_jobs_in_its_own_thread():
+    task = PeriodicTask(lambda: threading.current_thread().name, name="retention")
+
+    async def main():
+        return await task.run_once(), await task.run_once()
+
+    assert task._executor is None
+    first, second = asyncio.run(main())
+    task.shutdown()
+    assert first == second and first.startswith("whodis-retention")
+    assert task._executor is None
+
+
+async def wait_for(condition, timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not met")
+
+
+def test_jobs_share_the_scan_with_api_requests(fake):
+    scans = coordinator(fake)
+
+    async def main():
+        jobs = JobStore(scans)
+        job = jobs.submit(TARGETS)
+        events = []
+
+        async def subscribe():
+            async for event in job.events():
+                events.append(event)
+
+        subscriber = asyncio.create_task(subscribe())
+        request = asyncio.create_task(scans.scan(TARGETS))
+        await asyncio.to_thread(fake.started.wait, 5)
+        await wait_for(lambda: job.progress is not None)
+        fake.release.set()
+        await subscriber
+        return job, events, await request
+
+    job, events, request = asyncio.run(main())
+    assert len(fake.scans) == 1
+    assert fake.saved == [(TARGETS, False, 2)]
+    assert job.status == SUCCEEDED and job.started_at is not None
+    assert job.result["scan_id"] == request["scan_id"] == 1
+    assert {job.result["source"], request["source"]} == {"live", "joined"}
+    statuses = [e["status"] for e in events]
+    assert statuses[0] == "queued" and "running" in statuses and statuses[-1] == "succeeded"
+    assert events[-1]["result"]["devices"] == job.result["devices"]
+    assert any(e["progress"] == {"phase": "sweep", "hosts_found": 1} for e in events)
+
+
+def test_cancelling_the_only_job_stops_the_scan(fake):
+    scans = coordinator(fake)
+
+    async def main():
+        jobs = JobStore(scans)
+        job = jobs.submit(TARGETS)
+        await asyncio.to_thread(fake.started.wait, 5)
+        jobs.cancel(job.id)
+        await wait_for(lambda: job.finished)
+        await wait_for(lambda: not scans.status()["in_flight"])
+        return job, scans.status()
+
+    job, status = asyncio.run(main())
+    assert job.status == CANCELLED
+    assert fake.cancelled
+    assert fake.saved == []
+    assert status["abandoned"] == 1
+
+
+def test_cancelling_a_shared_job_keeps_the_scan_running(fake):
+    scans = coordinator(fake)
+
+    async def main():
+        jobs = JobStore(scans)
+        first, second = jobs.submit(TARGETS), jobs.submit(TARGETS)
+        request = asyncio.create_task(scans.scan(TARGETS))
+        await asyncio.to_thread(fake.started.wait, 5)
+        await asyncio.sleep(0.05)
+        jobs.cancel(first.id)
+        await wait_for(lambda: first.finished)
+        fake.release.set()
+        await wait_for(lambda: second.finished)
+        return first, second, await request
+
+    first, second, request = asyncio.run(main())
+    assert first.status == CANCELLED and second.status == SUCCEEDED
+    assert not fake.cancelled
+    assert fake.saved == [(TARGETS, False, 2)]
+    assert second.result["scan_id"] == request["scan_id"] == 1
+
+
+def test_failed_scan_fails_the_job():
+    fake = FakeScanner(error="Permission denied")
+    fake.release.set()
+
+    async def main():
+        jobs = JobStore(coordinator(fake))
+        job = jobs.submit(TARGETS)
+        await job.task
+        return job
+
+    job = asyncio.run(main())
+    assert job.status == FAILED and job.error == "Permission denied"
+    assert fake.saved == []
+
+
+def test_abandoned_upgrade_saves_the_quick_result(fake):
+    scans = coordinator(fake)
+
+    async def main():
+        jobs = JobStore(scans)
+        quick = asyncio.create_task(scans.scan(TARGETS))
+        await asyncio.to_thread(fake.started.wait, 5)
+        deep = jobs.submit(TARGETS, deep_scan=True)
+        await asyncio.sleep(0.05)
+        jobs.cancel(deep.id)
+        await wait_for(lambda: deep.finished)
+        fake.release.set()
+        return await quick, deep
+
+    quick, deep = asyncio.run(main())
+    assert deep.status == CANCELLED
+    assert not fake.cancelled and fake.deepened == []
+    assert fake.saved == [(TARGETS, False, 2)]
+    assert quick["scan_id"] == 1
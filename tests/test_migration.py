@@ -0,0 +1,156 @@
+"""舊版（v0）資料庫遷移到正規化結構後，歷史與詳細資料應與遷移前相同"""
+
+import json
+import shutil
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from database import Database
+
+TRACKED_DB = Path(__file__).resolve().parent.parent / "src" / "whodis.db"
+
+V0_SCHEMA = """
+CREATE TABLE scans (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    scan_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    device_count INTEGER,
+    subnet TEXT,
+    deep_scan INTEGER DEFAULT 0
+);
+CREATE TABLE devices (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    scan_id INTEGER,
+    ip TEXT,
+    mac TEXT,
+    vendor TEXT,
+    hostname TEXT,
+    open_ports TEXT,
+    FOREIGN KEY (scan_id) REFERENCES scans(id)
+);
+"""
+
+
+def legacy_snapshot(path):
+    """以舊版 Database 的查詢讀出所有掃描（遷移前）"""
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    history = [dict(row) for row in conn.execute(
+        "SELECT id, scan_time, device_count, subnet, deep_scan FROM scans ORDER BY scan_time DESC, id DESC"
+    )]
+    details = {}
+    for scan in history:
+        devices = []
+        for row in conn.execute("SELECT ip, mac, vendor, hostname, open_ports FROM devices WHERE scan_id = ?",
+                                (scan["id"],)):
+            device = dict(row)
+            device["ports"] = json.loads(device.pop("open_ports") or "[]")
+            devices.append(device)
+        details[scan["id"]] = dict(scan, devices=devices)
+    conn.close()
+    return history, details
+
+
+def normalized(details):
+    """裝置順序與埠順序不屬於儲存的語意，比較前先排序"""
+    devices = sorted(
+        (dict(d, ports=sorted(d["ports"], key=lambda p: p["port"])) for d in details["devices"]),
+        key=lambda d: (d["mac"], d["ip"]),
+    )
+    return dict(details, devices=devices)
+
+
+def assert_migration_preserves(path):
+    history, details = legacy_snapshot(path)
+    db = Database(path)
+    try:
+        assert db._connect().execute("PRAGMA user_version").fetchone()[0] > 0
+        assert db.get_scan_history(len(history) + 10) == history
+        for scan_id, expected in details.items():
+            assert normalized(db.get_scan_details(scan_id)) == normalized(expected)
+        tables = {row[0] for row in db._connect().execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        assert "devices" not in tables
+    finally:
+        db.close()
+
+
+def test_tracked_database_migrates_without_changes(tmp_path):
+    path = tmp_path / "whodis.db"
+    shutil.copy(TRACKED_DB, path)
+    assert_migration_preserves(path)
+
+
+def port(number, service):
+    return {"port": number, "service": service}
+
+
+# 每次掃描：(scan_time, subnet, deep_scan, 裝置列表)
+V0_SCANS = [
+    ("2024-01-01 10:00:00", "192.168.1.0/24", 1, [
+        {"ip": "192.168.1.1", "mac": "aa:aa:aa:aa:aa:01", "vendor": "Cisco", "hostname": "router",
+         "ports": [port(80, "HTTP"), port(443, "HTTPS")]},
+        {"ip": "192.168.1.10", "mac": "aa:aa:aa:aa:aa:02", "vendor": "Apple", "hostname": None, "ports": []},
+    ]),
+    # 快速掃描：沒有埠資料
+    ("2024-01-01 11:00:00", "192.168.1.0/24", 0, [
+        {"ip": "192.168.1.1", "mac": "aa:aa:aa:aa:aa:01", "vendor": "Cisco", "hostname": "router", "ports": []},
+    ]),
+    # IP、主機名稱與埠變更，主機重新出現
+    ("2024-01-01 12:00:00", "192.168.1.0/24", 1, [
+        {"ip": "192.168.1.1", "mac": "aa:aa:aa:aa:aa:01", "vendor": "Cisco", "hostname": "gw",
+         "ports": [port(22, "SSH"), port(443, "HTTPS")]},
+        {"ip": "192.168.1.11", "mac": "aa:aa:aa:aa:aa:02", "vendor": "Apple", "hostname": "phone",
+         "ports": [port(8080, "HTTP-Proxy")]},
+    ]),
+    # 另一個網段
+    ("2024-01-01 12:30:00", "10.0.0.0/24", 1, [
+        {"ip": "10.0.0.5", "mac": "aa:aa:aa:aa:aa:03", "vendor": "Intel", "hostname": None,
+         "ports": [port(3389, "RDP")]},
+    ]),
+    ("2024-01-01 13:00:00", "192.168.1.0/24", 1, [
+        {"ip": "192.168.1.1", "mac": "aa:aa:aa:aa:aa:01", "vendor": "Cisco", "hostname": "gw",
+         "ports": [port(80, "HTTP"), port(443, "HTTPS")]},
+    ]),
+    # 沒有發現任何裝置的掃描
+    ("2024-01-01 14:00:00", "192.168.1.0/24", 0, []),
+]
+
+
+def test_synthetic_history_migrates_without_changes(tmp_path):
+    path = tmp_path / "v0.db"
+    conn = sqlite3.connect(path)
+    conn.executescript(V0_SCHEMA)
+    for scan_time, subnet, deep_scan, devices in V0_SCANS:
+        scan_id = conn.execute(
+            "INSERT INTO scans (scan_time, device_count, subnet, deep_scan) VALUES (?, ?, ?, ?)",
+            (scan_time, len(devices), subnet, deep_scan),
+        ).lastrowid
+        for d in devices:
+            conn.execute(
+                "INSERT INTO devices (scan_id, ip, mac, vendor, hostname, open_ports) VALUES (?, ?, ?, ?, ?, ?)",
+                (scan_id, d["ip"], d["mac"], d["vendor"], d["hostname"], json.dumps(d["ports"])),
+            )
+    conn.commit()
+    conn.close()
+
+    assert_migration_preserves(path)
+
+
+@pytest.mark.parametrize("source", ["tracked", "synthetic"])
+def test_migrated_database_reopens_cleanly(tmp_path, source):
+    """遷移只執行一次：重新開啟時不再重跑，資料維持不變"""
+    path = tmp_path / "whodis.db"
+    if source == "tracked":
+        shutil.copy(TRACKED_DB, path)
+    else:
+        sqlite3.connect(path).executescript(V0_SCHEMA)
+    db = Database(path)
+    before = db.get_scan_history(100)
+    version = db._connect().execute("PRAGMA user_version").fetchone()[0]
+    db.close()
+
+    db = Database(path)
+    assert db._connect().execute("PRAGMA user_version").fetchone()[0] == version
+    assert db.get_scan_history(100) == before
+    db.close()
@@ -0,0 +1,138 @@
+"""資料保留政策（RetentionManager）"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from repository import AsyncDatabase
+from retention import RetentionManager, RetentionPolicy
+
+NOW = datetime(2026, 6, 1, 12, 0, tzinfo=timezone.utc)
+SUBNET = "192.168.1.0/24"
+
+
+def device(n, ports=()):
+    return {
+        "ip": f"192.168.1.{n}",
+        "mac": f"aa:bb:cc:00:00:{n:02x}",
+        "vendor": "Vendor",
+        "hostname": None,
+        "ports": [{"port": p, "service": f"Port-{p}"} for p in ports],
+    }
+
+
+@pytest.fixture
+def store(db):
+    store = AsyncDatabase(db)
+    yield store
+    store.close()
+
+
+def save(db, devices, age, deep_scan=False, subnet=SUBNET):
+    """儲存一次掃描，掃描時間（與上線區間的起訖時間）設為 NOW 之前 age"""
+    scan_id = db.save_scan(devices, subnet, deep_scan=deep_scan)
+    scan_time = (NOW - age).strftime("%Y-%m-%d %H:%M:%S")
+    conn = db._connect()
+    with conn:
+        conn.execute("UPDATE scans SET scan_time = ? WHERE id = ?", (scan_time, scan_id))
+        conn.execute("UPDATE host_presence SET started_at = ? WHERE first_scan = ?", (scan_time, scan_id))
+        conn.execute("UPDATE host_presence SET ended_at = ? WHERE last_scan = ?", (scan_time, scan_id))
+    return scan_id
+
+
+def run(store, **kwargs):
+    return RetentionManager(store, RetentionPolicy(full_days=1, hourly_days=2, max_days=10), **kwargs).run(NOW)
+
+
+def scan_ids(db):
+    return [row[0] for row in db._connect().execute("SELECT id FROM scans ORDER BY id")]
+
+
+def assert_hosts_consistent(db):
+    """主機的最後出現／最後深度掃描都指向仍存在的掃描"""
+    rows = db._connect().execute("""
+        SELECT h.id, h.last_seen_scan, h.last_deep_scan,
+               (SELECT MAX(scan_id) FROM scan_hosts WHERE host_id = h.id) AS seen,
+               (SELECT MAX(sh.scan_id) FROM scan_hosts sh JOIN scans s ON s.id = sh.scan_id
+                WHERE sh.host_id = h.id AND s.deep_scan = 1) AS deep
+        FROM hosts h
+    """).fetchall()
+    for row in rows:
+        assert (row["last_seen_scan"], row["last_deep_scan"]) == (row["seen"], row["deep"]), f"host {row['id']}"
+
+
+def test_downsamples_older_tiers_and_keeps_latest(db, store):
+    recent = save(db, [device(1)], timedelta(hours=1))
+    hourly = [save(db, [device(1)], timedelta(days=1, hours=5, minutes=m)) for m in (40, 30, 20)]
+    daily = [save(db, [device(1)], timedelta(days=5, hours=h)) for h in (6, 3)]
+    expired = save(db, [device(1)], timedelta(days=20))
+    latest = save(db, [device(1)], timedelta(minutes=1))
+
+    report = run(store)
+
+    assert report["scans_deleted"] == 4
+    remaining = scan_ids(db)
+    assert {recent, latest, hourly[-1], daily[-1]} <= set(remaining)
+    assert expired not in remaining and hourly[0] not in remaining and daily[0] not in remaining
+
+
+def host(db, n):
+    return db._connect().execute(
+        "SELECT last_seen_scan, last_deep_scan FROM hosts WHERE mac = ?", (f"aa:bb:cc:00:00:{n:02x}",)
+    ).fetchone()
+
+
+def test_deleted_scans_do_not_leave_dangling_host_pointers(db, store):
+    # 超過 max_days 的深度掃描全部刪除：主機 1 沒有剩下的深度掃描，主機 2 只出現在過期掃描中
+    save(db, [device(1, ports=[22]), device(2, ports=[22])], timedelta(days=20), deep_scan=True)
+    save(db, [device(1, ports=[22]), device(2, ports=[80])], timedelta(days=19), deep_scan=True)
+    # 同一小時內的深度掃描只保留最後一筆：主機 3 只出現在被降採樣的那一筆
+    save(db, [device(1), device(3, ports=[443])], timedelta(days=1, hours=5, minutes=50), deep_scan=True)
+    deep = save(db, [device(1)], timedelta(days=1, hours=5, minutes=40), deep_scan=True)
+    latest = save(db, [device(1)], timedelta(minutes=1))
+
+    report = run(store)
+
+    assert report["scans_deleted"] == 3
+    assert scan_ids(db) == [deep, latest]
+    assert_hosts_consistent(db)
+    assert tuple(host(db, 1)) == (latest, deep)
+    # 上線區間已過期的主機整個刪除；仍有上線區間的主機保留，但不指向已刪除的掃描
+    assert host(db, 2) is None
+    assert tuple(host(db, 3)) == (None, None)
+    assert db.get_hosts_with_port(443) == []
+
+
+def test_diffs_are_rebased_onto_the_previous_kept_scan(db, store):
+    first = save(db, [device(1)], timedelta(days=1, hours=6, minutes=10))
+    save(db, [device(1), device(2)], timedelta(days=1, hours=5, minutes=40))
+    save(db, [device(1), device(2), device(3)], timedelta(days=1, hours=5, minutes=20))
+    kept = save(db, [device(1), device(3)], timedelta(days=1, hours=5, minutes=10))
+    latest = save(db, [device(3)], timedelta(minutes=1))
+
+    report = run(store)
+
+    assert scan_ids(db) == [first, kept, latest]
+    assert report["diffs_rebased"] == 1
+    diff = db.get_scan_diff(kept)
+    assert diff["base_scan_id"] == first
+    assert [d["mac"] for d in diff["added"]] == ["aa:bb:cc:00:00:03"]
+    assert diff["removed"] == diff["changed"] == []
+    assert db.get_scan_diff(latest)["base_scan_id"] == kept
+    assert_hosts_consistent(db)
+
+
+def test_writes_go_through_the_writer_thread(db, store):
+    for m in range(10):
+        save(db, [device(m + 1)], timedelta(days=1, hours=5, minutes=m + 10))
+    save(db, [device(1)], timedelta(minutes=1))
+    writes = store.stats()["writes"]
+
+    report = run(store, batch_size=3)
+
+    # 9 筆過期掃描分 3 批刪除，加上重新計算差異、壓縮與 vacuum
+    assert report["scans_deleted"] == 9
+    assert store.stats()["writes"] - writes >= 3
+    assert report["hosts"] == 0
+    assert_hosts_consistent(db)
+    assert db._connect().execute("PRAGMA freelist_count").fetchone()[0] == 0
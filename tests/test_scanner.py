@@ -0,0 +1,87 @@
+import asyncio
+import socket
+import threading
+
+import pytest
+
+from oui import VendorResolver
+from scanner import NetworkScanner
+
+
+@pytest.fixture
+def listener():
+    """127.0.0.1 上的一個監聽埠"""
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(("127.0.0.1", 0))
+    s.listen(8)
+    yield s.getsockname()[1]
+    s.close()
+
+
+def closed_port():
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def test_port_scan_without_loop(listener):
+    scanner = NetworkScanner()
+    closed = closed_port()
+    assert scanner.port_scan("127.0.0.1", [listener, closed]) == [{"port": listener, "service": f"Port-{listener}"}]
+
+
+def test_port_scan_inside_running_loop(listener):
+    """在 async handler 中呼叫同步版本不應因 asyncio.run 巢狀而失敗"""
+    scanner = NetworkScanner()
+
+    async def handler():
+        return scanner.port_scan("127.0.0.1", [listener])
+
+    assert asyncio.run(handler()) == [{"port": listener, "service": f"Port-{listener}"}]
+
+
+def test_port_scan_hosts_async(listener):
+    scanner = NetworkScanner()
+    closed = closed_port()
+    results = asyncio.run(scanner.port_scan_hosts_async(["127.0.0.1", "127.0.0.2"], [listener, closed]))
+    assert results == {"127.0.0.1": [{"port": listener, "service": f"Port-{listener}"}], "127.0.0.2": []}
+
+
+class SlowSweeper:
+    """回應一台主機後持續等待，直到被要求停止"""
+
+    def __init__(self):
+        self.stopped = threading.Event()
+
+    def sweep(self, targets, on_reply, on_sent=None, cancel=None):
+        on_reply("127.0.0.1", "aa:bb:cc:00:00:01")
+        if cancel is not None and cancel.wait(5):
+            self.stopped.set()
+
+
+def test_scan_iter_stops_the_scan_when_the_consumer_stops(tmp_path):
+    sweeper = SlowSweeper()
+    scanner = NetworkScanner(sweeper=sweeper)
+    scanner.vendor_resolver = VendorResolver(tmp_path / "oui.tsv", auto_refresh=False)
+
+    events = scanner.scan_iter("127.0.0.0/30")
+    assert next(events)["type"] == "device"
+    events.close()
+
+    assert sweeper.stopped.wait(5)
+
+
+def test_scan_iter_forwards_the_caller_cancel(tmp_path):
+    sweeper = SlowSweeper()
+    scanner = NetworkScanner(sweeper=sweeper)
+    scanner.vendor_resolver = VendorResolver(tmp_path / "oui.tsv", auto_refresh=False)
+    cancel = threading.Event()
+
+    events = scanner.scan_iter("127.0.0.0/30", cancel=cancel)
+    assert next(events)["type"] == "device"
+    cancel.set()
+
+    assert [e["type"] for e in events if e["type"] != "update"] == ["cancelled"]
+    assert sweeper.stopped.is_set()
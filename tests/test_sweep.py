@@ -0,0 +1,82 @@
+import socket
+
+from scapy.all import ARP, Ether
+
+from fake_arp import FakeTransport
+from sweep import ArpSweeper, is_reply_to
+
+LOCAL_IP = "192.168.1.2"
+LOCAL_MAC = "02:00:00:00:00:01"
+
+
+class ChattyTransport(FakeTransport):
+    """每個請求除了正確的回應，還會收到同一個廣播域中目標網段外主機的回應"""
+
+    def __init__(self, lan, stray):
+        super().__init__(lan)
+        self.stray = stray
+
+    def open(self, on_reply):
+        self.on_reply = on_reply
+
+    def send(self, frame):
+        ip = socket.inet_ntoa(frame[38:42])
+        if ip in self.lan.hosts:
+            self.on_reply(ip, self.lan.hosts[ip])
+        self.on_reply(*self.stray)
+
+    def close(self):
+        pass
+
+
+class Lan:
+    def __init__(self, hosts):
+        self.hosts = hosts
+
+
+def sweep(targets, hosts, stray):
+    sweeper = ArpSweeper(timeout=0.2, idle_timeout=0.05, retries=1,
+                         transport_factory=lambda iface: ChattyTransport(Lan(hosts), stray))
+    found = {}
+    sweeper.sweep(targets, lambda ip, mac: found.setdefault(ip, mac))
+    return sweeper, found
+
+
+def test_replies_outside_target_are_ignored():
+    hosts = {"10.99.0.5": "02:00:00:00:00:05"}
+    sweeper, found = sweep("10.99.0.0/28", hosts, ("10.99.0.100", "02:00:00:00:00:64"))
+    assert found == hosts
+    assert "10.99.0.100" not in sweeper._known
+
+
+def test_known_hosts_outside_target_are_not_retried():
+    sent = []
+
+    class Recording(ChattyTransport):
+        def send(self, frame):
+            sent.append(socket.inet_ntoa(frame[38:42]))
+            super().send(frame)
+
+    sweeper = ArpSweeper(timeout=0.2, idle_timeout=0.05, retries=1,
+                         transport_factory=lambda iface: Recording(Lan({}), ("10.99.0.100", "02:00:00:00:00:64")))
+    sweeper.remember([("10.99.0.100", "02:00:00:00:00:64")])
+    sweeper.sweep("10.99.0.0/28", lambda ip, mac: None)
+    assert "10.99.0.100" not in sent
+
+
+def reply(op=2, psrc="192.168.1.10", pdst=LOCAL_IP, hwdst=LOCAL_MAC):
+    return Ether(dst=hwdst) / ARP(op=op, psrc=psrc, hwsrc="aa:bb:cc:dd:ee:ff", pdst=pdst, hwdst=hwdst)
+
+
+def test_reply_to_local_request_is_accepted():
+    assert is_reply_to(reply(), LOCAL_IP, LOCAL_MAC)
+    assert is_reply_to(reply(hwdst=LOCAL_MAC.upper()), LOCAL_IP, LOCAL_MAC)
+
+
+def test_requests_gratuitous_and_foreign_replies_are_rejected():
+    assert not is_reply_to(reply(op=1), LOCAL_IP, LOCAL_MAC)
+    # gratuitous ARP：目標位址是發送者自己
+    assert not is_reply_to(reply(pdst="192.168.1.10", hwdst="ff:ff:ff:ff:ff:ff"), LOCAL_IP, LOCAL_MAC)
+    # 回覆其他主機的請求
+    assert not is_reply_to(reply(pdst="192.168.1.3", hwdst="02:00:00:00:00:03"), LOCAL_IP, LOCAL_MAC)
+    assert not is_reply_to(Ether() / b"not arp", LOCAL_IP, LOCAL_MAC)